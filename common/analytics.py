@@ -0,0 +1,254 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from common import artifacts
+from common import retention
+
+# Flat table of every experiment (one row per platform, sample and try of a sweep), kept in SQLite
+# so platforms can be compared across sweeps without walking result_list.json and the result files.
+# Usage: python -m common.analytics --backfill
+#        python -m common.analytics --group-by platform sample --metrics training_time_ms --last 5
+
+DB_PATH = 'analytics.sqlite'
+RESULT_LIST_PATH = 'result_list.json'
+
+# Columns of the experiments table; metrics are in milliseconds / MB as stored in the results
+DIMENSIONS = ['model', 'result_item_id', 'try', 'platform', 'sample', 'sample_pct', 'type', 'dtype', 'stop_reason']
+METRICS = ['training_time_ms', 'inference_time_ms', 'duration_ms', 'mse', 'r2', 'loss', 'accuracy',
+           'peak_rss_mb', 'stopped_epoch']
+AGGREGATES = {'avg': 'AVG', 'min': 'MIN', 'max': 'MAX', 'sum': 'SUM', 'count': 'COUNT'}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS experiments (
+    result_path TEXT PRIMARY KEY,
+    model TEXT, result_item_id INTEGER, try INTEGER, platform TEXT, sample TEXT, sample_pct REAL,
+    type TEXT, dtype TEXT, stop_reason TEXT, start TEXT, "end" TEXT,
+    {', '.join(f'{metric} REAL' for metric in METRICS)},
+    ingested_at TEXT
+);
+CREATE INDEX IF NOT EXISTS experiments_sweep ON experiments (result_item_id);
+CREATE INDEX IF NOT EXISTS experiments_platform_sample ON experiments (platform, sample_pct);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Writes from the server's request threads are serialized, the first-use backfill included
+# (reentrant: ingest connects while holding it)
+write_lock = threading.RLock()
+
+def connect(db_path=DB_PATH):
+    """
+    Opens the analytics database, creating the table and backfilling it from result_list.json.
+    The backfill is recorded in the meta table once it completes, and tried again on every
+    connect until then (e.g. after it failed partway).
+    """
+    # Held until the backfill is done, so no other thread ingests into or queries a half-filled table
+    with write_lock:
+        connection = sqlite3.connect(db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')  # readers do not block the writer
+            connection.executescript(SCHEMA)
+            backfilled = connection.execute("SELECT value FROM meta WHERE key = 'backfilled'").fetchone()
+            if backfilled is None and os.path.exists(RESULT_LIST_PATH):
+                backfill(RESULT_LIST_PATH, connection)
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfilled', ?)",
+                                       (datetime.now(timezone.utc).isoformat(),))
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+    except (TypeError, ValueError):
+        return None
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def flatten(experiment, results):
+    """
+    Returns the row of an experiment: its metadata and the scalar metrics of its results.
+    """
+    results = results or {}
+    result_path = artifacts.logical_name(experiment['result_path'])
+    start, end = _parse_time(experiment.get('start')), _parse_time(experiment.get('end'))
+    sample = experiment.get('sample')
+    try:
+        sample_pct = float(str(sample).rstrip('%'))
+    except ValueError:
+        sample_pct = None
+    convergence = results.get('convergence') or {}
+
+    row = {
+        'result_path': result_path,
+        'model': result_path.split('/')[0],
+        'result_item_id': experiment.get('result_item_id'),
+        'try': experiment.get('try'),
+        'platform': experiment.get('platform'),
+        'sample': sample,
+        'sample_pct': sample_pct,
+        'type': experiment.get('type'),
+        'dtype': results.get('dtype'),
+        'stop_reason': convergence.get('stop_reason'),
+        'start': experiment.get('start'),
+        'end': experiment.get('end'),
+        'duration_ms': (end - start).total_seconds() * 1000 if start and end else None,
+        'stopped_epoch': _number(convergence.get('stopped_epoch')),
+        'ingested_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+    }
+    for metric in METRICS:
+        if metric not in row:
+            row[metric] = _number(results.get(metric))
+    return row
+
+def _upsert(connection, rows):
+    columns = list(rows[0])
+    placeholders = ', '.join('?' for _ in columns)
+    quoted = ', '.join(f'"{column}"' for column in columns)
+    connection.executemany(f'INSERT OR REPLACE INTO experiments ({quoted}) VALUES ({placeholders})',
+                           [[row[column] for column in columns] for row in rows])
+
+def ingest(experiment, results, db_path=DB_PATH):
+    """
+    Adds (or replaces) one experiment, called when it is appended to the result list.
+    """
+    with write_lock:
+        connection = connect(db_path)
+        try:
+            with connection:
+                _upsert(connection, [flatten(experiment, results)])
+        finally:
+            connection.close()
+
+def read_results(result_path):
+    """
+    Reads a result file, on disk or in its sweep's archive (see common/retention.py), without its arrays.
+    """
+    try:
+        return artifacts.read_json(result_path, resolve_arrays=False)
+    except FileNotFoundError:
+        pass
+    for candidate in artifacts.variants(result_path):
+        archived = retention.locate(candidate)
+        if archived:
+            with artifacts.decompressing_reader(retention.open_member(archived[0], archived[1]),
+                                                artifacts.compression_of(candidate), candidate) as file:
+                return json.load(file)
+    raise FileNotFoundError(result_path)
+
+def backfill(result_list_path=RESULT_LIST_PATH, connection=None):
+    """
+    Ingests every experiment of result_list.json, reading the metrics from its result file
+    (archived ones included). Experiments whose result file is missing are ingested with their metadata only.
+    """
+    with open(result_list_path, 'r') as f:
+        result_list = json.load(f)
+
+    rows = []
+    for item in result_list:
+        for experiment in item.get('experiments') or []:
+            try:
+                results = read_results(experiment['result_path'])
+            except (OSError, ValueError):
+                results = None
+            rows.append(flatten(experiment, results))
+
+    with write_lock:
+        close = connection is None
+        connection = connection or connect()
+        try:
+            if rows:
+                with connection:
+                    _upsert(connection, rows)
+        finally:
+            if close:
+                connection.close()
+    return len(rows)
+
+def _columns(names, allowed, kind):
+    for name in names:
+        if name not in allowed:
+            raise ValueError(f"Unknown {kind} '{name}', expected one of {allowed}")
+    return names
+
+def query(group_by=('platform', 'sample'), metrics=('training_time_ms',), aggregate='avg', last=None,
+          filters=None, db_path=DB_PATH):
+    """
+    Aggregates metrics grouped by dimensions, e.g. mean training time (ms) by platform and sample,
+    over the last `last` sweeps (result items) when given. filters maps dimensions to required values.
+    """
+    group_by = _columns(list(group_by), DIMENSIONS, 'dimension')
+    metrics = _columns(list(metrics), METRICS, 'metric')
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate '{aggregate}', expected one of {list(AGGREGATES)}")
+
+    conditions, parameters = [], []
+    for dimension, value in (filters or {}).items():
+        _columns([dimension], DIMENSIONS, 'dimension')
+        conditions.append(f'"{dimension}" = ?')
+        parameters.append(value)
+    if last:
+        conditions.append('result_item_id IN (SELECT DISTINCT result_item_id FROM experiments'
+                          + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                          + ' ORDER BY result_item_id DESC LIMIT ?)')
+        parameters = parameters + parameters + [int(last)]
+
+    selected = [f'"{dimension}"' for dimension in group_by]
+    selected += [f'{AGGREGATES[aggregate]}({metric}) AS {metric}' for metric in metrics]
+    selected += ['COUNT(*) AS n']
+    sql = 'SELECT ' + ', '.join(selected) + ' FROM experiments'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    if group_by:
+        quoted = ', '.join(f'"{dimension}"' for dimension in group_by)
+        order = quoted.replace('"sample"', 'sample_pct')  # 10%, 50%, 100% rather than text order
+        sql += f' GROUP BY {quoted} ORDER BY {order}'
+
+    connection = connect(db_path)
+    try:
+        return [dict(row) for row in connection.execute(sql, parameters)]
+    finally:
+        connection.close()
+
+def query_from_params(query_params):
+    """
+    Runs a query from /api/query parameters: group_by and metrics (comma separated), agg, last,
+    and any dimension as a filter (e.g. model=neural_network).
+    """
+    def values(name, default):
+        value = query_params.get(name, [default])[0]
+        return [part for part in value.split(',') if part] if value else []
+
+    filters = {dimension: query_params[dimension][0] for dimension in DIMENSIONS
+               if query_params.get(dimension, [''])[0] != ''}
+    last = query_params.get('last', [None])[0]
+    return query(values('group_by', 'platform,sample'), values('metrics', 'training_time_ms'),
+                 query_params.get('agg', ['avg'])[0], int(last) if last else None, filters)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the experiments of all sweeps.")
+    parser.add_argument('--backfill', action='store_true', help="(re)ingest every experiment of result_list.json")
+    parser.add_argument('--group-by', nargs='*', default=['platform', 'sample'])
+    parser.add_argument('--metrics', nargs='+', default=['training_time_ms'])
+    parser.add_argument('--agg', choices=list(AGGREGATES), default='avg')
+    parser.add_argument('--last', type=int, default=None, help="only the last N sweeps")
+    parser.add_argument('--model', default=None)
+    args = parser.parse_args()
+
+    if args.backfill:
+        connection = connect()
+        print(f"Ingested {backfill(RESULT_LIST_PATH, connection)} experiments into {DB_PATH}")
+        connection.close()
+    filters = {'model': args.model} if args.model else None
+    for row in query(args.group_by, args.metrics, args.agg, args.last, filters):
+        print(json.dumps(row))
+
+if __name__ == '__main__':
+    main()
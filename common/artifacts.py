@@ -0,0 +1,270 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+# Result artifacts (training_result/**) are written compact, compressed and atomically.
+# The compression is chosen with ARTIFACT_COMPRESSION: gzip (default), zstd or none.
+# zstd needs the zstandard package and orjson is used for encoding when installed;
+# without them the writer falls back to gzip and the standard json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION = os.environ.get('ARTIFACT_COMPRESSION', 'gzip')
+LEVELS = {'gzip': int(os.environ.get('ARTIFACT_GZIP_LEVEL', 3)), 'zstd': int(os.environ.get('ARTIFACT_ZSTD_LEVEL', 3))}
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+CONTENT_ENCODINGS = {'gzip': 'gzip', 'zstd': 'zstd'}
+
+# Large numeric arrays of a result (e.g. per-row features and predictions) are stored as .npy files
+# next to it, result.json keeping {"$npy": "<file>", "shape": [...], "dtype": ...} in their place
+ARRAY_THRESHOLD = int(os.environ.get('ARTIFACT_ARRAY_THRESHOLD', 10000))
+
+def resolve_compression(compression=None):
+    """
+    Returns the compression to write with: none, gzip or zstd (gzip when zstandard is not installed).
+    """
+    compression = compression or COMPRESSION
+    if compression in ('none', '', None):
+        return 'none'
+    if compression == 'zstd' and zstandard is None:
+        return 'gzip'
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown artifact compression '{compression}', expected none, gzip or zstd")
+    return compression
+
+def compression_of(path):
+    for compression, extension in EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+    return 'none'
+
+def logical_name(path):
+    """
+    Returns the path without its compression extension, e.g. result.json.gz -> result.json.
+    """
+    extension = EXTENSIONS.get(compression_of(path))
+    return path[:-len(extension)] if extension else path
+
+def is_json(path):
+    """
+    True for result.json as well as its compressed variants.
+    """
+    return logical_name(path).endswith('.json')
+
+def variants(location):
+    # Every file an artifact may be stored as, uncompressed first
+    location = logical_name(location)
+    return [location] + [location + extension for extension in EXTENSIONS.values()]
+
+def find(location):
+    """
+    Returns the existing file of an artifact (location, location.gz or location.zst), or None.
+    """
+    for path in variants(location):
+        if os.path.exists(path):
+            return path
+    return None
+
+def _open_writer(file, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='wb', compresslevel=LEVELS['gzip'], mtime=0)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=LEVELS['zstd']).stream_writer(file, closefd=False)
+    return file
+
+def open_artifact(path):
+    """
+    Opens an artifact for binary reading, decompressing it by its extension.
+    """
+    return decompressing_reader(open(path, 'rb'), compression_of(path), path)
+
+def decompressing_reader(file, compression, name=None):
+    """
+    Wraps a binary file object (e.g. an archive member) to read it decompressed; closing it closes file.
+    """
+    if compression == 'gzip':
+        reader = gzip.GzipFile(fileobj=file, mode='rb')
+        close = reader.close
+
+        def close_both():
+            close()
+            file.close()
+        reader.close = close_both
+        return reader
+    if compression == 'zstd':
+        if zstandard is None:
+            file.close()
+            raise RuntimeError(f"Reading {name or 'a zstd artifact'} needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(file, closefd=True)
+    return file
+
+def _write(location, compression, write):
+    """
+    Streams an artifact through the compressor into a temporary file next to it and renames
+    it into place, so readers never see a partial file. Other variants of the same artifact
+    (e.g. an older uncompressed result) are removed. Returns the path written.
+    """
+    compression = resolve_compression(compression)
+    location = logical_name(location)
+    path = location + EXTENSIONS.get(compression, '')
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            writer = _open_writer(file, compression)
+            write(writer)
+            if writer is not file:
+                writer.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    for other in variants(location):
+        if other != path and os.path.exists(other):
+            os.remove(other)
+    return path
+
+def write_json(location, data, compression=None):
+    """
+    Writes data as compact JSON (orjson when installed, no indentation). Returns the path written.
+    """
+    def write(writer):
+        # Encoded in one call: the one-shot C encoders are several times faster than json.dump's chunked output
+        if orjson is not None:
+            writer.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            writer.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+    return _write(location, compression, write)
+
+def write_bytes(location, payload, compression=None):
+    """
+    Writes binary data (bytes or a readable file object). Returns the path written.
+    """
+    def write(writer):
+        if hasattr(payload, 'read'):
+            shutil.copyfileobj(payload, writer, 1024 * 1024)
+        else:
+            writer.write(payload)
+    return _write(location, compression, write)
+
+def read_json(location, resolve_arrays=True):
+    """
+    Reads an artifact written by write_json, or a plain JSON file, whichever variant exists.
+    Array references are loaded back into lists unless resolve_arrays is False.
+    """
+    path = find(location)
+    if path is None:
+        raise FileNotFoundError(location)
+    with open_artifact(path) as file:
+        if orjson is not None:
+            data = orjson.loads(file.read())
+        else:
+            data = json.load(file)
+    return resolve(data, os.path.dirname(path)) if resolve_arrays else data
+
+def is_array_ref(value):
+    return isinstance(value, dict) and '$npy' in value
+
+def array_ref(path, array):
+    return {'$npy': path, 'shape': list(array.shape), 'dtype': str(array.dtype)}
+
+def save_array(path, array):
+    """
+    Saves an array as .npy atomically. Returns its reference.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.save(file, array, allow_pickle=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return array_ref(os.path.basename(path), array)
+
+def numeric_array(value, threshold):
+    # The list as an array when it holds at least threshold numbers in a regular shape, else None
+    if not isinstance(value, list) or not value:
+        return None
+    size = len(value) * (len(value[0]) if isinstance(value[0], list) else 1)
+    if size < threshold:
+        return None
+    try:
+        array = np.asarray(value)
+    except ValueError:  # ragged rows
+        return None
+    return array if array.dtype.kind in 'biuf' else None
+
+def array_file_name(key, used=()):
+    # The part of <name>.<key>.npy naming an array: the key with anything but letters, digits, _ and -
+    # replaced, so it cannot leave the result's directory, and numbered when that collides
+    name = re.sub(r'[^A-Za-z0-9_-]', '_', str(key)) or '_'
+    candidate, index = name, 1
+    while candidate in used:
+        index += 1
+        candidate = f"{name}_{index}"
+    return candidate
+
+def externalize_arrays(location, data, threshold=None, spooled=()):
+    """
+    Moves the large numeric arrays among the top-level values of data into .npy files next to
+    location (<name>.<key>.npy) and returns a copy of data referencing them. References to arrays
+    spooled by common/uploads.py are moved into place the same way; spooled lists the files the
+    upload created, and any other reference raises ValueError.
+    """
+    if not isinstance(data, dict):
+        return data
+    threshold = ARRAY_THRESHOLD if threshold is None else threshold
+    spooled = {os.path.abspath(path) for path in spooled}
+    stem = logical_name(location)
+    stem = stem[:-len('.json')] if stem.endswith('.json') else stem
+    externalized = dict(data)
+    used = set()
+    for key, value in data.items():
+        if is_array_ref(value) and os.path.abspath(value['$npy']) not in spooled:
+            raise ValueError(f"Array reference of '{key}' was not uploaded with this request")
+        if not is_array_ref(value):
+            array = numeric_array(value, threshold)
+            if array is None:
+                continue
+        name = array_file_name(key, used)
+        used.add(name)
+        path = f"{stem}.{name}.npy"
+        if is_array_ref(value):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            shutil.move(value['$npy'], path)
+            os.chmod(path, 0o644)
+            externalized[key] = dict(value, **{'$npy': os.path.basename(path)})
+        else:
+            externalized[key] = save_array(path, array)
+    return externalized
+
+def resolve(data, directory):
+    """
+    Replaces the array references among the top-level values of data with lists loaded from
+    their .npy files (relative to directory).
+    """
+    if not isinstance(data, dict):
+        return data
+    return {key: np.load(os.path.join(directory, value['$npy'])).tolist() if is_array_ref(value) else value
+            for key, value in data.items()}
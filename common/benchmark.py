@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+from linear_regression.plot.linear_regression_plot import calculate_confidence_interval
+
+# Headless benchmark suite for the Python platform.
+# Usage: python -m common.benchmark [--suite all|process|load|plot] [--samples 10% 50%] [--warmups 1] [--repeats 5]
+#                                   [--save-baseline] [--fail-on-regression]
+
+HISTORY_PATH = 'benchmark_results/history.jsonl'
+BASELINE_PATH = 'benchmark_results/baseline.json'
+RESULT_LIST_PATH = 'result_list.json'
+SAMPLES = ['10%', '50%', '100%']
+
+def _linear_regression_process(sample):
+    from linear_regression.app.python import linear_regression
+    data = linear_regression.process(0, 1, sample, 0, export=False)
+    return {'training_time_ms': data['results']['training_time_ms'], 'inference_time_ms': data['results']['inference_time_ms']}
+
+def _neural_network_process(sample):
+    from neural_network.app.python import neural_network
+    data = neural_network.process(0, 1, sample, 0, export=False)
+    return {'training_time_ms': data['results']['training_time_ms'], 'inference_time_ms': data['results']['inference_time_ms']}
+
+def _load_mnist(sample):
+    from common import sampling
+    from neural_network.app.python import neural_network
+    neural_network.load_mnist(sampling.parse_fraction(sample))
+    return {}
+
+def _fetch_dataset(sample):
+    from common import sampling
+    from linear_regression.app.python import linear_regression
+    dataset_path = 'linear_regression/datasets/house_price/sample_100%.csv'
+    n_rows = sampling.count_rows(dataset_path, cache_dir='linear_regression/datasets/house_price/indices')
+    indices = sampling.sample_indices(n_rows, sampling.parse_fraction(sample), seed=1,
+                                      cache_dir='linear_regression/datasets/house_price/indices')
+    linear_regression.fetch_dataset(dataset_path, 'price', [], indices)
+    return {}
+
+def _plot_pipeline(plot_module, source_try_path):
+    # Plots a copy of an existing try folder so the stored results are not rewritten
+    def case(sample):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, 'try')
+            shutil.copytree(source_try_path, target)
+            start = time.perf_counter()
+            plot_module.process_json_files(target)
+            return {'plot_ms': (time.perf_counter() - start) * 1000}
+    return case
+
+def plot_try_path(model, sweep=None, result_list_path=RESULT_LIST_PATH):
+    """
+    Returns the folder of a try of model to plot: the first try on disk of the given sweep
+    (result item id), or of the latest sweep in result_list.json with one. None when there is none.
+    """
+    if not os.path.exists(result_list_path):
+        return None
+    with open(result_list_path, 'r') as f:
+        result_list = json.load(f)
+    for item in reversed(result_list):
+        if sweep is not None and item.get('id') != sweep:
+            continue
+        for experiment in item.get('experiments') or []:
+            try_path = experiment.get('try_path') or os.path.dirname(os.path.dirname(experiment.get('result_path', '')))
+            if experiment.get('result_path', '').startswith(model + '/') and os.path.isdir(try_path):
+                return try_path
+    return None
+
+def build_cases(suite, samples, plot_sweep=None):
+    """
+    Returns the benchmark cases as (name, sample, function) tuples.
+    The plot cases plot a try of plot_sweep (default: the latest sweep with results on disk).
+    """
+    cases = []
+    if suite in ('all', 'process'):
+        for sample in samples:
+            cases.append(('linear_regression.process', sample, _linear_regression_process))
+            cases.append(('neural_network.process', sample, _neural_network_process))
+    if suite in ('all', 'load'):
+        for sample in samples:
+            cases.append(('linear_regression.fetch_dataset', sample, _fetch_dataset))
+            cases.append(('neural_network.load_mnist', sample, _load_mnist))
+    if suite in ('all', 'plot'):
+        from linear_regression.plot import linear_regression_plot
+        from neural_network.plot import neural_network_plot
+        for model, plot_module in (('linear_regression', linear_regression_plot), ('neural_network', neural_network_plot)):
+            try_path = plot_try_path(model, plot_sweep)
+            if try_path is None:
+                print(f"Skipping {model}_plot: no try of {model} on disk" + (f" in sweep {plot_sweep}" if plot_sweep is not None else ""))
+                continue
+            cases.append((f'{model}_plot.process_json_files', None, _plot_pipeline(plot_module, try_path)))
+    return cases
+
+def case_key(name, sample):
+    return name if sample is None else f"{name}[{sample}]"
+
+def run_case(function, sample, warmups, repeats):
+    """
+    Runs a case warmups + repeats times and returns the measured metrics of the repeats,
+    as {metric: [value per repeat]}. wall_ms is always measured.
+    """
+    for _ in range(warmups):
+        function(sample)
+
+    measurements = {}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        metrics = function(sample)
+        wall_ms = (time.perf_counter() - start) * 1000
+        for metric, value in dict(metrics, wall_ms=wall_ms).items():
+            measurements.setdefault(metric, []).append(value)
+    return measurements
+
+def summarize(values):
+    """
+    Returns mean and 95% confidence interval of a list of measurements.
+    """
+    summary = {'n': len(values), 'mean': float(np.mean(values))}
+    if len(values) > 1:
+        ci_lower, ci_upper = calculate_confidence_interval(values)
+        summary['ci_lower'], summary['ci_upper'] = float(ci_lower), float(ci_upper)
+    return summary
+
+def compare_to_baseline(results, baseline):
+    """
+    Flags a metric as a regression when its confidence interval lies entirely above the
+    baseline's, i.e. the slowdown is significant at the 95% level.
+    """
+    regressions = []
+    for key, metrics in results.items():
+        for metric, summary in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if not base or 'ci_lower' not in summary or 'ci_upper' not in base:
+                continue
+            if summary['ci_lower'] > base['ci_upper']:
+                regressions.append({'case': key, 'metric': metric, 'baseline_mean': base['mean'],
+                                    'mean': summary['mean'], 'slowdown': summary['mean'] / base['mean']})
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def append_history(record, history_path=HISTORY_PATH):
+    directory = os.path.dirname(history_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(history_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+def run_benchmarks(suite='all', samples=None, warmups=1, repeats=5, baseline_path=BASELINE_PATH, history_path=HISTORY_PATH,
+                   plot_sweep=None):
+    """
+    Runs the benchmark suite, appends the results to the history file and compares them to the baseline.
+    """
+    results = {}
+    for name, sample, function in build_cases(suite, samples or SAMPLES, plot_sweep):
+        key = case_key(name, sample)
+        print(f"Benchmarking {key} ({warmups} warmups, {repeats} repeats)")
+        measurements = run_case(function, sample, warmups, repeats)
+        results[key] = {metric: dict(summarize(values), values=values) for metric, values in measurements.items()}
+        print(f"  wall: {results[key]['wall_ms']['mean']:.1f} ms")
+
+    baseline = {}
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)['results']
+    regressions = compare_to_baseline(results, baseline)
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        'commit': git_commit(),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()},
+        'suite': suite,
+        'plot_sweep': plot_sweep,
+        'warmups': warmups,
+        'repeats': repeats,
+        'results': results,
+        'regressions': regressions,
+    }
+    append_history(record, history_path)
+    return record
+
+def save_baseline(record, baseline_path=BASELINE_PATH):
+    directory = os.path.dirname(baseline_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(baseline_path, 'w') as f:
+        json.dump(record, f, indent=4)
+    print(f"Baseline saved to {baseline_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Python platform and flag performance regressions.")
+    parser.add_argument('--suite', choices=['all', 'process', 'load', 'plot'], default='all')
+    parser.add_argument('--samples', nargs='+', default=SAMPLES)
+    parser.add_argument('--warmups', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--plot-sweep', type=int, default=None,
+                        help="result item id whose try the plot suite plots (default: the latest one on disk)")
+    parser.add_argument('--history', default=HISTORY_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 when a regression is found")
+    args = parser.parse_args()
+
+    record = run_benchmarks(args.suite, args.samples, args.warmups, args.repeats, args.baseline, args.history, args.plot_sweep)
+    for regression in record['regressions']:
+        print(f"REGRESSION {regression['case']} {regression['metric']}: "
+              f"{regression['baseline_mean']:.1f} -> {regression['mean']:.1f} ({regression['slowdown']:.2f}x)")
+    if not record['regressions']:
+        print("No significant regressions against the baseline.")
+    if args.save_baseline:
+        save_baseline(record, args.baseline)
+    if args.fail_on_regression and record['regressions']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
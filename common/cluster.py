@@ -0,0 +1,584 @@
+import os
+import sys
+import json
+import gzip
+import math
+import time
+import socket
+import shutil
+import argparse
+import threading
+import socketserver
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Sweeps of the Python trainers spread over several processes or hosts. A coordinator holds the tasks
+# of a sweep (model, sample, try, config) and hands them out over TCP, one JSON object per line;
+# workers register, pull a task, run linear_regression.process or neural_network.process and POST
+# the result to the server's /api/append_experiment, so it is stored like a run_python run.
+# Tasks are leased: a worker renews its lease with heartbeats while it trains, and a task whose lease
+# expires, or whose worker disconnects or fails, is queued again (up to MAX_ATTEMPTS failures).
+# With stealing on, a worker with nothing left to pull steals from a straggler: it runs a backup copy
+# of a task that has been running much longer than the finished tasks of the same model and sample,
+# and the first copy to claim its result is stored while the other one is aborted. The two copies
+# compete for the machine and the faster one wins, so such results are marked "raced" under "worker".
+# Workers must share the server's filesystem (run from the same checkout, or one on a shared mount):
+# models are exported to the try's folder by the worker and the stored model_path points there.
+# Usage: python server.py
+#        python -m common.cluster coordinator --server http://localhost:8001 --model neural_network --samples 10% 50% --tries 3
+#        python -m common.cluster worker --coordinator localhost:8765 --threads 2   (one per process or host)
+
+PORT = int(os.environ.get('CLUSTER_PORT', 8765))
+LEASE_SECONDS = float(os.environ.get('CLUSTER_LEASE_SECONDS', 60))
+MAX_ATTEMPTS = int(os.environ.get('CLUSTER_MAX_ATTEMPTS', 3))
+# A task is stolen once it has run STEAL_FACTOR times the median duration of the finished tasks of
+# its model and sample (and at least STEAL_MIN_SECONDS); 0, the default, disables stealing
+STEAL_FACTOR = float(os.environ.get('CLUSTER_STEAL_FACTOR', 0))
+STEAL_MIN_SECONDS = 5.0
+MODELS = {'linear_regression': 'Linear Regression Python GPU', 'neural_network': 'Neural Network Python GPU'}
+
+def _now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def make_tasks(model, samples, tries, result_item_id, config=None):
+    """
+    The tasks of a sweep, in the order the browser runs them: every try of the first sample, then the next sample.
+    config holds the process() arguments shared by all of them (dtype, hyperparameters ...).
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}', expected one of {', '.join(MODELS)}")
+    return [dict(config or {}, task_id=f"{model}/{sample}/{retry}", model=model, sample=sample, retry=retry,
+                 result_item_id=result_item_id)
+            for sample in samples for retry in range(1, tries + 1)]
+
+class Coordinator:
+    """
+    Task states of a sweep: queued, leased (one or more running attempts, more than one when a
+    backup copy was stolen), committing (an attempt claimed the result and is storing it), done or failed.
+    Every method is called with a worker's request and returns the reply.
+    """
+
+    def __init__(self, tasks, server=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, steal_factor=STEAL_FACTOR):
+        self.server = server
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.steal_factor = steal_factor
+        self.tasks = {task['task_id']: {'spec': task, 'state': 'queued', 'attempts': 0, 'running': {}, 'committing': None,
+                                        'errors': [], 'stolen': 0, 'result': None}
+                      for task in tasks}
+        self.queue = deque(self.tasks)
+        self.workers = {}
+        self.durations = {}  # (model, sample) -> durations of its finished tasks
+        self.condition = threading.Condition()
+        self.next_worker = 1
+
+    def register(self, worker):
+        with self.condition:
+            worker_id = f"w{self.next_worker}"
+            self.next_worker += 1
+            self.workers[worker_id] = dict(worker, connected=True, registered=_now_iso(), tasks_done=0)
+            return {'worker_id': worker_id, 'server': self.server, 'heartbeat_s': self.lease_seconds / 3}
+
+    def pull(self, worker_id):
+        with self.condition:
+            self._reap()
+            while self.queue:
+                task_id = self.queue.popleft()
+                if self.tasks[task_id]['state'] == 'queued':
+                    return {'task': self._lease(task_id, worker_id)}
+            task_id = self._straggler(worker_id)
+            if task_id is not None:
+                self.tasks[task_id]['stolen'] += 1
+                return {'task': self._lease(task_id, worker_id, backup=True)}
+            if all(task['state'] in ('done', 'failed') for task in self.tasks.values()):
+                return {'done': True}
+            return {'wait': min(2.0, self.lease_seconds / 3)}
+
+    def heartbeat(self, worker_id, task_id, attempt):
+        """
+        Renews a lease. cancel tells the worker its copy is no longer needed (another one was stored).
+        """
+        with self.condition:
+            task = self.tasks[task_id]
+            if task['state'] in ('done', 'failed') or (task['committing'] not in (None, attempt)):
+                return {'cancel': True}
+            self._adopt(task, task_id, worker_id, attempt)
+            return {'cancel': False}
+
+    def claim(self, worker_id, task_id, attempt):
+        """
+        The first finished attempt of a task is the one stored; the others are told to drop their results.
+        """
+        with self.condition:
+            task = self.tasks[task_id]
+            if task['state'] in ('done', 'failed') or task['committing'] not in (None, attempt):
+                return {'accepted': False}
+            self._adopt(task, task_id, worker_id, attempt)
+            task['state'] = 'committing'
+            task['committing'] = attempt
+            # raced: a backup copy ran at the same time, so this timing was measured under contention
+            return {'accepted': True, 'raced': task['stolen'] > 0}
+
+    def complete(self, worker_id, task_id, attempt, summary=None):
+        with self.condition:
+            task = self.tasks[task_id]
+            run = task['running'].pop(attempt, None)
+            if task['committing'] != attempt:
+                return {'ok': False}
+            task['state'] = 'done'
+            task['committing'] = None
+            task['result'] = dict(summary or {}, worker=worker_id, attempt=attempt)
+            if run is not None:
+                self.durations.setdefault(self._group(task), []).append(time.time() - run['started'])
+            if worker_id in self.workers:
+                self.workers[worker_id]['tasks_done'] += 1
+            self.condition.notify_all()
+            return {'ok': True}
+
+    def fail(self, worker_id, task_id, attempt, error):
+        with self.condition:
+            self._drop(task_id, attempt, error)
+            return {'ok': True}
+
+    def disconnected(self, worker_id):
+        # A worker that went away loses its leases at once instead of when they expire
+        with self.condition:
+            if worker_id in self.workers:
+                self.workers[worker_id]['connected'] = False
+            for task_id, task in self.tasks.items():
+                for attempt, run in list(task['running'].items()):
+                    if run['worker'] == worker_id:
+                        self._drop(task_id, attempt, f"worker {worker_id} disconnected")
+
+    def status(self):
+        with self.condition:
+            self._reap()
+            states = {}
+            for task in self.tasks.values():
+                states[task['state']] = states.get(task['state'], 0) + 1
+            return {
+                'states': states,
+                'queued': len(self.queue),
+                'workers': self.workers,
+                'tasks': {task_id: {'state': task['state'], 'attempts': task['attempts'], 'stolen': task['stolen'],
+                                    'running': {str(attempt): run['worker'] for attempt, run in task['running'].items()},
+                                    'errors': task['errors'], 'result': task['result']}
+                          for task_id, task in self.tasks.items()},
+            }
+
+    def wait(self, timeout=None):
+        """
+        Waits until every task is done or failed; returns whether they are.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not all(task['state'] in ('done', 'failed') for task in self.tasks.values()):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                # Woken by completions and failures; expired leases are noticed on the next check
+                self.condition.wait(min(1.0, remaining) if remaining is not None else 1.0)
+                self._reap()
+            return True
+
+    def _lease(self, task_id, worker_id, backup=False):
+        task = self.tasks[task_id]
+        task['attempts'] += 1
+        attempt = task['attempts']
+        now = time.time()
+        task['running'][attempt] = {'worker': worker_id, 'started': now, 'deadline': now + self.lease_seconds}
+        if task['state'] == 'queued':
+            task['state'] = 'leased'
+        return dict(task['spec'], attempt=attempt, backup=backup, lease_s=self.lease_seconds)
+
+    def _adopt(self, task, task_id, worker_id, attempt):
+        # Renews the lease of an attempt, taking it back when it had expired meanwhile (e.g. the
+        # worker was paused), as long as the task is not stored yet
+        now = time.time()
+        run = task['running'].get(attempt)
+        if run is None:
+            run = task['running'][attempt] = {'worker': worker_id, 'started': now, 'deadline': now}
+            if task['state'] == 'queued':
+                task['state'] = 'leased'
+        run['deadline'] = now + self.lease_seconds
+
+    def _drop(self, task_id, attempt, error):
+        task = self.tasks[task_id]
+        run = task['running'].pop(attempt, None)
+        if task['committing'] == attempt:
+            task['committing'] = None
+            task['state'] = 'leased'
+        if run is None or task['state'] in ('done', 'failed') or task['committing'] is not None:
+            return  # a copy that lost to the one stored
+        task['errors'].append({'attempt': attempt, 'worker': run['worker'], 'error': error})
+        if task['running']:
+            return  # another copy is still running
+        failures = len(task['errors'])
+        if failures >= self.max_attempts:
+            task['state'] = 'failed'
+        else:
+            task['state'] = 'queued'
+            self.queue.appendleft(task_id)  # retried before the tasks not started yet
+        self.condition.notify_all()
+
+    def _reap(self):
+        now = time.time()
+        for task_id, task in self.tasks.items():
+            for attempt, run in list(task['running'].items()):
+                if run['deadline'] < now:
+                    self._drop(task_id, attempt, f"lease of {run['worker']} expired")
+
+    def _group(self, task):
+        # Tasks are only compared with tasks of the same model and sample, whose durations are alike
+        return task['spec']['model'], task['spec']['sample']
+
+    def _straggler(self, worker_id):
+        # The running task that overran the finished ones of its group the most, with no backup copy yet
+        if not self.steal_factor or not self.durations:
+            return None
+        thresholds = {group: max(STEAL_MIN_SECONDS, self.steal_factor * float(np.median(durations)))
+                      for group, durations in self.durations.items()}
+        now = time.time()
+        candidates = [(run['started'], task_id) for task_id, task in self.tasks.items()
+                      if task['state'] == 'leased' and len(task['running']) == 1 and self._group(task) in thresholds
+                      for run in task['running'].values()
+                      if run['worker'] != worker_id and now - run['started'] > thresholds[self._group(task)]]
+        return min(candidates)[1] if candidates else None
+
+class _Handler(socketserver.StreamRequestHandler):
+    # One connection per worker: a request line, then its reply line
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker_id = None
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    message = json.loads(line)
+                    op = message.pop('op')
+                    if op == 'register':
+                        reply = coordinator.register(dict(message, address=self.client_address[0]))
+                        worker_id = reply['worker_id']
+                    elif op == 'status':
+                        reply = coordinator.status()
+                    elif worker_id is None:
+                        reply = {'error': 'Register first'}
+                    elif op in ('pull', 'heartbeat', 'claim', 'complete', 'fail'):
+                        reply = getattr(coordinator, op)(worker_id, **message)
+                    else:
+                        reply = {'error': f"Unknown op '{op}'"}
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {'error': repr(e)}
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if worker_id is not None:
+                coordinator.disconnected(worker_id)
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(coordinator, host='', port=PORT):
+    """
+    Starts the coordinator's TCP server on a background thread and returns it (shutdown() stops it).
+    """
+    server = _Server((host, port), _Handler)
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, name='coordinator', daemon=True).start()
+    return server
+
+class Connection:
+    """
+    A worker's connection to the coordinator, shared by its main loop and heartbeat thread.
+    """
+
+    def __init__(self, address, timeout=60):
+        host, _, port = address.rpartition(':')
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.socket = socket.create_connection((host or 'localhost', int(port)), timeout=30)
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)  # the coordinator may not be up yet
+        self.file = self.socket.makefile('rwb')
+        self.lock = threading.Lock()
+
+    def call(self, op, **fields):
+        with self.lock:
+            self.file.write(json.dumps(dict(fields, op=op)).encode('utf-8') + b'\n')
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise ConnectionError("Coordinator closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError(f"Coordinator: {reply['error']}")
+        return reply
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+def _plain(value):
+    # JSON-ready copy of process() output: numpy arrays and scalars as lists and numbers,
+    # NaN and inf as null (as artifacts.write_json writes them)
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _plain(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def post_json(server, path, data):
+    """
+    POSTs data gzip-compressed to the server and returns its JSON reply.
+    """
+    body = gzip.compress(json.dumps(_plain(data), separators=(',', ':')).encode('utf-8'), compresslevel=5)
+    request = urllib.request.Request(server.rstrip('/') + path, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    with urllib.request.urlopen(request, timeout=300) as response:
+        return json.loads(response.read() or b'{}')
+
+def get_json(server, path):
+    with urllib.request.urlopen(server.rstrip('/') + path, timeout=300) as response:
+        return json.loads(response.read())
+
+def try_dir(task):
+    return f"{task['model']}/training_result/{int(task['result_item_id'])}/{task['retry']}"
+
+def staging_dir(task):
+    # Exports of an attempt go to <try>/.attempt-<n>/ until its result is the one stored, so a
+    # copy that loses (a stolen or superseded attempt) never overwrites the stored model
+    return f"{try_dir(task)}/.attempt-{task['attempt']}"
+
+def run_task(task, run_config=None, progress_job=None):
+    """
+    Runs one task with the trainer of its model; returns the process() output.
+    Its exported models are staged, see staging_dir.
+    """
+    if task['model'] == 'linear_regression':
+        from linear_regression.app.python import linear_regression as trainer
+        extra = {'feature_columns': task.get('feature_columns'), 'categorical_columns': task.get('categorical_columns')}
+    else:
+        from neural_network.app.python import neural_network as trainer
+        extra = {'inference_variants': task.get('inference_variants', False), 'validation_config': task.get('validation_config')}
+    run_config = dict(task.get('run_config') or {}, **(run_config or {}))
+    return trainer.process(task.get('dataset', 0), task['retry'], task['sample'], task['result_item_id'], task.get('dtype'),
+                           run_config, convergence_policy=task.get('convergence_policy'),
+                           hyperparameters=task.get('hyperparameters'), progress_job=progress_job,
+                           export_staging=os.path.basename(staging_dir(task)), **extra)
+
+class Worker:
+    """
+    Pulls tasks from the coordinator until the sweep is done, one at a time.
+    run_config (e.g. intra_op_threads) pins this worker's thread pools, so several workers share a host.
+    """
+
+    def __init__(self, coordinator, name=None, server=None, run_config=None, runner=run_task):
+        self.coordinator = coordinator
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.server = server
+        self.run_config = run_config
+        self.runner = runner
+
+    def run(self):
+        connection = Connection(self.coordinator)
+        try:
+            info = connection.call('register', name=self.name, host=socket.gethostname(), pid=os.getpid(),
+                                   cpus=os.cpu_count())
+            self.worker_id = info['worker_id']
+            self.server = self.server or info['server']
+            self.heartbeat_s = info['heartbeat_s']
+            print(f"Worker {self.name} registered as {self.worker_id}")
+            done = 0
+            while True:
+                reply = connection.call('pull')
+                if reply.get('done'):
+                    break
+                if 'wait' in reply:
+                    time.sleep(reply['wait'])
+                    continue
+                done += self.execute(connection, reply['task'])
+            print(f"Worker {self.worker_id}: sweep done, stored {done} results")
+        except ConnectionError as e:
+            print(f"Worker {self.name}: {e}")
+        finally:
+            connection.close()
+
+    def execute(self, connection, task):
+        from common import progress
+
+        label = f"{task['task_id']} (attempt {task['attempt']}{', backup' if task['backup'] else ''})"
+        print(f"Worker {self.worker_id}: running {label}")
+        job = progress.Job(f"{task['task_id']}#{task['attempt']}")
+        cancelled = threading.Event()
+        stopping = threading.Event()
+
+        def heartbeat():
+            # Keeps the lease while training; aborts the run after its current batch when another copy was stored
+            while not stopping.wait(self.heartbeat_s):
+                try:
+                    if connection.call('heartbeat', task_id=task['task_id'], attempt=task['attempt'])['cancel']:
+                        cancelled.set()
+                        job.request_abort()
+                        return
+                except (OSError, RuntimeError):
+                    return
+        thread = threading.Thread(target=heartbeat, name='heartbeat', daemon=True)
+        thread.start()
+        try:
+            return self.finish(connection, task, label, job, cancelled)
+        finally:
+            stopping.set()
+            thread.join()
+
+    def finish(self, connection, task, label, job, cancelled):
+        # Trains, then stores the result unless another copy of the task was stored first
+        try:
+            return self.attempt(connection, task, label, job, cancelled)
+        finally:
+            shutil.rmtree(staging_dir(task), ignore_errors=True)  # the exports of a lost or failed attempt
+
+    def attempt(self, connection, task, label, job, cancelled):
+        try:
+            data = self.runner(task, self.run_config, job)
+        except Exception as e:
+            connection.call('fail', task_id=task['task_id'], attempt=task['attempt'], error=repr(e))
+            print(f"Worker {self.worker_id}: {label} failed: {e!r}")
+            return 0
+
+        claim = None if cancelled.is_set() else connection.call('claim', task_id=task['task_id'], attempt=task['attempt'])
+        if not claim or not claim['accepted']:
+            connection.call('fail', task_id=task['task_id'], attempt=task['attempt'], error='superseded by another attempt')
+            print(f"Worker {self.worker_id}: {label} dropped, another attempt was stored")
+            return 0
+        try:
+            self.publish_exports(task, data)
+            self.store(task, data, raced=claim.get('raced', False))
+        except (OSError, ValueError) as e:
+            connection.call('fail', task_id=task['task_id'], attempt=task['attempt'], error=f"storing the result: {e!r}")
+            print(f"Worker {self.worker_id}: could not store {label}: {e!r}")
+            return 0
+        connection.call('complete', task_id=task['task_id'], attempt=task['attempt'],
+                        summary={'training_time_ms': data['results'].get('training_time_ms'),
+                                 'result_path': data['experiment']['result_path']})
+        return 1
+
+    def publish_exports(self, task, data):
+        # Moves the exports of the attempt whose result is stored from its staging directory into the try's folder
+        staging, target = staging_dir(task), try_dir(task)
+        for current, _, files in os.walk(staging):
+            directory = target + current[len(staging):]
+            os.makedirs(directory, exist_ok=True)
+            for name in files:
+                os.replace(os.path.join(current, name), os.path.join(directory, name))
+        for record in [data] + (data.get('variants') or []):
+            for holder in (record['experiment'], record['results']):
+                path = holder.get('model_path')
+                if path and path.startswith(staging + '/'):
+                    holder['model_path'] = target + path[len(staging):]
+
+    def store(self, task, data, raced=False):
+        # Each inference variant is appended as its own experiment, as run_python does
+        variants = data.pop('variants', None) or []
+        for record in [data] + variants:
+            record['experiment']['worker'] = {'name': self.name, 'id': self.worker_id, 'attempt': task['attempt'],
+                                              'backup': task['backup'], 'raced': raced}
+            post_json(self.server, '/api/append_experiment', record)
+
+def run_coordinator(args):
+    config = {'dtype': args.dtype, 'dataset': args.dataset}
+    for name in ('hyperparameters', 'convergence_policy', 'validation_config', 'run_config'):
+        if getattr(args, name):
+            config[name] = json.loads(getattr(args, name))
+    if args.features:
+        config['feature_columns'] = args.features.split(',')
+        config['categorical_columns'] = args.categorical.split(',') if args.categorical else None
+    if args.variants:
+        config['inference_variants'] = True
+
+    result_item_id = args.result_item_id
+    if result_item_id is None:
+        item = get_json(args.server, f"/api/new_result_item?tries={args.tries}&isRunAll=false&start={_now_iso()}")
+        result_item_id = item['id']
+    coordinator = Coordinator(make_tasks(args.model, args.samples, args.tries, result_item_id, config), server=args.server,
+                              lease_seconds=args.lease_seconds, max_attempts=args.max_attempts, steal_factor=args.steal_factor)
+    server = serve(coordinator, args.host, args.port)
+    print(f"Coordinating {len(coordinator.tasks)} tasks of result item {result_item_id} on port {server.server_address[1]}")
+    try:
+        coordinator.wait()
+        # Workers still pulling are told the sweep is done
+        time.sleep(min(5.0, coordinator.lease_seconds / 3))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    post_json(args.server, '/api/update_result_item', {'result_item_id': result_item_id, 'end': _now_iso()})
+    if args.plot:
+        get_json(args.server, f"/api/plot_{args.model}?id={result_item_id}&tries={args.tries}")
+    status = coordinator.status()
+    for task_id, task in status['tasks'].items():
+        print(json.dumps(dict(task, task_id=task_id)))
+    print(f"Result item {result_item_id}: {status['states']}")
+    return 1 if status['states'].get('failed') else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a sweep of the Python trainers on several workers.")
+    modes = parser.add_subparsers(dest='mode', required=True)
+
+    coordinator = modes.add_parser('coordinator', help="hand out the tasks of a sweep")
+    coordinator.add_argument('--server', default='http://localhost:8001', help="server storing the results")
+    coordinator.add_argument('--model', choices=list(MODELS), required=True)
+    coordinator.add_argument('--samples', nargs='+', default=['10%'])
+    coordinator.add_argument('--tries', type=int, default=1)
+    coordinator.add_argument('--result-item-id', type=int, default=None, help="add to this sweep instead of a new one")
+    coordinator.add_argument('--dataset', type=int, default=0)
+    coordinator.add_argument('--dtype', default=None)
+    coordinator.add_argument('--hyperparameters', default=None, help="JSON, e.g. '{\"learning_rate\": 0.01}'")
+    coordinator.add_argument('--convergence-policy', default=None, help="JSON, e.g. '{\"patience\": 3}'")
+    coordinator.add_argument('--validation-config', default=None, help="JSON, e.g. '{\"freq\": 3}'")
+    coordinator.add_argument('--run-config', default=None, help="JSON run config of every task")
+    coordinator.add_argument('--features', default=None)
+    coordinator.add_argument('--categorical', default=None)
+    coordinator.add_argument('--variants', action='store_true')
+    coordinator.add_argument('--plot', action='store_true', help="plot the sweep when it is done")
+    coordinator.add_argument('--host', default='')
+    coordinator.add_argument('--port', type=int, default=PORT)
+    coordinator.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    coordinator.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+    coordinator.add_argument('--steal-factor', type=float, default=STEAL_FACTOR,
+                             help="back up tasks running this many times their group's median (0: off)")
+
+    worker = modes.add_parser('worker', help="run tasks pulled from a coordinator (from a checkout sharing the server's filesystem)")
+    worker.add_argument('--coordinator', default=f'localhost:{PORT}', help="host:port")
+    worker.add_argument('--server', default=None, help="server storing the results (default: the coordinator's)")
+    worker.add_argument('--name', default=None)
+    worker.add_argument('--threads', type=int, default=None, help="intra-op/OMP threads of this worker")
+    worker.add_argument('--cpu-affinity', default=None, help="CPUs of this worker, e.g. 0-3")
+
+    args = parser.parse_args()
+    if args.mode == 'coordinator':
+        sys.exit(run_coordinator(args))
+    run_config = {}
+    if args.threads:
+        run_config.update(intra_op_threads=args.threads, inter_op_threads=1, omp_threads=args.threads)
+    if args.cpu_affinity:
+        run_config['cpu_affinity'] = args.cpu_affinity
+    Worker(args.coordinator, args.name, args.server, run_config or None).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import time
+import tensorflow as tf
+
+# Values of a policy that turn on early stopping on the monitored metric; a policy of only
+# max_epochs and/or time_budget_ms bounds the run without it
+EARLY_STOPPING_KEYS = ('monitor', 'mode', 'tolerance', 'patience')
+
+# Defaults for any value a convergence policy leaves out
+DEFAULT_POLICY = {
+    'monitor': 'loss',          # metric from the epoch logs, e.g. loss or val_loss
+    'mode': 'auto',             # min, max, or auto: max for accuracy/auc metrics, else min
+    'tolerance': 1e-4,          # minimum relative improvement that resets patience
+    'patience': 5,              # epochs without improvement before stopping (with monitor, mode, tolerance or patience given)
+    'max_epochs': None,         # upper bound on epochs (None: the trainer's default)
+    'time_budget_ms': None,     # wall-clock budget for training
+}
+
+def resolve_policy(policy):
+    """
+    Fills in the defaults of a convergence policy; None disables early stopping.
+    """
+    if policy is None:
+        return None
+    resolved = dict(DEFAULT_POLICY)
+    resolved.update({key: value for key, value in policy.items() if value is not None})
+    if not any(policy.get(key) is not None for key in EARLY_STOPPING_KEYS):
+        resolved['patience'] = None
+    if resolved['mode'] == 'auto':
+        resolved['mode'] = 'max' if any(name in resolved['monitor'] for name in ('acc', 'auc')) else 'min'
+    if resolved['mode'] not in ('min', 'max'):
+        raise ValueError(f"Unknown convergence mode '{resolved['mode']}', expected min, max or auto")
+    return resolved
+
+def policy_from_query(query_params):
+    """
+    Builds a convergence policy from /api/run_python query parameters, or None when none are given.
+    """
+    casts = {'monitor': str, 'mode': str, 'tolerance': float, 'patience': int, 'max_epochs': int, 'time_budget_ms': float}
+    policy = {name: cast(query_params[name][0]) for name, cast in casts.items() if query_params.get(name, [''])[0] != ''}
+    return policy or None
+
+def max_epochs(policy, default):
+    """
+    Returns the number of epochs to pass to model.fit.
+    """
+    if policy and policy.get('max_epochs'):
+        return int(policy['max_epochs'])
+    return default
+
+class ConvergenceCallback(tf.keras.callbacks.Callback):
+    """
+    Stops training once the monitored metric has not improved (decreased with mode min,
+    increased with max) by more than the relative tolerance for `patience` epochs, or when
+    the wall-clock budget is spent.
+    """
+
+    def __init__(self, policy):
+        super().__init__()
+        self.policy = resolve_policy(policy)
+        self.sign = 1 if self.policy['mode'] == 'min' else -1  # compares -value for max
+        self.best = None
+        self.seen = False
+        self.warned = False
+        self.wait = 0
+        self.epochs_run = 0
+        self.stop_reason = 'max_epochs'
+        self.start_time = None
+
+    def on_train_begin(self, logs=None):
+        self.start_time = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs_run = epoch + 1
+        logs = logs or {}
+        monitor = self.policy['monitor']
+        current = logs.get(monitor)
+        if current is None and self.policy['patience'] is not None:
+            # val_ metrics are missing on the epochs validation skips (validation_freq)
+            skipped = monitor.startswith('val_') and not any(name.startswith('val_') for name in logs)
+            if not skipped:
+                self._warn_missing(logs)
+        elif current is not None and self.policy['patience'] is not None:
+            self.seen = True
+            value = self.sign * current
+            if self.best is None or self.best - value > self.policy['tolerance'] * abs(self.best):
+                self.best = value
+                self.wait = 0
+            else:
+                self.wait += 1
+                if self.wait >= self.policy['patience']:
+                    self.stop_reason = 'converged'
+                    self.model.stop_training = True
+
+        budget = self.policy['time_budget_ms']
+        if budget and (time.time() - self.start_time) * 1000 >= budget and not self.model.stop_training:
+            self.stop_reason = 'time_budget'
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.policy['patience'] is not None and not self.seen:
+            self._warn_missing(logs or {})
+
+    def _warn_missing(self, logs):
+        if not self.warned:
+            self.warned = True
+            print(f"Warning: early stopping monitors '{self.policy['monitor']}', which is not in the epoch logs "
+                  f"({', '.join(sorted(logs)) or 'none'}); training runs to max_epochs")
+
+    def summary(self):
+        return {'policy': self.policy, 'stopped_epoch': self.epochs_run, 'stop_reason': self.stop_reason}
+
+def summary(callback, epochs_run):
+    """
+    Convergence record saved with the results; without a policy the run always uses its full epoch count.
+    """
+    if callback is None:
+        return {'policy': None, 'stopped_epoch': epochs_run, 'stop_reason': 'max_epochs'}
+    return callback.summary()
@@ -0,0 +1,92 @@
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Datasets shared between a parent process and its workers through multiprocessing.shared_memory.
+# The parent loads a dataset once and publishes it under a key (e.g. "mnist/0.1/None/float32");
+# workers attach to the segments and get read-only NumPy views instead of loading their own copy.
+
+class DatasetPool:
+    """
+    Shared-memory datasets of the parent process, reference-counted per key.
+    acquire() loads and publishes a dataset on first use; the last release() unlinks its segments.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, loader):
+        """
+        Returns the specs of a dataset ({array name: spec}), publishing loader() (a dict of arrays)
+        when the dataset is not shared yet. Every acquire must be paired with a release.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = {'segments': {}, 'specs': {}, 'refcount': 0}
+                for name, array in loader().items():
+                    array = np.ascontiguousarray(array)
+                    segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+                    self.entries[key]['segments'][name] = segment
+                    self.entries[key]['specs'][name] = {'shm_name': segment.name, 'shape': array.shape, 'dtype': array.dtype}
+            entry = self.entries[key]
+            entry['refcount'] += 1
+            return {key: entry['specs']}
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry['refcount'] -= 1
+            if entry['refcount'] <= 0:
+                for segment in entry['segments'].values():
+                    segment.close()
+                    segment.unlink()
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {key: {'refcount': entry['refcount'],
+                          'size_mb': sum(segment.size for segment in entry['segments'].values()) / 2**20}
+                    for key, entry in self.entries.items()}
+
+# Datasets published by this process
+pool = DatasetPool()
+
+# Worker side: specs registered for this process and the segments attached so far
+_registered = {}
+_attached = {}
+
+def register(shared_specs):
+    """
+    Makes shared datasets ({key: specs} from DatasetPool.acquire) available to lookup() in this process.
+    """
+    _registered.update(shared_specs or {})
+
+def _attach(shm_name):
+    if shm_name not in _attached:
+        try:
+            segment = shared_memory.SharedMemory(name=shm_name, track=False)  # Python 3.13+
+        except TypeError:
+            # Before 3.13 attaching registers the segment with the resource tracker too; workers
+            # started by the owner share its tracker, so the owner's unlink still releases it once
+            segment = shared_memory.SharedMemory(name=shm_name)
+        _attached[shm_name] = segment
+    return _attached[shm_name]
+
+def lookup(key):
+    """
+    Returns read-only views of a registered shared dataset ({array name: array}), or None.
+    """
+    specs = _registered.get(key)
+    if specs is None:
+        return None
+    arrays = {}
+    for name, spec in specs.items():
+        array = np.ndarray(spec['shape'], spec['dtype'], buffer=_attach(spec['shm_name']).buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
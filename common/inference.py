@@ -0,0 +1,167 @@
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+# Optimized inference variants of a trained Keras model, benchmarked with one warmed, batched harness.
+# Each variant is stored as its own platform, next to python_gpu (plain Keras).
+VARIANTS = ['python_xla', 'python_tflite', 'python_tflite_int8']
+BATCH_SIZES = (1, 256)
+
+def keras_predict_fn(model):
+    """
+    Plain Keras inference (the model called directly, without model.predict's per-call setup).
+    """
+    return lambda inputs: model(inputs, training=False).numpy()
+
+def xla_predict_fn(model):
+    """
+    The model compiled by XLA as one fused tf.function (traced once per batch shape).
+    """
+    compiled = tf.function(lambda inputs: model(inputs, training=False), jit_compile=True)
+    return lambda inputs: compiled(tf.constant(inputs)).numpy()
+
+def convert_tflite(model, quantize=False):
+    """
+    Converts a Keras model to a TFLite flatbuffer. quantize=True applies dynamic-range
+    quantization: weights are stored as int8 and activations stay float.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    return converter.convert()
+
+def tflite_predict_fn(model_content):
+    """
+    Runs a TFLite model with the interpreter, resizing its input for each new batch size.
+    """
+    interpreter = tf.lite.Interpreter(model_content=model_content)
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    input_dtype = interpreter.get_input_details()[0]['dtype']
+    shape = [None]
+
+    def predict(inputs):
+        if shape[0] != inputs.shape:
+            interpreter.resize_tensor_input(input_index, list(inputs.shape))
+            interpreter.allocate_tensors()
+            shape[0] = inputs.shape
+        interpreter.set_tensor(input_index, np.ascontiguousarray(inputs, dtype=input_dtype))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index).copy()
+    return predict
+
+def benchmark(predict_fn, inputs, batch_sizes=BATCH_SIZES, warmups=10, repeats=50):
+    """
+    Measures the latency of predict_fn per batch size, after warmup calls (tracing, allocation).
+    Returns {batch_size: {mean_ms, p50_ms, p99_ms, throughput_per_s}}.
+    """
+    report = {}
+    for batch_size in batch_sizes:
+        batch = np.asarray(inputs[:batch_size], dtype=np.float32)
+        for _ in range(warmups):
+            predict_fn(batch)
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predict_fn(batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies = np.array(latencies)
+        report[str(batch.shape[0])] = {
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'throughput_per_s': float(batch.shape[0] / (latencies.mean() / 1000)),
+        }
+    return report
+
+def predict_all(predict_fn, inputs, batch_size=1024):
+    return np.concatenate([predict_fn(np.asarray(inputs[i:i + batch_size], dtype=np.float32))
+                           for i in range(0, len(inputs), batch_size)])
+
+def score(probabilities, labels, reference=None):
+    """
+    Accuracy and cross-entropy loss of predicted class probabilities against one-hot labels,
+    and the drift from the reference (float Keras) probabilities when given.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.float64)
+    predicted = probabilities.argmax(axis=1)
+    metrics = {
+        'accuracy': float((predicted == labels.argmax(axis=1)).mean()),
+        'loss': float(-(labels * np.log(np.clip(probabilities, 1e-7, 1.0))).sum(axis=1).mean()),
+    }
+    if reference is not None:
+        reference = np.asarray(reference, dtype=np.float64)
+        metrics['drift'] = {
+            'prediction_agreement': float((predicted == reference.argmax(axis=1)).mean()),
+            'max_abs_diff': float(np.abs(probabilities - reference).max()),
+            'mean_abs_diff': float(np.abs(probabilities - reference).mean()),
+        }
+    return metrics
+
+def build_variants(model):
+    """
+    Returns {platform: (predict_fn, exported model bytes or None)} for every variant that could be built.
+    """
+    builders = {
+        'python_xla': lambda: (xla_predict_fn(model), None),
+        'python_tflite': lambda: _tflite_variant(model, quantize=False),
+        'python_tflite_int8': lambda: _tflite_variant(model, quantize=True),
+    }
+    variants = {}
+    for platform, build in builders.items():
+        try:
+            variants[platform] = build()
+        except Exception as e:  # e.g. a dtype policy the converter does not support
+            print(f"Warning: skipping inference variant {platform}: {e}")
+    return variants
+
+def _tflite_variant(model, quantize):
+    content = convert_tflite(model, quantize)
+    return tflite_predict_fn(content), content
+
+def harness_time_ms(report):
+    # harness_inference_time_ms of a platform: the warmed mean at the smallest batch size
+    return report[str(min(BATCH_SIZES))]['mean_ms']
+
+def single_predict_time_ms(predict_fn, inputs):
+    # inference_time_ms of a platform: one single-image prediction, the first one (cold), as python_gpu's
+    start = time.perf_counter()
+    predict_fn(np.asarray(inputs[:1], dtype=np.float32))
+    return (time.perf_counter() - start) * 1000
+
+def run_variants(model, test_images, test_labels, export_dir=None, export_name=None):
+    """
+    Benchmarks plain Keras and every variant with the same harness and scores each on the test set.
+    A variant's inference_time_ms is its first single-image prediction, as for python_gpu; the harness
+    mean is harness_inference_time_ms.
+    Returns the Keras report and {platform: results} for the variants. TFLite models are
+    saved as <export_dir>/<platform>/<platform>_<export_name>.tflite when export_dir is given.
+    """
+    reference_fn = keras_predict_fn(model)
+    reference = predict_all(reference_fn, test_images)
+    keras_report = {'benchmark': benchmark(reference_fn, test_images), **score(reference, test_labels)}
+
+    results = {}
+    for platform, (predict_fn, content) in build_variants(model).items():
+        inference_time = single_predict_time_ms(predict_fn, test_images)  # before anything warms it up
+        start = time.perf_counter()
+        probabilities = predict_all(predict_fn, test_images)
+        evaluation_time = (time.perf_counter() - start) * 1000
+        report = benchmark(predict_fn, test_images)
+        results[platform] = dict(score(probabilities, test_labels, reference),
+                                 benchmark=report,
+                                 inference_time_ms=inference_time,
+                                 harness_inference_time_ms=harness_time_ms(report),
+                                 evaluation_time_ms=evaluation_time)
+        if content is not None:
+            results[platform]['model_size_bytes'] = len(content)
+            if export_dir:
+                path = os.path.join(export_dir, platform, f"{platform}_{export_name}.tflite")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(content)
+                results[platform]['model_path'] = path
+    return keras_report, results
@@ -0,0 +1,134 @@
+import os
+import time
+import resource
+import tracemalloc
+import contextlib
+from collections import deque
+
+# Memory records of the most recent experiments, served by /api/metrics
+recent_experiments = deque(maxlen=50)
+
+def _read_status():
+    # VmRSS / VmHWM (peak RSS) of this process in kB, from /proc/self/status (Linux only)
+    values = {}
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+def rss_mb():
+    """
+    Current resident set size of this process in MB.
+    """
+    status = _read_status()
+    if 'VmRSS' in status:
+        return status['VmRSS'] / 1024
+    return peak_rss_mb()
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (since the last reset_peak_rss).
+    """
+    status = _read_status()
+    if 'VmHWM' in status:
+        return status['VmHWM'] / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+def reset_peak_rss():
+    """
+    Resets the kernel's peak RSS counter so the next phase reports its own peak.
+    Returns False when the platform does not allow it (the peak is then process-wide).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def process_memory():
+    """
+    Current and peak memory of this process, used by /api/metrics.
+    """
+    return {'rss_mb': rss_mb(), 'peak_rss_mb': peak_rss_mb()}
+
+def tf_allocator_stats():
+    """
+    TensorFlow allocator statistics per device where the runtime exposes them (GPUs, some CPU builds).
+    """
+    import tensorflow as tf
+
+    stats = {}
+    devices = ['CPU:0'] + [f"GPU:{i}" for i in range(len(tf.config.list_physical_devices('GPU')))]
+    for device in devices:
+        try:
+            info = tf.config.experimental.get_memory_info(device)
+            stats[device] = {'current_mb': info['current'] / 2**20, 'peak_mb': info['peak'] / 2**20}
+        except (ValueError, RuntimeError):
+            pass  # not supported for this device
+    return stats
+
+class MemoryProfiler:
+    """
+    Records RSS and peak RSS per experiment phase (load, train, evaluate, serialize).
+    With trace_allocations=True, tracemalloc also records the top Python/NumPy allocation
+    sites of each phase; it slows allocation down, so timings of traced runs are not comparable.
+    """
+
+    def __init__(self, trace_allocations=False, top=5):
+        self.trace_allocations = trace_allocations
+        self.top = top
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        peak_reset = reset_peak_rss()
+        rss_before = rss_mb()
+        started_tracing = False
+        if self.trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            snapshot_before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {
+                'duration_ms': (time.perf_counter() - start) * 1000,
+                'rss_before_mb': rss_before,
+                'rss_after_mb': rss_mb(),
+                'peak_rss_mb': peak_rss_mb(),
+                'peak_reset': peak_reset,
+            }
+            if self.trace_allocations:
+                record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+                record['top_allocations'] = self._top_allocations(snapshot_before)
+                if started_tracing:
+                    tracemalloc.stop()
+            self.phases[name] = record
+
+    def _top_allocations(self, snapshot_before):
+        stats = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')
+        return [{'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 'size_mb': stat.size_diff / 2**20,
+                 'count': stat.count_diff}
+                for stat in stats[:self.top]]
+
+    def peak_rss_mb(self):
+        return max((phase['peak_rss_mb'] for phase in self.phases.values()), default=peak_rss_mb())
+
+    def report(self, include_tf=True):
+        """
+        Returns the per-phase records, the overall peak RSS and TF allocator stats.
+        """
+        report = {'phases': self.phases, 'peak_rss_mb': self.peak_rss_mb(), 'trace_allocations': self.trace_allocations}
+        if include_tf:
+            report['tf_allocator'] = tf_allocator_stats()
+        return report
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from datetime import datetime, timezone
+
+# Request metrics of the server: per-route latency histograms, bytes served, requests in flight
+# and queued behind a training run, and utilization. Rendered in the Prometheus text format by
+# /api/metrics. ACCESS_LOG=<path> also appends one JSON line per request, for offline analysis.
+
+# Latency buckets in seconds, from static files to whole training runs
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+ACCESS_LOG = os.environ.get('ACCESS_LOG')
+# Methods kept as labels; anything else the client sends is counted as "other"
+METHODS = ('GET', 'POST', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'PATCH')
+
+def route_of(path, routes=()):
+    """
+    The route label of a request path: the API endpoint when it is one of routes (the handler's),
+    /api/predict for every served model, /api/other for any other API path and /static for files,
+    so the number of series stays bounded.
+    """
+    path = path.split('?', 1)[0]
+    if path.startswith('/api/predict/'):
+        return '/api/predict'
+    if path.startswith('/api/'):
+        return path if path in routes else '/api/other'
+    return '/static'
+
+def method_of(command):
+    # The method label of a request (command is None when the request line could not be parsed)
+    if not command:
+        return '-'
+    return command if command in METHODS else 'other'
+
+def _label(value):
+    # Escapes a label value for the text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (upper bound, requests at or below it), as Prometheus buckets are cumulative
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile, a coarse estimate
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return '+Inf'
+
+class Registry:
+    """
+    Counters of the server process, updated from the request threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}  # (route, method, status) -> count
+        self.latency = {}  # (route, method) -> Histogram
+        self.bytes_sent = {}  # route -> bytes
+        self.in_flight = 0
+        self.queued = 0
+        self.busy_seconds = 0.0  # request-seconds of all finished requests
+        self.training_seconds = 0.0  # seconds the training slot was held
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, route, method, status, seconds, bytes_sent):
+        with self.lock:
+            self.in_flight -= 1
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((route, method), Histogram()).observe(seconds)
+            self.bytes_sent[route] = self.bytes_sent.get(route, 0) + bytes_sent
+            self.busy_seconds += seconds
+
+    @contextlib.contextmanager
+    def queued_on(self, lock):
+        """
+        Acquires lock (the training slot), counting the request as queued while it waits and
+        the time the lock is held as training time.
+        """
+        with self.lock:
+            self.queued += 1
+        try:
+            lock.acquire()
+        finally:
+            with self.lock:
+                self.queued -= 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            lock.release()
+            with self.lock:
+                self.training_seconds += time.perf_counter() - start
+
+    def snapshot(self):
+        """
+        The metrics as a dict (used by /api/metrics?format=json).
+        """
+        with self.lock:
+            uptime = time.time() - self.started
+            return {
+                'uptime_seconds': uptime,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                # Average number of busy request threads, and the share of time a run held the training slot
+                'worker_utilization': self.busy_seconds / uptime if uptime else 0.0,
+                'training_utilization': self.training_seconds / uptime if uptime else 0.0,
+                'routes': {f'{method} {route}': {'count': histogram.count,
+                                                 'mean_ms': histogram.sum / histogram.count * 1000,
+                                                 'p50_le_s': histogram.quantile(0.5),
+                                                 'p99_le_s': histogram.quantile(0.99),
+                                                 'bytes_sent': self.bytes_sent.get(route, 0)}
+                           for (route, method), histogram in sorted(self.latency.items())},
+            }
+
+    def render(self, gauges=None):
+        """
+        The metrics in the Prometheus text exposition format; gauges adds {name: value} gauges
+        (e.g. process memory).
+        """
+        with self.lock:
+            uptime = time.time() - self.started
+            lines = ['# HELP http_requests_total Requests handled, by route, method and status.',
+                     '# TYPE http_requests_total counter']
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{route="{_label(route)}",method="{_label(method)}",'
+                             f'status="{_label(status)}"}} {count}')
+
+            lines += ['# HELP http_request_duration_seconds Request latency, by route and method.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for (route, method), histogram in sorted(self.latency.items()):
+                labels = f'route="{_label(route)}",method="{_label(method)}"'
+                for bound, total in histogram.cumulative():
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {histogram.count}')
+
+            lines += ['# HELP http_response_bytes_total Response bytes sent, by route.',
+                      '# TYPE http_response_bytes_total counter']
+            for route, count in sorted(self.bytes_sent.items()):
+                lines.append(f'http_response_bytes_total{{route="{_label(route)}"}} {count}')
+
+            values = {
+                'http_requests_in_flight': ('gauge', 'Requests being handled.', self.in_flight),
+                'http_requests_queued': ('gauge', 'Requests waiting for the training slot.', self.queued),
+                'http_worker_busy_seconds_total': ('counter', 'Request-seconds spent handling requests.', self.busy_seconds),
+                'training_busy_seconds_total': ('counter', 'Seconds the training slot was held.', self.training_seconds),
+                'http_worker_utilization': ('gauge', 'Average number of busy request threads since start.',
+                                            self.busy_seconds / uptime if uptime else 0.0),
+                'training_utilization': ('gauge', 'Share of time the training slot was held since start.',
+                                         self.training_seconds / uptime if uptime else 0.0),
+                'process_uptime_seconds': ('gauge', 'Seconds since the server started.', uptime),
+            }
+        for name, value in (gauges or {}).items():
+            values[name] = ('gauge', None, value)
+        for name, (kind, description, value) in values.items():
+            if description:
+                lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+class CountingWriter:
+    """
+    Wraps a handler's wfile to count the bytes written to the client.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.count = 0
+
+    def write(self, data):
+        written = self.file.write(data)
+        self.count += len(data) if written is None else written
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+_access_log_lock = threading.Lock()
+
+def log_access(record, path=None):
+    """
+    Appends one request to the JSON-lines access log, when ACCESS_LOG is set.
+    """
+    path = path or ACCESS_LOG
+    if not path:
+        return
+    record = dict(record, time=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z')
+    line = json.dumps(record) + '\n'
+    with _access_log_lock:
+        with open(path, 'a') as f:
+            f.write(line)
@@ -0,0 +1,75 @@
+import contextlib
+import numpy as np
+import tensorflow as tf
+
+# Supported dtype policies: name -> (dtype the data is stored in, Keras policy)
+# mixed_* keep float32 inputs and variables and compute in the lower precision.
+POLICIES = {
+    'float32': ('float32', 'float32'),
+    'float64': ('float64', 'float64'),
+    'bfloat16': ('bfloat16', 'bfloat16'),
+    'mixed_bfloat16': ('float32', 'mixed_bfloat16'),
+    'mixed_float16': ('float32', 'mixed_float16'),
+}
+
+DEFAULT_POLICY = 'float32'
+
+def resolve(policy):
+    """
+    Returns the policy name, falling back to the default when none is given.
+    """
+    policy = policy or DEFAULT_POLICY
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown dtype policy '{policy}', expected one of {list(POLICIES)}")
+    return policy
+
+def storage_dtype(policy):
+    """
+    Returns the NumPy dtype input data is kept in for the given policy.
+    """
+    name = POLICIES[resolve(policy)][0]
+    if name == 'bfloat16':
+        return tf.bfloat16.as_numpy_dtype  # NumPy has no native bfloat16
+    return np.dtype(name)
+
+def cache_dtype(policy):
+    """
+    Returns the dtype cached dataset files are stored in for the given policy.
+    NumPy cannot save bfloat16 files, so those are cached as float32 and cast after gathering.
+    """
+    return np.dtype('float64' if resolve(policy) == 'float64' else 'float32')
+
+def cast(array, policy):
+    """
+    Casts an array to the storage dtype of the policy, without copying when it already matches.
+    """
+    return np.asarray(array).astype(storage_dtype(policy), copy=False)
+
+def output_dtype(policy):
+    """
+    Returns the dtype of a model's output layer. Outputs stay at least float32 so
+    low-precision policies remain numerically stable in the loss.
+    """
+    return 'float64' if resolve(policy) == 'float64' else 'float32'
+
+def to_list(array):
+    """
+    Converts an array to nested Python lists for JSON results.
+    bfloat16 values are widened to float32 first, since their scalars are not JSON serializable.
+    """
+    array = np.asarray(array)
+    if array.dtype == storage_dtype('bfloat16'):
+        array = array.astype(np.float32)
+    return array.tolist()
+
+@contextlib.contextmanager
+def policy_scope(policy):
+    """
+    Sets the global Keras dtype policy while models are built and trained, then restores it.
+    """
+    previous = tf.keras.mixed_precision.global_policy().name
+    tf.keras.mixed_precision.set_global_policy(POLICIES[resolve(policy)][1])
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
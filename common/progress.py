@@ -0,0 +1,175 @@
+import json
+import math
+import time
+import uuid
+import threading
+from collections import deque, OrderedDict
+
+import tensorflow as tf
+
+# Events kept per job for subscribers that connect late, and number of jobs kept after they end
+BUFFER_SIZE = 512
+MAX_JOBS = 100
+# Seconds a job created by a subscriber waits for a run to claim it, and how many such jobs may wait at once
+CLAIM_TIMEOUT = 300
+MAX_UNCLAIMED = 20
+
+class Job:
+    """
+    Progress events of one training run, kept in a bounded ring buffer.
+
+    Every event gets an increasing id, so a subscriber resumes after the last id it saw
+    (the SSE Last-Event-ID). When the buffer has dropped events it missed, it continues
+    with the oldest event still buffered.
+    """
+
+    def __init__(self, job_id, buffer_size=BUFFER_SIZE, claimed=True):
+        self.job_id = job_id
+        self.events = deque(maxlen=buffer_size)
+        self.next_id = 1
+        self.done = False
+        self.abort_requested = False
+        self.claimed = claimed  # False while only subscribers know the job
+        self.created = time.monotonic()
+        self.condition = threading.Condition()
+
+    def publish(self, event, data=None):
+        with self.condition:
+            self.events.append((self.next_id, event, dict(data or {}, time=time.time())))
+            self.next_id += 1
+            self.condition.notify_all()
+
+    def finish(self, event='end', data=None):
+        """
+        Publishes the final event; subscribers stop streaming after it.
+        """
+        with self.condition:
+            self.publish(event, data)
+            self.done = True
+
+    def expire_unclaimed(self, claim_timeout=CLAIM_TIMEOUT):
+        """
+        Ends a job no run has claimed within claim_timeout seconds, so its subscribers stop waiting.
+        Returns True when the job is (now) ended that way.
+        """
+        with self.condition:
+            if not self.claimed and not self.done and time.monotonic() - self.created > claim_timeout:
+                self.finish('error', {'error': 'No run claimed the job'})
+            return not self.claimed and self.done
+
+    def request_abort(self):
+        with self.condition:
+            self.abort_requested = True
+            self.condition.notify_all()
+
+    def events_after(self, last_id, timeout=None):
+        """
+        Returns the buffered events with an id above last_id, waiting up to timeout
+        seconds for new ones. An empty list means the wait timed out (or the job is done).
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.done or (self.events and self.events[-1][0] > last_id), timeout)
+            return [event for event in self.events if event[0] > last_id]
+
+class JobRegistry:
+    """
+    Jobs by id. Subscribers may connect before the run starts, so jobs are created by whichever comes first;
+    a job created by a subscriber is claimed when the run starts, and ends unclaimed after CLAIM_TIMEOUT.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, max_unclaimed=MAX_UNCLAIMED):
+        self.max_jobs = max_jobs
+        self.max_unclaimed = max_unclaimed
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, job_id, create=False):
+        """
+        Returns the job, or None. With create, a missing job is created for a subscriber (unclaimed),
+        unless max_unclaimed jobs are already waiting for a run (None then too).
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None and create:
+                waiting = [old for old in self.jobs.values() if not old.expire_unclaimed() and not old.claimed]
+                if len(waiting) < self.max_unclaimed:
+                    job = self._add(Job(job_id, claimed=False))
+            return job
+
+    def create(self, job_id=None):
+        """
+        Returns the job of a starting run, claiming the one its subscribers created if there is one.
+        Raises ValueError when a run with job_id is still running.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id) if job_id else None
+            if job is not None:
+                with job.condition:
+                    if not job.done:
+                        if job.claimed:
+                            raise ValueError(f"Job '{job_id}' is still running")
+                        job.claimed = True
+                        return job
+            return self._add(Job(job_id or uuid.uuid4().hex))
+
+    def _add(self, job):
+        self.jobs[job.job_id] = job
+        self.jobs.move_to_end(job.job_id)
+        # Forget the oldest ended jobs; running ones are kept even above max_jobs
+        for key, old in list(self.jobs.items()):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if old is not job and (old.done or old.expire_unclaimed()):
+                del self.jobs[key]
+        return job
+
+# Jobs of this process
+jobs = JobRegistry()
+
+def _to_float(value):
+    value = float(value)
+    return value if math.isfinite(value) else None  # NaN/inf are not valid JSON
+
+class ProgressCallback(tf.keras.callbacks.Callback):
+    """
+    Publishes per-epoch metrics and elapsed time of a training run to a Job.
+    Training stops when an abort was requested for the job, or when the loss is no longer
+    finite (the run diverged); stop_reason is then 'aborted' or 'diverged'.
+    """
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self.stop_reason = None
+        self.start_time = None
+
+    def _stop(self, reason):
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            self.model.stop_training = True
+            self.job.publish('stopped', {'reason': reason})
+
+    def on_train_begin(self, logs=None):
+        self.start_time = time.time()
+        self.job.publish('train_begin', {'epochs': self.params.get('epochs')})
+
+    def on_train_batch_end(self, batch, logs=None):
+        # Checked every batch so an abort does not wait for the end of a long epoch
+        if self.job.abort_requested:
+            self._stop('aborted')
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        metrics = {name: _to_float(value) for name, value in logs.items()}
+        self.job.publish('epoch', dict(metrics, epoch=epoch + 1, epochs=self.params.get('epochs'),
+                                       elapsed_ms=(time.time() - self.start_time) * 1000))
+        if 'loss' in logs and not math.isfinite(float(logs['loss'])):
+            self._stop('diverged')
+        elif self.job.abort_requested:
+            self._stop('aborted')
+
+def format_event(event_id, event, data):
+    """
+    Formats an event for a text/event-stream response.
+    """
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
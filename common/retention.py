@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+# Retention of <model>/training_result/<sweep id>/ trees. The raw per-try artifacts of older sweeps
+# (result JSON, arrays, timelines, models, PNGs) are packed into one archive per sweep,
+# <sweep>/archive.zip, with <sweep>/archive_index.json listing its members. The aggregates stay
+# hot on disk: confidence_interval_metric.json and the metric CSVs. Single members are streamed
+# from the archive by the server, and a whole sweep is restored on demand (e.g. to plot it again).
+# Usage: python -m common.retention --keep-last 20 --max-age-days 30 [--dry-run]
+#        python -m common.retention --restore linear_regression 3
+
+MODELS = ('linear_regression', 'neural_network')
+ARCHIVE_NAME = 'archive.zip'
+INDEX_NAME = 'archive_index.json'
+HOT_NAMES = ('confidence_interval_metric.json', ARCHIVE_NAME, INDEX_NAME)
+HOT_EXTENSIONS = ('.csv',)
+# Already compressed files are stored as they are; everything else is deflated
+STORED_EXTENSIONS = ('.gz', '.zst', '.png', '.npz', '.keras', '.zip')
+
+# Defaults of the policy applied by the server when a sweep is created; RETENTION=off disables it
+DEFAULT_POLICY = {
+    'keep_last': int(os.environ.get('RETENTION_KEEP_LAST', 20)),  # newest sweeps kept hot
+    'max_age_days': float(os.environ['RETENTION_MAX_AGE_DAYS']) if os.environ.get('RETENTION_MAX_AGE_DAYS') else None,
+}
+ENABLED = os.environ.get('RETENTION', 'on') != 'off'
+
+SWEEP_PATTERN = re.compile(r'^(?P<sweep>(?:.*/)?(?P<model>[a-z_]+)/training_result/(?P<id>\d+))/(?P<member>.+)$')
+
+# One compaction at a time per process
+_lock = threading.Lock()
+
+def sweep_dir(model, sweep_id):
+    return f"{model}/training_result/{int(sweep_id)}"
+
+def sweeps(model, root='.'):
+    """
+    Returns the sweep ids of a model that have a directory, oldest first.
+    """
+    base = os.path.join(root, model, 'training_result')
+    if not os.path.isdir(base):
+        return []
+    return sorted(int(entry.name) for entry in os.scandir(base) if entry.is_dir() and entry.name.isdigit())
+
+def is_hot(member):
+    name = os.path.basename(member)
+    return name in HOT_NAMES or name.endswith(HOT_EXTENSIONS)
+
+def raw_files(directory):
+    """
+    Returns the members (paths relative to the sweep directory) that belong in its archive.
+    """
+    members = []
+    for current, _, files in os.walk(directory):
+        for name in files:
+            member = os.path.relpath(os.path.join(current, name), directory).replace(os.sep, '/')
+            if not is_hot(member) and not name.endswith('.tmp'):
+                members.append(member)
+    return sorted(members)
+
+def read_index(directory):
+    """
+    Returns the archive index of a sweep directory, or None when it has no archive.
+    """
+    try:
+        with open(os.path.join(directory, INDEX_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _last_modified(directory):
+    # Newest mtime of the sweep directory and its tries (not a full walk)
+    times = [os.stat(directory).st_mtime]
+    for entry in os.scandir(directory):
+        times.append(entry.stat().st_mtime)
+    return max(times)
+
+def _write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+def compact(directory):
+    """
+    Packs the raw files of a sweep directory into its archive (adding to an existing one) and
+    removes them. The archive is written next to the old one and renamed into place, and the
+    files are only deleted once it is complete. Returns (files archived, bytes freed).
+    """
+    members = raw_files(directory)
+    if not members:
+        return 0, 0
+    archive_path = os.path.join(directory, ARCHIVE_NAME)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + ARCHIVE_NAME, suffix='.tmp')
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+            if os.path.exists(archive_path):
+                # Members archived before, unless a newer copy is on disk again
+                with zipfile.ZipFile(archive_path, 'r') as previous:
+                    for info in previous.infolist():
+                        if info.filename not in members:
+                            with previous.open(info) as source, archive.open(info, 'w') as target:
+                                shutil.copyfileobj(source, target, 1024 * 1024)
+            for member in members:
+                compression = zipfile.ZIP_STORED if member.endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                archive.write(os.path.join(directory, member), member, compress_type=compression)
+        with zipfile.ZipFile(tmp_path, 'r') as archive:
+            files = {info.filename: {'size': info.file_size, 'compressed_size': info.compress_size,
+                                     'mtime': datetime(*info.date_time).strftime('%Y-%m-%dT%H:%M:%S')}
+                     for info in archive.infolist()}
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, archive_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    _write_json(os.path.join(directory, INDEX_NAME), {
+        'archive': ARCHIVE_NAME,
+        'compacted_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        'total_size': sum(entry['size'] for entry in files.values()),
+        'archive_size': os.path.getsize(archive_path),
+        'files': files,
+    })
+
+    freed = 0
+    for member in members:
+        path = os.path.join(directory, member)
+        freed += os.path.getsize(path)
+        os.remove(path)
+    # Drop the directories left empty (the tries keep their metric CSVs)
+    for current, _, _ in sorted(os.walk(directory), key=lambda entry: -len(entry[0])):
+        if current != directory and not os.listdir(current):
+            os.rmdir(current)
+    return len(members), freed
+
+def restore(directory, members=None):
+    """
+    Extracts members of a sweep's archive back into its directory (all of them by default),
+    leaving the archive as it is. Returns the members extracted.
+    """
+    archive_path = os.path.join(directory, ARCHIVE_NAME)
+    if not os.path.exists(archive_path):
+        return []
+    with _lock, zipfile.ZipFile(archive_path, 'r') as archive:
+        names = archive.namelist() if members is None else [member for member in members if member in archive.NameToInfo]
+        for member in names:
+            target = os.path.join(directory, member)
+            if not os.path.exists(target):
+                archive.extract(member, directory)
+    return names
+
+def locate(path):
+    """
+    Finds a file of an archived sweep: returns (archive path, member, size) when path (relative
+    to the server root, e.g. neural_network/training_result/3/1/python_gpu/python_gpu_sample_10%.json)
+    is in its sweep's archive, else None.
+    """
+    match = SWEEP_PATTERN.match(path.replace(os.sep, '/'))
+    if match is None:
+        return None
+    index = read_index(match.group('sweep'))
+    member = match.group('member')
+    if index is None or member not in index['files']:
+        return None
+    return os.path.join(match.group('sweep'), index['archive']), member, index['files'][member]['size']
+
+def open_member(archive_path, member):
+    """
+    Opens a member of an archive for streaming; closing it closes the archive.
+    """
+    archive = zipfile.ZipFile(archive_path, 'r')
+    try:
+        stream = archive.open(member)
+    except BaseException:
+        archive.close()
+        raise
+    close = stream.close
+
+    def close_both():
+        close()
+        archive.close()
+    stream.close = close_both
+    return stream
+
+def extract(path):
+    """
+    Restores a single archived file in place (e.g. a model to serve). Returns True when it exists afterwards.
+    """
+    if os.path.exists(path):
+        return True
+    found = locate(path)
+    if found is None:
+        return False
+    restore(os.path.dirname(found[0]), [found[1]])
+    return os.path.exists(path)
+
+def ensure_hot(model, sweep_id):
+    """
+    Restores an archived sweep before it is read as a whole (e.g. plotted again). It is packed
+    again by a later compaction.
+    """
+    return restore(sweep_dir(model, sweep_id))
+
+def expired(model, policy=None, root='.', now=None):
+    """
+    Returns the sweep ids of a model the policy moves to the archive: those not among the
+    keep_last newest and, when max_age_days is set, last modified longer ago than that.
+    """
+    policy = dict(DEFAULT_POLICY, **(policy or {}))
+    ids = sweeps(model, root)
+    candidates = ids[:-policy['keep_last']] if policy['keep_last'] else ids
+    if policy['max_age_days'] is None:
+        return candidates
+    now = now or time.time()
+    cutoff = now - policy['max_age_days'] * 86400
+    return [sweep_id for sweep_id in candidates
+            if _last_modified(os.path.join(root, sweep_dir(model, sweep_id))) < cutoff]
+
+def apply_policy(policy=None, root='.', dry_run=False):
+    """
+    Compacts the expired sweeps of every model. Returns a report per compacted sweep.
+    """
+    report = []
+    with _lock:
+        for model in MODELS:
+            for sweep_id in expired(model, policy, root):
+                directory = os.path.join(root, sweep_dir(model, sweep_id))
+                if dry_run:
+                    members = raw_files(directory)
+                    if members:
+                        report.append({'model': model, 'sweep': sweep_id, 'files': len(members),
+                                       'bytes': sum(os.path.getsize(os.path.join(directory, member)) for member in members)})
+                    continue
+                files, freed = compact(directory)
+                if files:
+                    index = read_index(directory)
+                    report.append({'model': model, 'sweep': sweep_id, 'files': files, 'bytes': freed,
+                                   'archive_size': index['archive_size']})
+    return report
+
+def apply_policy_in_background(policy=None):
+    """
+    Runs apply_policy on a daemon thread (used when the server creates a sweep), unless
+    retention is disabled or a compaction is already running.
+    """
+    if not ENABLED or _lock.locked():
+        return None
+
+    def run():
+        try:
+            for entry in apply_policy(policy):
+                print(f"Archived {entry['model']} sweep {entry['sweep']}: {entry['files']} files, "
+                      f"{entry['bytes'] / 2**20:.1f} MB -> {entry['archive_size'] / 2**20:.1f} MB")
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Warning: retention failed: {e}")
+    thread = threading.Thread(target=run, name='retention', daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive the raw artifacts of older sweeps.")
+    parser.add_argument('--keep-last', type=int, default=DEFAULT_POLICY['keep_last'], help="newest sweeps kept hot per model")
+    parser.add_argument('--max-age-days', type=float, default=DEFAULT_POLICY['max_age_days'],
+                        help="only archive sweeps last modified longer ago than this")
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--restore', nargs=2, metavar=('MODEL', 'SWEEP_ID'), help="extract an archived sweep again")
+    args = parser.parse_args()
+
+    if args.restore:
+        members = ensure_hot(*args.restore)
+        print(f"Restored {len(members)} files of {sweep_dir(*args.restore)}")
+        return
+    report = apply_policy({'keep_last': args.keep_last, 'max_age_days': args.max_age_days}, dry_run=args.dry_run)
+    for entry in report:
+        print(json.dumps(entry))
+    total = sum(entry['bytes'] for entry in report)
+    print(f"{'Would archive' if args.dry_run else 'Archived'} {len(report)} sweeps, {total / 2**20:.1f} MB of raw files")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import argparse
+import contextlib
+import subprocess
+import tempfile
+
+# Environment variables read by the OpenMP / MKL / TensorFlow thread pools when they start
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+
+def parse_cpu_list(value):
+    """
+    Parses a CPU list such as "0-3,6" into [0, 1, 2, 3, 6].
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (list, tuple)):
+        return sorted(int(cpu) for cpu in value)
+    cpus = set()
+    for part in str(value).split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+def run_config_from_query(query_params):
+    """
+    Builds a run configuration from /api/run_python query parameters.
+    """
+    def value(name):
+        return query_params.get(name, [None])[0]
+
+    config = {
+        'intra_op_threads': value('intra_op_threads'),
+        'inter_op_threads': value('inter_op_threads'),
+        'omp_threads': value('omp_threads'),
+        'cpu_affinity': value('cpu_affinity'),
+    }
+    return {key: val for key, val in config.items() if val not in (None, '')}
+
+def thread_env(config):
+    """
+    Returns the environment variables that pin the thread pools of a child process.
+    """
+    env = {}
+    omp_threads = config.get('omp_threads') or config.get('intra_op_threads')
+    if omp_threads:
+        env['OMP_NUM_THREADS'] = str(omp_threads)
+        env['MKL_NUM_THREADS'] = str(omp_threads)
+    if config.get('intra_op_threads'):
+        env['TF_NUM_INTRAOP_THREADS'] = str(config['intra_op_threads'])
+    if config.get('inter_op_threads'):
+        env['TF_NUM_INTEROP_THREADS'] = str(config['inter_op_threads'])
+    return env
+
+def set_affinity(cpus):
+    """
+    Pins every thread of the current process to the given CPUs.
+    os.sched_setaffinity(0, ...) only affects the calling thread, so each task id is set.
+    """
+    task_dir = '/proc/self/task'
+    tids = [int(tid) for tid in os.listdir(task_dir)] if os.path.isdir(task_dir) else [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except (ProcessLookupError, PermissionError):
+            pass  # the thread exited in the meantime
+
+def runtime_started(tf):
+    # TensorFlow refuses new thread pool sizes once its runtime is up; setting the current size probes that
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(tf.config.threading.get_intra_op_parallelism_threads())
+        return False
+    except RuntimeError:
+        return True
+
+@contextlib.contextmanager
+def applied_run_config(config=None):
+    """
+    Applies TensorFlow intra/inter-op threads, OMP/MKL thread counts and CPU affinity for the
+    duration of a run, and yields the settings actually in effect for the experiment metadata.
+    The previous CPU affinity and thread environment are restored afterwards, so a run inside a
+    long-running process (the server) does not leave it pinned.
+
+    Thread pools only take their sizes when the runtime starts, so once it has (e.g. in the
+    server after its first run) the thread settings are not applied: the request is recorded
+    with "applied": false and the values in effect are reported instead. Use a child process
+    for those, as /api/thread_scaling does.
+    """
+    import tensorflow as tf
+
+    config = dict(config or {})
+    applied = True
+    warnings = []
+    previous_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    previous_affinity = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+
+    env = thread_env(config)
+    if env and runtime_started(tf):
+        applied = False
+        warnings.append("Thread pools already initialized, so the thread settings were not applied; run in a child process")
+    else:
+        os.environ.update(env)
+        if config.get('intra_op_threads'):
+            tf.config.threading.set_intra_op_parallelism_threads(int(config['intra_op_threads']))
+        if config.get('inter_op_threads'):
+            tf.config.threading.set_inter_op_parallelism_threads(int(config['inter_op_threads']))
+
+    cpus = parse_cpu_list(config.get('cpu_affinity'))
+    pinned = cpus is not None and previous_affinity is not None
+    if pinned:
+        set_affinity(cpus)
+
+    metadata = {
+        'requested': config,
+        'applied': applied,
+        'intra_op_threads': tf.config.threading.get_intra_op_parallelism_threads(),  # 0 means TF picks
+        'inter_op_threads': tf.config.threading.get_inter_op_parallelism_threads(),
+        'cpu_count': os.cpu_count(),
+        'cpu_affinity': sorted(os.sched_getaffinity(0)) if previous_affinity is not None else None,
+        'env': {name: os.environ.get(name) for name in THREAD_ENV_VARS},
+    }
+    if warnings:
+        metadata['warnings'] = warnings
+        print("Warning: " + "; ".join(warnings))
+    try:
+        yield metadata
+    finally:
+        if pinned:
+            set_affinity(previous_affinity)
+        for name, value in previous_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def default_thread_counts(max_threads=None):
+    """
+    Returns 1, 2, 4 ... up to max_threads (the usable CPU count by default), always including max_threads.
+    """
+    if max_threads is None:
+        max_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    counts = []
+    n = 1
+    while n < max_threads:
+        counts.append(n)
+        n *= 2
+    counts.append(max_threads)
+    return counts
+
+def run_child(model, dataset, sample, threads, dtype=None):
+    """
+    Runs one experiment in a fresh Python process pinned to the given number of threads
+    (intra-op, OMP/MKL and CPU affinity), since TensorFlow cannot resize its pools in-process.
+    """
+    config = {'intra_op_threads': threads, 'inter_op_threads': 1, 'omp_threads': threads}
+    if hasattr(os, 'sched_getaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+        config['cpu_affinity'] = ','.join(str(cpu) for cpu in available[:threads])
+
+    env = dict(os.environ)
+    env.update(thread_env(config))
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        output_path = tmp.name
+    try:
+        subprocess.run([sys.executable, '-m', 'common.runtime', '--model', model, '--dataset', str(dataset),
+                        '--sample', sample, '--config', json.dumps(config), '--output', output_path]
+                       + (['--dtype', dtype] if dtype else []),
+                       env=env, check=True)
+        with open(output_path, 'r') as f:
+            return json.load(f)
+    finally:
+        os.remove(output_path)
+
+def thread_scaling(model, dataset, sample, thread_counts=None, tries=1, dtype=None, save_dir=None):
+    """
+    Benchmarks training time with 1, 2, 4 ... N threads and plots the speedup curve.
+    Results and plot are saved to <model>/training_result/thread_scaling_<sample>.json/.png.
+    """
+    thread_counts = thread_counts or default_thread_counts()
+    runs = []
+    for threads in thread_counts:
+        for i in range(tries):
+            result = run_child(model, dataset, sample, threads, dtype)
+            runs.append({'threads': threads, 'try': i + 1, 'training_time_ms': result['training_time_ms'],
+                         'run_config': result['run_config']})
+            print(f"threads={threads} try={i + 1}: {result['training_time_ms']:.1f} ms")
+
+    mean_times = {}
+    for threads in thread_counts:
+        times = [run['training_time_ms'] for run in runs if run['threads'] == threads]
+        mean_times[threads] = sum(times) / len(times)
+    baseline = mean_times[thread_counts[0]]
+    speedup = {threads: baseline / mean_times[threads] for threads in thread_counts}
+
+    save_dir = save_dir or f"{model}/training_result"
+    name = f"thread_scaling_{str(sample).replace('%', '')}%"
+    result = {'model': model, 'sample': sample, 'dtype': dtype, 'thread_counts': thread_counts,
+              'mean_training_time_ms': mean_times, 'speedup': speedup, 'runs': runs}
+    os.makedirs(save_dir, exist_ok=True)
+    with open(os.path.join(save_dir, name + ".json"), 'w') as f:
+        json.dump(result, f, indent=4)
+    plot_speedup(f"{model} sample {sample}", thread_counts, speedup, os.path.join(save_dir, name + ".png"))
+    return result
+
+def plot_speedup(title, thread_counts, speedup, save_path):
+    """
+    Plots the measured speedup against the ideal linear speedup and saves the plot.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(8, 6))
+    plt.plot(thread_counts, [speedup[n] for n in thread_counts], marker='o', label='Measured Speedup')
+    plt.plot(thread_counts, [n / thread_counts[0] for n in thread_counts], linestyle='--', color='gray', label='Linear Speedup')
+    plt.xlabel('Threads')
+    plt.ylabel('Speedup (training time)')
+    plt.title('Thread Scaling: ' + title)
+    plt.legend()
+    plt.grid(True)
+    plt.savefig(save_path)
+    plt.close()
+    print(f"Thread scaling plot saved to {save_path}")
+
+def main():
+    # Child entry point used by run_child: python -m common.runtime --model ... --output result.json
+    parser = argparse.ArgumentParser(description="Run one Python-platform experiment with a fixed thread configuration.")
+    parser.add_argument('--model', choices=['linear_regression', 'neural_network'], required=True)
+    parser.add_argument('--dataset', type=int, default=0)
+    parser.add_argument('--sample', required=True)
+    parser.add_argument('--dtype', default=None)
+    parser.add_argument('--config', default='{}')
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    if args.model == 'linear_regression':
+        from linear_regression.app.python import linear_regression as trainer
+    else:
+        from neural_network.app.python import neural_network as trainer
+
+    data = trainer.process(args.dataset, 1, args.sample, 0, args.dtype, json.loads(args.config), export=False)
+    with open(args.output, 'w') as f:
+        json.dump({'training_time_ms': data['results']['training_time_ms'],
+                   'run_config': data['experiment']['run_config']}, f)
+
+if __name__ == '__main__':
+    main()
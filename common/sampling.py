@@ -0,0 +1,132 @@
+import os
+import json
+import numpy as np
+
+def parse_fraction(sample):
+    """
+    Converts a sample label such as "25%" into a fraction (0.25).
+    """
+    return float(str(sample).strip().rstrip('%')) / 100
+
+def sample_name(fraction):
+    """
+    Returns the file-name label used for a fraction, e.g. 0.1 -> "sample_10%".
+    """
+    return f"sample_{fraction * 100:g}%"
+
+def index_path(cache_dir, name, fraction, seed):
+    """
+    Location of the cached row-index file for a given split.
+    """
+    return os.path.join(cache_dir, f"{name}_{fraction * 100:g}%_seed{seed}.npy")
+
+def _save_npy(path, array):
+    # Write to a temp file first so a half-written cache is never picked up
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+def count_rows(csv_path, cache_dir=None):
+    """
+    Returns the number of data rows of a CSV file (lines minus the header).
+
+    The count is cached as <cache_dir>/<file name>.rows.json with the file's size and
+    modification time, so the file is only read again after it changed.
+    """
+    stat = os.stat(csv_path)
+    path = os.path.join(cache_dir, os.path.basename(csv_path) + ".rows.json") if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('size') == stat.st_size and cached.get('mtime') == stat.st_mtime:
+            return cached['rows']
+
+    with open(csv_path, 'rb') as f:
+        rows = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+        if stat.st_size:
+            f.seek(-1, os.SEEK_END)
+            rows += f.read(1) != b'\n'  # a last line without a newline
+    rows = max(0, rows - 1)  # minus the header row
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'rows': rows}, f)
+        os.replace(tmp_path, path)
+    return rows
+
+def sample_indices(n_rows, fraction, seed=1, cache_dir=None, name="sample"):
+    """
+    Returns the uint32 row indices of a split over a base dataset of n_rows.
+
+    The split is drawn with np.random.RandomState(seed).choice, which selects the
+    same rows as df.sample(frac=fraction, random_state=seed), and is cached as
+    <cache_dir>/<name>_<pct>%_seed<seed>.npy so every loader shares it.
+    A fraction of 1.0 is the base dataset in its original order, and seed=None
+    gives the unshuffled prefix used by the browser apps.
+    """
+    if fraction >= 1.0:
+        return np.arange(n_rows, dtype=np.uint32)
+    if seed is None:
+        return np.arange(int(n_rows * fraction), dtype=np.uint32)
+
+    path = index_path(cache_dir, name, fraction, seed) if cache_dir else None
+    if path and os.path.exists(path):
+        indices = np.load(path)
+        if indices.size == 0 or indices.max() < n_rows:
+            return indices
+
+    size = int(round(fraction * n_rows))
+    indices = np.random.RandomState(seed).choice(n_rows, size=size, replace=False).astype(np.uint32)
+    if path:
+        _save_npy(path, indices)
+    return indices
+
+def load_base_array(json_path, dtype=None):
+    """
+    Loads a JSON-encoded array as a read-only memmap.
+
+    The first call converts the JSON file into a .npy file next to it (one per dtype
+    when dtype is given); later calls memory-map that file instead of parsing the
+    JSON again.
+    """
+    stem = os.path.splitext(json_path)[0]
+    npy_path = f"{stem}.{np.dtype(dtype).name}.npy" if dtype else stem + ".npy"
+    if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(json_path):
+        with open(json_path, 'r') as f:
+            array = np.asarray(json.load(f), dtype=dtype)
+        _save_npy(npy_path, array)
+        del array
+    return np.load(npy_path, mmap_mode='r')
+
+def take_rows(base, indices):
+    """
+    Gathers the given rows of a base array into memory with a single fancy index.
+    """
+    if indices.size and indices[-1] == indices.size - 1 and np.all(indices[:-1] < indices[1:]):
+        # Contiguous prefix: slice instead of gathering row by row
+        return np.array(base[:indices.size])
+    return np.asarray(base[indices])
+
+def stratified_indices(classes, size, seed=0):
+    """
+    Returns sorted uint32 indices of `size` rows with the class proportions of `classes`
+    (a class id per row): each class gets its share of size, the largest remainders
+    rounding up, and its rows are drawn with np.random.RandomState(seed).
+    """
+    classes = np.asarray(classes)
+    if size >= classes.shape[0]:
+        return np.arange(classes.shape[0], dtype=np.uint32)
+    values, counts = np.unique(classes, return_counts=True)
+    shares = counts * size / classes.shape[0]
+    allocated = np.floor(shares).astype(int)
+    for i in np.argsort(-(shares - allocated), kind='stable')[:size - allocated.sum()]:
+        allocated[i] += 1
+
+    random = np.random.RandomState(seed)
+    chosen = [random.choice(np.flatnonzero(classes == value), size=n, replace=False)
+              for value, n in zip(values, allocated) if n]
+    return np.sort(np.concatenate(chosen)).astype(np.uint32)
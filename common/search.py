@@ -0,0 +1,362 @@
+import os
+import json
+import math
+import random
+import argparse
+import itertools
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from common import datasets
+from common import sampling
+
+# Hyperparameter search over the Python trainers: grid, random, successive halving and Hyperband.
+# Usage: python -m common.search --model neural_network --sample 10% --strategy halving --trials 27 --workers 4
+
+# Search spaces: name -> list of values, or {"low": ..., "high": ..., "log": true, "int": false} for random draws
+DEFAULT_SPACES = {
+    'linear_regression': {
+        'learning_rate': [0.001, 0.003, 0.01, 0.03, 0.1],
+        'batch_size': [256, 1024, 4096],
+    },
+    'neural_network': {
+        'learning_rate': [0.003, 0.01, 0.03, 0.1],
+        'batch_size': [32, 128, 512],
+        'hidden_units': [16, 32, 64, 128],
+    },
+}
+
+# Metric each trial is ranked by (lower is better), the per-epoch metric halving cuts trials on,
+# and the epoch budget range used by halving/Hyperband
+OBJECTIVES = {'linear_regression': 'mse', 'neural_network': 'val_loss'}
+CURVE_METRICS = {'linear_regression': 'loss', 'neural_network': 'val_loss'}
+EPOCH_BUDGETS = {'linear_regression': (25, 200), 'neural_network': (1, 9)}
+
+HYPERPARAMETER_CASTS = {'learning_rate': float, 'batch_size': int, 'hidden_units': int, 'epochs': int}
+
+def hyperparameters_from_query(query_params):
+    """
+    Builds trainer hyperparameter overrides from /api/run_python query parameters, or None when none are given.
+    """
+    overrides = {name: cast(query_params[name][0]) for name, cast in HYPERPARAMETER_CASTS.items()
+                 if query_params.get(name, [''])[0] != ''}
+    return overrides or None
+
+def grid(space):
+    """
+    Every combination of the listed values of a search space.
+    """
+    names = sorted(space)
+    for name in names:
+        if not isinstance(space[name], list):
+            raise ValueError(f"Grid search needs a list of values for '{name}'")
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def sample_config(space, rng):
+    """
+    Draws one configuration from a search space.
+    """
+    config = {}
+    for name, values in sorted(space.items()):
+        if isinstance(values, list):
+            config[name] = rng.choice(values)
+        else:
+            low, high = values['low'], values['high']
+            if values.get('log'):
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                value = rng.uniform(low, high)
+            config[name] = int(round(value)) if values.get('int') else value
+    return config
+
+def random_configs(space, n, seed=None):
+    rng = random.Random(seed)
+    return [sample_config(space, rng) for _ in range(n)]
+
+class RungStopper:
+    """
+    Stands in for the progress job of a successive halving trial (see common/progress.py). At each
+    rung (epoch budget) it records the trial's curve metric, and requests an abort when it is worse
+    than the best 1/eta of the values other trials recorded at that rung (asynchronous successive
+    halving, Li et al., 2020), so a poor configuration stops there instead of training on.
+    rungs holds the epoch budgets, the shared scores ({rung: values}) and lock, and eta.
+    """
+
+    def __init__(self, metric, rungs):
+        self.metric = metric
+        self.epochs = rungs['epochs']
+        self.scores = rungs['scores']
+        self.lock = rungs['lock']
+        self.eta = rungs['eta']
+        self.abort_requested = False
+        self.rung = None  # the last rung the trial reached
+
+    def publish(self, event, data=None):
+        if event != 'epoch' or data.get('epoch') not in self.epochs:
+            return
+        self.rung = self.epochs.index(data['epoch'])
+        value = data.get(self.metric)
+        if value is None:
+            return  # not validated at this epoch, or not finite (the run stops as diverged)
+        with self.lock:
+            recorded = list(self.scores.get(self.rung, []))
+            self.scores[self.rung] = recorded + [value]
+        if self.rung < len(self.epochs) - 1 and recorded and value > np.percentile(recorded, 100 * (1 - 1 / self.eta)):
+            self.abort_requested = True
+
+def run_trial(model, sample, params, dtype=None, threads=None, convergence_policy=None, shared_datasets=None, rungs=None):
+    """
+    Trains one configuration in this (pool worker) process and returns its score and per-epoch curve.
+    shared_datasets are the specs of datasets the parent shared, used instead of loading them again.
+    With rungs (see RungStopper), the trial is cut at the first rung where its curve falls behind.
+    """
+    datasets.register(shared_datasets)
+    if model == 'linear_regression':
+        from linear_regression.app.python import linear_regression as trainer
+    else:
+        from neural_network.app.python import neural_network as trainer
+
+    run_config = {'intra_op_threads': threads, 'inter_op_threads': 1, 'omp_threads': threads} if threads else None
+    stopper = RungStopper(CURVE_METRICS[model], rungs) if rungs else None
+    try:
+        data = trainer.process(0, 1, sample, 0, dtype, run_config, export=False,
+                               convergence_policy=convergence_policy, hyperparameters=params, progress_job=stopper)
+        results = data['results']
+        if model == 'linear_regression':
+            score, curve = results['mse'], results['loss_history']
+        else:
+            score, curve = results['val_loss_values'][-1], results['val_loss_values']
+    except Exception as e:  # including a run that recorded no validation (no score)
+        return {'params': params, 'score': None, 'error': repr(e)}
+
+    trial = {
+        'params': params,
+        'score': None if score is None or math.isnan(score) else float(score),
+        'curve': [float(value) for value in curve],
+        'training_time_ms': results['training_time_ms'],
+        'convergence': results.get('convergence'),
+    }
+    if stopper:
+        trial['rung'] = stopper.rung
+        trial['cut'] = stopper.abort_requested
+    return trial
+
+class Search:
+    """
+    Runs trials concurrently on a process pool. Each worker gets an equal share of the CPUs
+    (intra-op/OMP threads), so concurrent trials do not oversubscribe the machine.
+    Workers are spawned rather than forked, since TensorFlow is not fork-safe.
+    The MNIST split is loaded once into shared memory and read by all workers (see common/datasets.py).
+    """
+
+    def __init__(self, model, sample, workers=None, dtype=None, convergence_policy=None):
+        self.model = model
+        self.sample = sample
+        self.workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self.threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.dtype = dtype
+        self.convergence_policy = convergence_policy
+        self.trials = []
+        self.shared_key = None
+        self.shared_datasets = None
+
+    def __enter__(self):
+        if self.model == 'neural_network':
+            from neural_network.app.python import neural_network
+            fraction = sampling.parse_fraction(self.sample)
+            self.shared_key = neural_network.dataset_key(fraction, None, self.dtype)
+            self.shared_datasets = datasets.pool.acquire(self.shared_key, lambda: neural_network.load_mnist(fraction, dtype=self.dtype))
+        try:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        except BaseException:
+            # __exit__ does not run when __enter__ fails, so the segments would never be unlinked
+            if self.shared_key:
+                datasets.pool.release(self.shared_key)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.pool.shutdown()  # workers keep their views until they exit, so unlink after them
+        finally:
+            if self.shared_key:
+                datasets.pool.release(self.shared_key)
+
+    def evaluate(self, configs, epochs=None, bracket=None, rungs=None):
+        """
+        Trains the configurations concurrently (with a fixed epoch budget if given) and records the trials.
+        """
+        futures = []
+        for config in configs:
+            params = dict(config, epochs=epochs) if epochs else dict(config)
+            futures.append(self.pool.submit(run_trial, self.model, self.sample, params, self.dtype,
+                                            self.threads, self.convergence_policy, self.shared_datasets, rungs))
+        trials = []
+        for config, future in zip(configs, futures):
+            trial = dict(future.result(), config=config, trial=len(self.trials) + 1)
+            if bracket is not None:
+                trial['bracket'] = bracket
+            self.trials.append(trial)
+            trials.append(trial)
+            print(f"trial {trial['trial']} {trial['params']}: {self.objective()}={trial['score']}")
+        return trials
+
+    def objective(self):
+        return OBJECTIVES[self.model]
+
+    def successive_halving(self, configs, min_epochs, max_epochs, eta=3, bracket=None):
+        """
+        Trains every configuration towards max_epochs once, with rungs at min_epochs, eta times that
+        and so on: at each rung a trial goes on only while its per-epoch curve metric is within the
+        best 1/eta of the trials that reached the rung (see RungStopper), so survivors are never
+        retrained from scratch. Diverged or failed trials are always cut.
+        """
+        epochs, rung_epochs = min_epochs, []
+        while epochs < max_epochs:
+            rung_epochs.append(epochs)
+            epochs *= eta
+        rung_epochs.append(max_epochs)
+        # The rungs' values are shared by the trials running in the pool's processes
+        with multiprocessing.get_context('spawn').Manager() as manager:
+            rungs = {'epochs': rung_epochs, 'scores': manager.dict(), 'lock': manager.Lock(), 'eta': eta}
+            return self.evaluate(configs, max_epochs, bracket, rungs)
+
+    def hyperband(self, space, min_epochs, max_epochs, eta=3, seed=None):
+        """
+        Runs successive halving brackets that trade the number of configurations against
+        their starting epoch budget (Li et al., 2018).
+        """
+        rng = random.Random(seed)
+        s_max = int(math.log(max_epochs / min_epochs, eta) + 1e-9)
+        for s in range(s_max, -1, -1):
+            n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            epochs = max(min_epochs, int(round(max_epochs * eta ** -s)))
+            configs = [sample_config(space, rng) for _ in range(n)]
+            self.successive_halving(configs, epochs, max_epochs, eta, bracket=s_max - s)
+
+    def leaderboard(self):
+        """
+        Trials ranked by the objective; for each configuration only its largest-budget trial counts.
+        A trial cut by halving is ranked by its objective where it stopped.
+        """
+        best = {}
+        for trial in self.trials:
+            if trial['score'] is None:
+                continue
+            key = json.dumps(trial['config'], sort_keys=True)
+            if key not in best or trial['params'].get('epochs', 0) >= best[key]['params'].get('epochs', 0):
+                best[key] = trial
+        return sorted(best.values(), key=lambda trial: trial['score'])
+
+def _write_json(path, data):
+    # Written to a temporary file and renamed, so readers never see a partial leaderboard
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+def save_results(search, strategy, settings, results_dir=None):
+    """
+    Saves all trials to <model>/training_result/search/<timestamp>_<strategy>.json and records the
+    best configuration per platform and sample in <model>/training_result/leaderboard.json,
+    replacing the previous entry only when the new score is better.
+    """
+    results_dir = results_dir or f"{search.model}/training_result"
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+    ranking = search.leaderboard()
+    search_path = f"{results_dir}/search/{timestamp.replace(':', '-')}_{strategy}.json"
+    record = {
+        'model': search.model,
+        'sample': search.sample,
+        'platform': 'python_gpu',
+        'strategy': strategy,
+        'objective': search.objective(),
+        'settings': settings,
+        'timestamp': timestamp,
+        'trial_count': len(search.trials),
+        'total_training_time_ms': sum(trial.get('training_time_ms', 0) for trial in search.trials),
+        'leaderboard': ranking,
+        'trials': search.trials,
+    }
+    _write_json(search_path, record)
+
+    leaderboard_path = f"{results_dir}/leaderboard.json"
+    leaderboard = {}
+    if os.path.exists(leaderboard_path):
+        with open(leaderboard_path, 'r') as f:
+            leaderboard = json.load(f)
+    if ranking:
+        entries = leaderboard.setdefault('python_gpu', {})
+        current = entries.get(search.sample)
+        if current is None or current['objective'] != search.objective() or ranking[0]['score'] < current['score']:
+            entries[search.sample] = {'params': ranking[0]['params'], 'score': ranking[0]['score'],
+                                      'objective': search.objective(), 'strategy': strategy,
+                                      'search_path': search_path, 'timestamp': timestamp}
+        _write_json(leaderboard_path, leaderboard)
+    record['search_path'] = search_path
+    return record
+
+def run_search(model, sample, strategy='halving', space=None, trials=None, workers=None, min_epochs=None,
+               max_epochs=None, eta=3, seed=None, dtype=None, convergence_policy=None, results_dir=None):
+    """
+    Runs a hyperparameter search and persists its trials and leaderboard.
+    trials is the number of random configurations (random and halving); grid uses the whole space
+    and Hyperband sizes its own brackets.
+    """
+    space = space or DEFAULT_SPACES[model]
+    # The search sets the epochs of every trial (its rungs), so a max_epochs in the convergence
+    # policy would override them; without it, a policy of only max_epochs means no early stopping
+    convergence_policy = {name: value for name, value in (convergence_policy or {}).items() if name != 'max_epochs'} or None
+    default_min, default_max = EPOCH_BUDGETS[model]
+    min_epochs = min_epochs or default_min
+    max_epochs = max_epochs or default_max
+    settings = {'space': space, 'trials': trials, 'min_epochs': min_epochs, 'max_epochs': max_epochs,
+                'eta': eta, 'seed': seed, 'dtype': dtype, 'convergence': convergence_policy}
+
+    with Search(model, sample, workers, dtype, convergence_policy) as search:
+        settings['workers'], settings['threads_per_worker'] = search.workers, search.threads
+        if strategy == 'grid':
+            search.evaluate(grid(space), max_epochs)
+        elif strategy == 'random':
+            search.evaluate(random_configs(space, trials or 10, seed), max_epochs)
+        elif strategy == 'halving':
+            search.successive_halving(random_configs(space, trials or 27, seed), min_epochs, max_epochs, eta)
+        elif strategy == 'hyperband':
+            search.hyperband(space, min_epochs, max_epochs, eta, seed)
+        else:
+            raise ValueError(f"Unknown search strategy '{strategy}'")
+
+    return save_results(search, strategy, settings, results_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Search hyperparameters of the Python trainers.")
+    parser.add_argument('--model', choices=['linear_regression', 'neural_network'], required=True)
+    parser.add_argument('--sample', default='10%')
+    parser.add_argument('--strategy', choices=['grid', 'random', 'halving', 'hyperband'], default='halving')
+    parser.add_argument('--space', default=None, help="JSON search space, e.g. '{\"learning_rate\": [0.01, 0.1]}'")
+    parser.add_argument('--trials', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--min-epochs', type=int, default=None)
+    parser.add_argument('--max-epochs', type=int, default=None)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--dtype', default=None)
+    parser.add_argument('--patience', type=int, default=None, help="also stop trials early once their loss plateaus")
+    args = parser.parse_args()
+
+    convergence_policy = {'patience': args.patience} if args.patience else None
+    record = run_search(args.model, args.sample, args.strategy, json.loads(args.space) if args.space else None,
+                        args.trials, args.workers, args.min_epochs, args.max_epochs, args.eta, args.seed,
+                        args.dtype, convergence_policy)
+    print(f"{record['trial_count']} trials, saved to {record['search_path']}")
+    for rank, trial in enumerate(record['leaderboard'][:5], 1):
+        print(f"{rank}. {record['objective']}={trial['score']:.6g} {trial['params']}")
+
+if __name__ == '__main__':
+    main()
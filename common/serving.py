@@ -0,0 +1,252 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from common import retention
+
+# Defaults for the micro-batcher, overridable through the environment
+MAX_BATCH_SIZE = int(os.environ.get('SERVING_MAX_BATCH_SIZE', 64))
+MAX_WAIT_MS = float(os.environ.get('SERVING_MAX_WAIT_MS', 5))
+
+class Unavailable(Exception):
+    # The prediction did not finish in time, or the model was replaced while it was queued
+    pass
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predict requests into one batched model call.
+
+    Requests wait at most max_wait_ms for others to join, and a batch holds at most
+    max_batch_size rows. Latency (queueing + inference) is recorded per request.
+    Inputs must be (rows x n_features); n_features is taken from the model when known.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, window=10000, n_features=None):
+        self.predict_fn = predict_fn
+        self.n_features = n_features
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.requests = queue.Queue()
+        self.latencies_ms = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.request_count = 0
+        self.row_count = 0
+        self.error_count = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, inputs):
+        """
+        Queues a (rows x features) array and returns a Future with its predictions.
+        Raises ValueError for inputs of another shape.
+        """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if inputs.ndim != 2 or inputs.shape[0] == 0:
+            raise ValueError(f"Expected inputs of shape (rows, features), got {inputs.shape}")
+        if self.n_features is not None and inputs.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features per row, got {inputs.shape[1]}")
+        future = Future()
+        # Checked and queued under the lock close() and the final drain take, so a request is either
+        # refused or queued ahead of the close sentinel, where it is answered
+        with self.lock:
+            if self.closed:
+                raise Unavailable("The model was replaced")
+            self.requests.put((inputs, future, time.perf_counter()))
+        return future
+
+    def predict(self, inputs, timeout=30):
+        future = self.submit(inputs)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise Unavailable(f"No prediction within {timeout} s")
+
+    def close(self):
+        """
+        Stops the batching thread once the requests queued so far are answered.
+        """
+        with self.lock:
+            self.closed = True
+            self.requests.put(None)
+
+    def _collect(self):
+        # Block for the first request, then gather more until the batch is full or the wait is over.
+        # Returns the batch and whether the batcher was closed.
+        request = self.requests.get()
+        if request is None:
+            return [], True
+        batch = [request]
+        rows = request[0].shape[0]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+            rows += request[0].shape[0]
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            # Requests whose caller gave up waiting are skipped
+            batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+            # Rows of different widths (when the model's is unknown) are predicted apart, so a
+            # mismatch fails only the requests of that width
+            groups = {}
+            for request in batch:
+                groups.setdefault(request[0].shape[1], []).append(request)
+            for group in groups.values():
+                self._predict_group(group)
+        with self.lock:
+            while not self.requests.empty():
+                request = self.requests.get()
+                if request is not None and request[1].set_running_or_notify_cancel():
+                    request[1].set_exception(Unavailable("The model was replaced"))
+
+    def _predict_group(self, batch):
+        try:
+            inputs = np.concatenate([request[0] for request in batch])
+            outputs = np.asarray(self.predict_fn(inputs))
+        except Exception as e:
+            with self.lock:
+                self.error_count += len(batch)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        done = time.perf_counter()
+        offset = 0
+        with self.lock:
+            for request_inputs, future, submitted in batch:
+                rows = request_inputs.shape[0]
+                future.set_result(outputs[offset:offset + rows])
+                offset += rows
+                self.latencies_ms.append((done - submitted) * 1000)
+            self.batch_sizes.append(inputs.shape[0])
+            self.request_count += len(batch)
+            self.row_count += inputs.shape[0]
+
+    def stats(self):
+        """
+        p50/p99 latency over the recent window and throughput since the batcher started.
+        """
+        with self.lock:
+            latencies = np.array(self.latencies_ms)
+            batch_sizes = np.array(self.batch_sizes)
+            elapsed = time.time() - self.started
+            return {
+                'requests': self.request_count,
+                'rows': self.row_count,
+                'errors': self.error_count,
+                'batches': len(batch_sizes),
+                'mean_batch_size': float(batch_sizes.mean()) if batch_sizes.size else 0.0,
+                'p50_latency_ms': float(np.percentile(latencies, 50)) if latencies.size else None,
+                'p99_latency_ms': float(np.percentile(latencies, 99)) if latencies.size else None,
+                'throughput_rps': self.request_count / elapsed if elapsed > 0 else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+            }
+
+def load_predict_fn(model_path):
+    """
+    Loads an exported Keras model and returns a function predicting a batch with it, and the
+    number of features per row it expects (None when unknown).
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    n_features = model.input_shape[-1] if len(model.input_shape) == 2 else None
+    return (lambda inputs: model.predict_on_batch(inputs)), n_features
+
+class ModelRegistry:
+    """
+    Keeps trained models in memory for serving, one MicroBatcher per model name.
+
+    Names are either a model type ("linear_regression", "neural_network"), which serves the
+    latest model trained by this server, or "<model>/<result_item_id>/<try>/<sample>"
+    (e.g. "neural_network/3/1/10%"), which loads the model exported by that experiment.
+    """
+
+    def __init__(self, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.paths = {}
+        self.batchers = {}
+        self.loading = {}  # name -> lock held while its model loads
+        self.lock = threading.Lock()
+
+    def register(self, name, model_path):
+        """
+        Registers (or replaces) the model served under name.
+        """
+        with self.lock:
+            self.paths[name] = model_path
+            batcher = self.batchers.pop(name, None)  # loaded again on the next request
+        if batcher is not None:
+            batcher.close()  # its thread ends, releasing the old model
+
+    def resolve_path(self, name):
+        if name in self.paths:
+            return self.paths[name]
+        parts = name.strip('/').split('/')
+        if len(parts) == 4 and parts[0] in ('linear_regression', 'neural_network'):
+            model, result_item_id, tries, sample = parts
+            try:
+                return f"{model}/training_result/{int(result_item_id)}/{int(tries)}/python_gpu/python_gpu_sample_{float(sample.rstrip('%')):g}%_model.keras"
+            except ValueError:
+                return None
+        return None
+
+    def get(self, name):
+        """
+        Returns the MicroBatcher of a model, loading the model on first use.
+        Raises KeyError when no model is available under name.
+        The model loads outside the registry lock, so lookups of other models do not wait for it;
+        concurrent first requests of the same name wait for one load.
+        """
+        with self.lock:
+            if name in self.batchers:
+                return self.batchers[name]
+            loading = self.loading.setdefault(name, threading.Lock())
+        with loading:
+            while True:
+                with self.lock:
+                    if name in self.batchers:
+                        return self.batchers[name]
+                    path = self.resolve_path(name)
+                # The model of an archived sweep is extracted from its archive (see common/retention.py)
+                if path is None or not retention.extract(path):
+                    raise KeyError(name)
+                predict_fn, n_features = load_predict_fn(path)
+                batcher = MicroBatcher(predict_fn, self.max_batch_size, self.max_wait_ms, n_features=n_features)
+                with self.lock:
+                    if self.resolve_path(name) == path:
+                        self.batchers[name] = batcher
+                        return batcher
+                batcher.close()  # registered again while it loaded: load the new model instead
+
+    def stats(self):
+        with self.lock:
+            batchers = dict(self.batchers)
+        return {name: batcher.stats() for name, batcher in batchers.items()}
+
+# Models served by this process
+registry = ModelRegistry()
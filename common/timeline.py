@@ -0,0 +1,262 @@
+import os
+import time
+import tempfile
+import threading
+from array import array
+
+import numpy as np
+
+from common import memory
+
+# Resource timeline of a training run: a background thread samples CPU, per-core utilization,
+# RSS and I/O of this process every TIMELINE_INTERVAL_MS (default 50 ms, 0 disables it) into
+# array-backed columns, and the trainers mark the end of every epoch. The timeline is saved as
+# <result>.timeline.npz next to the result and overlaid on the loss plots, so a slow try can be
+# traced to CPU contention, memory growth or I/O instead of being averaged away.
+# psutil is used when installed; otherwise os.times() and /proc (Linux) are read directly.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+INTERVAL_MS = float(os.environ.get('TIMELINE_INTERVAL_MS', 50))
+COLUMNS = ('t', 'cpu_percent', 'rss_mb', 'read_bytes', 'write_bytes')
+
+class _ProcReader:
+    # Counters without psutil: process CPU time from os.times(), the rest from /proc when available
+
+    def cpu_seconds(self):
+        times = os.times()
+        return times.user + times.system
+
+    def core_times(self):
+        # (busy, total) jiffies per core from /proc/stat
+        cores = []
+        try:
+            with open('/proc/stat', 'r') as f:
+                for line in f:
+                    if line.startswith('cpu') and line[3].isdigit():
+                        values = [int(value) for value in line.split()[1:]]
+                        idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+                        cores.append((sum(values) - idle, sum(values)))
+        except OSError:
+            pass
+        return cores
+
+    def rss_mb(self):
+        return memory.rss_mb()
+
+    def io_bytes(self):
+        values = {}
+        try:
+            with open('/proc/self/io', 'r') as f:
+                for line in f:
+                    name, value = line.split(':', 1)
+                    values[name] = int(value)
+        except (OSError, ValueError):
+            pass
+        return values.get('read_bytes', 0), values.get('write_bytes', 0)
+
+class _PsutilReader(_ProcReader):
+
+    def __init__(self):
+        self.process = psutil.Process()
+
+    def cpu_seconds(self):
+        times = self.process.cpu_times()
+        return times.user + times.system
+
+    def core_times(self):
+        cores = []
+        for times in psutil.cpu_times(percpu=True):
+            total = sum(times)
+            idle = times.idle + getattr(times, 'iowait', 0)
+            cores.append((total - idle, total))
+        return cores
+
+    def rss_mb(self):
+        return self.process.memory_info().rss / 2**20
+
+    def io_bytes(self):
+        try:
+            counters = self.process.io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, psutil.Error):  # not available on macOS
+            return 0, 0
+
+class ResourceSampler:
+    """
+    Samples this process on a background thread while it is entered:
+    t (seconds since start), cpu_percent (of one core, so up to 100 x cores), per-core utilization (%),
+    rss_mb, and read/write bytes since start. mark(name) records a timestamp, e.g. every epoch end.
+    """
+
+    def __init__(self, interval_ms=None):
+        self.interval_ms = INTERVAL_MS if interval_ms is None else interval_ms
+        self.reader = _PsutilReader() if psutil is not None else _ProcReader()
+        self.columns = {name: array('d') for name in COLUMNS}
+        self.per_core = array('d')
+        self.cores = 0
+        self.marks = {}
+        self.stopping = threading.Event()
+        self.thread = None
+        self.start_time = None
+
+    @property
+    def enabled(self):
+        return self.interval_ms > 0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        if self.enabled:
+            self.previous = self._counters()
+            self.base_io = self.previous['io']
+            self.cores = len(self.previous['cores'])
+            self.thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        return False
+
+    def mark(self, name):
+        if self.start_time is not None:
+            self.marks.setdefault(name, array('d')).append(time.perf_counter() - self.start_time)
+
+    def _counters(self):
+        return {'time': time.perf_counter(), 'cpu': self.reader.cpu_seconds(), 'cores': self.reader.core_times(),
+                'io': self.reader.io_bytes()}
+
+    def _run(self):
+        while not self.stopping.wait(self.interval_ms / 1000):
+            self._sample()
+        self._sample()  # the end of the run
+
+    def _sample(self):
+        current = self._counters()
+        elapsed = current['time'] - self.previous['time']
+        if elapsed <= 0:
+            return
+        self.columns['t'].append(current['time'] - self.start_time)
+        self.columns['cpu_percent'].append((current['cpu'] - self.previous['cpu']) / elapsed * 100)
+        self.columns['rss_mb'].append(self.reader.rss_mb())
+        self.columns['read_bytes'].append(current['io'][0] - self.base_io[0])
+        self.columns['write_bytes'].append(current['io'][1] - self.base_io[1])
+        if self.cores and len(current['cores']) == self.cores:
+            for (busy, total), (previous_busy, previous_total) in zip(current['cores'], self.previous['cores']):
+                self.per_core.append((busy - previous_busy) / (total - previous_total) * 100 if total > previous_total else 0.0)
+        else:
+            self.per_core.extend([float('nan')] * self.cores)
+        self.previous = current
+
+    def arrays(self):
+        """
+        The timeline as arrays: the columns, per_core (samples x cores) and mark_<name> per mark.
+        """
+        arrays = {'t': np.frombuffer(self.columns['t'], dtype=np.float64).copy(),
+                  'cpu_percent': np.frombuffer(self.columns['cpu_percent'], dtype=np.float64).astype(np.float32),
+                  'rss_mb': np.frombuffer(self.columns['rss_mb'], dtype=np.float64).astype(np.float32),
+                  'read_bytes': np.frombuffer(self.columns['read_bytes'], dtype=np.float64).astype(np.int64),
+                  'write_bytes': np.frombuffer(self.columns['write_bytes'], dtype=np.float64).astype(np.int64),
+                  'per_core': np.frombuffer(self.per_core, dtype=np.float64).astype(np.float32).reshape(-1, self.cores or 1)[:, :self.cores]}
+        for name, values in self.marks.items():
+            arrays['mark_' + name] = np.frombuffer(values, dtype=np.float64).copy()
+        return arrays
+
+    def summary(self):
+        """
+        Aggregates of the timeline, saved with the results.
+        """
+        arrays = self.arrays()
+        cpu, rss = arrays['cpu_percent'], arrays['rss_mb']
+        summary = {'interval_ms': self.interval_ms, 'samples': int(arrays['t'].size), 'cores': self.cores,
+                   'source': 'psutil' if psutil is not None else 'proc',
+                   'epochs_marked': int(arrays.get('mark_epoch_end', np.empty(0)).size)}
+        if arrays['t'].size:
+            summary.update({
+                'duration_s': float(arrays['t'][-1]),
+                'cpu_percent_mean': float(cpu.mean()),
+                'cpu_percent_max': float(cpu.max()),
+                'core_utilization_mean': float(np.nanmean(arrays['per_core'])) if arrays['per_core'].size else None,
+                'rss_mb_max': float(rss.max()),
+                'rss_mb_growth': float(rss[-1] - rss[0]),
+                'read_mb': float(arrays['read_bytes'][-1] / 2**20),
+                'write_mb': float(arrays['write_bytes'][-1] / 2**20),
+            })
+        return summary
+
+def timeline_path(result_path):
+    """
+    Location of the timeline of a result: <result>.timeline.npz next to it.
+    """
+    stem = result_path[:-len('.json')] if result_path.endswith('.json') else result_path
+    return stem + '.timeline.npz'
+
+def save(path, arrays):
+    """
+    Writes timeline arrays as a compressed .npz, atomically. Lists (a timeline received as JSON
+    from a cluster worker, with null for NaN) are stored as float64 arrays.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez_compressed(file, **{name: values if isinstance(values, np.ndarray) else np.asarray(values, dtype=np.float64)
+                                         for name, values in arrays.items()})
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+def load(result_file, results):
+    """
+    Loads the timeline saved with a result (result_file is the path it was read from), or None.
+    """
+    info = (results or {}).get('timeline') or {}
+    if not info.get('path'):
+        return None
+    path = os.path.join(os.path.dirname(result_file), info['path'])
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+def epoch_positions(arrays):
+    """
+    Maps the sample times onto the epoch axis of the loss plots, where the value of epoch i is
+    drawn at x = i - 1: epoch i spans (i - 2, i - 1]. None without epoch marks.
+    """
+    ends = arrays.get('mark_epoch_end')
+    starts = arrays.get('mark_train_start')
+    if ends is None or not ends.size or starts is None or not starts.size:
+        return None
+    times = np.concatenate([starts[:1], ends])
+    return np.interp(arrays['t'], times, np.arange(-1, ends.size), left=np.nan, right=np.nan)
+
+def overlay(ax, arrays):
+    """
+    Draws the process CPU% and RSS of a timeline on twin axes of an epoch plot. Returns the lines drawn.
+    """
+    x = epoch_positions(arrays)
+    if x is None:
+        return []
+    inside = ~np.isnan(x)
+    cpu_axis = ax.twinx()
+    cpu_line, = cpu_axis.plot(x[inside], arrays['cpu_percent'][inside], color='gray', alpha=0.5, linewidth=0.8,
+                              label='Process CPU %')
+    cpu_axis.set_ylabel('CPU %')
+    cpu_axis.set_ylim(bottom=0)
+    rss_axis = ax.twinx()
+    rss_axis.spines['right'].set_position(('axes', 1.12))
+    rss_line, = rss_axis.plot(x[inside], arrays['rss_mb'][inside], color='green', alpha=0.6, linewidth=0.8,
+                              label='RSS MB')
+    rss_axis.set_ylabel('RSS MB')
+    return [cpu_line, rss_line]
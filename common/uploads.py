@@ -0,0 +1,308 @@
+import os
+import json
+import zlib
+import tempfile
+from array import array
+
+import numpy as np
+
+from common import artifacts
+
+# Request bodies of /api/append_experiment and /api/save_json_object are streamed to a temporary
+# file instead of being read into memory, then parsed from there. Browser results carry per-row
+# arrays (features, predictions ...); with ijson installed those are collected straight into
+# typed buffers and saved as .npy files, without building the Python lists at all.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+MAX_BODY_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 512)) * 1024 * 1024)
+CHUNK_SIZE = 1024 * 1024
+
+# Keys whose top-level arrays are moved to .npy files: {"experiment": ..., "results": {"features": [...]}}
+ARRAY_PARENTS = ('results', 'jsonObject')
+
+class BodyTooLarge(Exception):
+    pass
+
+class BadBody(ValueError):
+    pass
+
+class _NotNumeric(Exception):
+    pass
+
+def _fixed_length(rfile, length):
+    remaining = length
+    while remaining > 0:
+        chunk = rfile.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise BadBody("Request body ended before Content-Length bytes")
+        remaining -= len(chunk)
+        yield chunk
+
+def _chunked(rfile):
+    # Transfer-Encoding: chunked, i.e. "<hex size>[;extensions]\r\n<data>\r\n" ... "0\r\n<trailers>\r\n"
+    while True:
+        line = rfile.readline(1024)
+        try:
+            size = int(line.split(b';')[0].strip(), 16)
+        except ValueError:
+            raise BadBody("Malformed chunk size")
+        if size == 0:
+            while rfile.readline(1024).strip():
+                pass  # trailers
+            return
+        yield from _fixed_length(rfile, size)
+        rfile.readline(1024)  # CRLF after the chunk
+
+def spool_body(rfile, headers, max_bytes=None, directory=None):
+    """
+    Streams a request body to a temporary file, undoing chunked transfer encoding and gzip (or
+    deflate) content encoding, and returns its path; the caller removes it. Raises BodyTooLarge
+    when the body, before or after decompression, exceeds max_bytes, and BadBody for a body
+    that cannot be decoded.
+    """
+    max_bytes = MAX_BODY_BYTES if max_bytes is None else max_bytes
+    encoding = headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    elif encoding in ('identity', ''):
+        decompressor = None
+    else:
+        raise BadBody(f"Unsupported Content-Encoding '{encoding}'")
+
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        chunks = _chunked(rfile)
+    else:
+        length = int(headers.get('Content-Length') or 0)
+        if length > max_bytes:
+            raise BodyTooLarge(f"Request body of {length} bytes exceeds {max_bytes} bytes")
+        chunks = _fixed_length(rfile, length)
+
+    fd, path = tempfile.mkstemp(dir=directory, prefix='upload_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            received = written = 0
+            for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise BodyTooLarge(f"Request body exceeds {max_bytes} bytes")
+                if decompressor is None:
+                    file.write(chunk)
+                    continue
+                try:
+                    # Bounded output per call, so a small body cannot expand into an unbounded one
+                    while chunk:
+                        data = decompressor.decompress(chunk, CHUNK_SIZE)
+                        written += len(data)
+                        if written > max_bytes:
+                            raise BodyTooLarge(f"Decompressed request body exceeds {max_bytes} bytes")
+                        file.write(data)
+                        chunk = decompressor.unconsumed_tail
+                except zlib.error as e:
+                    raise BadBody(f"Invalid {encoding} request body: {e}")
+            if decompressor is not None:
+                if not decompressor.eof:
+                    raise BadBody(f"Truncated {encoding} request body")
+                file.write(decompressor.flush())
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+class _ArrayCollector:
+    """
+    Collects a JSON array of numbers, or of equally long rows of numbers, into a flat buffer.
+    Raises _NotNumeric for anything else (strings, objects, ragged rows, deeper nesting).
+    """
+
+    def __init__(self):
+        self.values = array('d')
+        self.rows = []
+        self.depth = 0
+        self.integral = True
+
+    def event(self, event, value):
+        # Returns True once the array is closed; an event that does not fit leaves the state as it was
+        if event == 'start_array':
+            if self.depth == 2 or (self.depth == 1 and self.values and not self.rows):
+                raise _NotNumeric()
+            self.depth += 1
+            if self.depth == 2:
+                self.rows.append(0)
+        elif event == 'end_array':
+            self.depth -= 1
+            return self.depth == 0
+        elif event == 'number' and not isinstance(value, bool):
+            if self.depth == 1 and self.rows:
+                raise _NotNumeric()
+            self.values.append(value)
+            self.integral = self.integral and isinstance(value, int)
+            if self.depth == 2:
+                self.rows[-1] += 1
+        else:
+            raise _NotNumeric()
+        return False
+
+    def to_array(self):
+        if not self.rows:
+            shape = (len(self.values),)
+        elif len(set(self.rows)) == 1:
+            shape = (len(self.rows), self.rows[0])
+        else:
+            raise _NotNumeric()
+        values = np.frombuffer(self.values, dtype=np.float64).reshape(shape)
+        return values.astype(np.int64) if self.integral else values
+
+    def replay(self, builder, closed=True):
+        # Feeds what was collected back as the original events; when not closed, the arrays
+        # still open (self.depth of them) are left open
+        numbers = [int(value) for value in self.values] if self.integral else self.values
+        builder.event('start_array', None)
+        if self.rows:
+            offset = 0
+            for index, length in enumerate(self.rows):
+                builder.event('start_array', None)
+                for number in numbers[offset:offset + length]:
+                    builder.event('number', number)
+                if closed or index < len(self.rows) - 1 or self.depth < 2:
+                    builder.event('end_array', None)
+                offset += length
+        else:
+            for number in numbers:
+                builder.event('number', number)
+        if closed:
+            builder.event('end_array', None)
+
+def _spooled_ref(array, directory):
+    fd, path = tempfile.mkstemp(dir=directory, prefix='upload_', suffix='.npy')
+    with os.fdopen(fd, 'wb') as file:
+        np.save(file, array, allow_pickle=False)
+    return artifacts.array_ref(path, array)
+
+def _emit_ref(builder, ref):
+    builder.event('start_map', None)
+    builder.event('map_key', '$npy')
+    builder.event('string', ref['$npy'])
+    builder.event('map_key', 'shape')
+    builder.event('start_array', None)
+    for size in ref['shape']:
+        builder.event('number', size)
+    builder.event('end_array', None)
+    builder.event('map_key', 'dtype')
+    builder.event('string', ref['dtype'])
+    builder.event('end_map', None)
+
+def _stream_load(file, array_parents, threshold, directory, spooled):
+    builder = ijson.common.ObjectBuilder()
+    collector = None
+    passthrough = 0  # depth of an array being built as plain lists after it turned out not numeric
+    for prefix, event, value in ijson.parse(file, use_float=True):
+        if passthrough:
+            passthrough += {'start_array': 1, 'start_map': 1, 'end_array': -1, 'end_map': -1}.get(event, 0)
+            builder.event(event, value)
+            continue
+        if collector is not None:
+            try:
+                closed = collector.event(event, value)
+            except _NotNumeric:
+                # e.g. a list of strings: replay what was collected and build the rest as usual
+                collector.replay(builder, closed=False)
+                passthrough = collector.depth
+                collector = None
+                passthrough += {'start_array': 1, 'start_map': 1, 'end_array': -1, 'end_map': -1}.get(event, 0)
+                builder.event(event, value)
+                continue
+            if closed:
+                try:
+                    array_value = collector.to_array()
+                except _NotNumeric:  # ragged rows
+                    array_value = None
+                if array_value is not None and array_value.size >= threshold:
+                    ref = _spooled_ref(array_value, directory)
+                    spooled.append(ref['$npy'])
+                    _emit_ref(builder, ref)
+                else:
+                    collector.replay(builder)
+                collector = None
+            continue
+        parent, _, key = prefix.partition('.')
+        if event == 'start_array' and parent in array_parents and key and '.' not in key:
+            collector = _ArrayCollector()
+            collector.event(event, value)
+            continue
+        builder.event(event, value)
+    return builder.value
+
+def load(path, array_parents=ARRAY_PARENTS, threshold=None, directory=None):
+    """
+    Parses a spooled JSON body and returns (data, spooled). Large numeric arrays among the values
+    of the array_parents objects (e.g. results.features) are saved to temporary .npy files, listed
+    in spooled, and replaced with references, which artifacts.externalize_arrays moves next to the
+    result. Raises BadBody for invalid JSON, and for array references sent in the body itself.
+    """
+    threshold = artifacts.ARRAY_THRESHOLD if threshold is None else threshold
+    spooled = []
+    try:
+        if ijson is not None:
+            try:
+                with open(path, 'rb') as file:
+                    data = _stream_load(file, array_parents, threshold, directory, spooled)
+            except (ijson.JSONError, UnicodeDecodeError) as e:
+                raise BadBody(f"Invalid JSON: {e}")
+        else:
+            try:
+                with open(path, 'rb') as file:
+                    data = json.load(file)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise BadBody(f"Invalid JSON: {e}")
+            # Without ijson the lists are built once, then converted so they are not kept around
+            for values in _parents(data, array_parents):
+                for key, value in list(values.items()):
+                    if artifacts.is_array_ref(value):
+                        continue  # rejected below
+                    array_value = artifacts.numeric_array(value, threshold)
+                    if array_value is not None:
+                        ref = _spooled_ref(array_value, directory)
+                        spooled.append(ref['$npy'])
+                        values[key] = ref
+
+        # Only references to the arrays spooled here are moved into place later
+        for values in _parents(data, array_parents):
+            for key, value in values.items():
+                if artifacts.is_array_ref(value) and value['$npy'] not in spooled:
+                    raise BadBody(f"Unexpected array reference in '{key}'")
+        return data, spooled
+    except BaseException:
+        for spooled_path in spooled:
+            if os.path.exists(spooled_path):
+                os.remove(spooled_path)
+        raise
+
+def _parents(data, array_parents):
+    # The array_parents objects of a body
+    for parent in array_parents:
+        values = data.get(parent) if isinstance(data, dict) else None
+        if isinstance(values, dict):
+            yield values
+
+def discard(spooled):
+    """
+    Removes the arrays spooled for a body (see load) that were not moved into place.
+    """
+    for path in spooled:
+        if os.path.exists(path):
+            os.remove(path)
+
+def read_body(rfile, headers, max_bytes=None):
+    """
+    Spools and parses a request body, see spool_body and load. Returns (data, spooled).
+    """
+    path = spool_body(rfile, headers, max_bytes)
+    try:
+        return load(path)
+    finally:
+        os.remove(path)
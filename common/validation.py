@@ -0,0 +1,86 @@
+import time
+import numpy as np
+import tensorflow as tf
+
+from common import sampling
+
+# Validation cadence of the neural network: how often the validation set is evaluated during
+# training, on how many rows, and whether the final metrics come from the last validation or
+# from a separate model.evaluate over the test set. The resolved config is saved with the results.
+DEFAULT_CONFIG = {
+    'freq': 1,             # validate every `freq` epochs
+    'subset': None,        # stratified subset of the test set with this many rows (None: all of it)
+    'seed': 0,             # seed of the subset
+    'final': 'evaluate',   # evaluate: model.evaluate on the full test set after training
+                           # reuse: the validation of the final epoch (validated even when off cadence)
+}
+
+def resolve_config(config):
+    """
+    Fills in the defaults of a validation config.
+    """
+    resolved = dict(DEFAULT_CONFIG)
+    resolved.update({key: value for key, value in (config or {}).items() if value is not None})
+    if resolved['freq'] < 1:
+        raise ValueError(f"Validation frequency must be at least 1, got {resolved['freq']}")
+    if resolved['final'] not in ('evaluate', 'reuse'):
+        raise ValueError(f"Unknown final validation '{resolved['final']}', expected evaluate or reuse")
+    return resolved
+
+def config_from_query(query_params):
+    """
+    Builds a validation config from /api/run_python query parameters (validation_freq,
+    validation_subset, validation_seed, reuse_validation=true), or None when none are given.
+    """
+    casts = {'validation_freq': ('freq', int), 'validation_subset': ('subset', int), 'validation_seed': ('seed', int)}
+    config = {name: cast(query_params[param][0]) for param, (name, cast) in casts.items()
+              if query_params.get(param, [''])[0] != ''}
+    if query_params.get('reuse_validation', [''])[0] != '':
+        config['final'] = 'reuse' if query_params['reuse_validation'][0] == 'true' else 'evaluate'
+    return config or None
+
+def subset(images, labels, config):
+    """
+    Returns the validation images and one-hot labels: the whole test set, or a stratified
+    subset of config['subset'] rows with the class proportions of the test set.
+    """
+    if not config['subset'] or config['subset'] >= labels.shape[0]:
+        return images, labels
+    indices = sampling.stratified_indices(np.argmax(labels, axis=1), config['subset'], config['seed'])
+    return np.asarray(images[indices]), np.asarray(labels[indices])
+
+class ValidationCallback(tf.keras.callbacks.Callback):
+    """
+    Collects the validation metrics of the epochs Keras validated (every validation_freq epochs).
+    validate_last_epoch() validates an epoch that ended training off cadence (or by stopping early)
+    once more, so the final metrics can be reused instead of running model.evaluate.
+    """
+
+    def __init__(self, val_images, val_labels):
+        super().__init__()
+        self.val_images = val_images
+        self.val_labels = val_labels
+        self.validated_epochs = []
+        self.val_loss_values = []
+        self.val_accuracy_values = []
+        self.last_epoch = 0
+        self.final_time_ms = 0.0
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.last_epoch = epoch + 1
+        if logs and 'val_loss' in logs:
+            self.record(epoch + 1, logs['val_loss'], logs['val_accuracy'])
+
+    def validate_last_epoch(self):
+        # Called after model.fit returns, so this pass is not counted as training time
+        if self.validated_epochs and self.validated_epochs[-1] == self.last_epoch:
+            return
+        start = time.time()
+        metrics = self.model.evaluate(self.val_images, self.val_labels, verbose=0, return_dict=True)
+        self.final_time_ms = (time.time() - start) * 1000
+        self.record(self.last_epoch, metrics['loss'], metrics['accuracy'])
+
+    def record(self, epoch, loss, accuracy):
+        self.validated_epochs.append(epoch)
+        self.val_loss_values.append(loss)
+        self.val_accuracy_values.append(accuracy)
@@ -10,20 +10,34 @@
 import tensorflow as tf
 import numpy as np
 import pandas as pd 
+from scipy import sparse
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.metrics import mean_squared_error, r2_score
 import argparse
 import os
 import json
 import time
 from datetime import datetime, timezone
+from common import sampling
+from common import precision
+from common import runtime
+from common import memory
+from common import convergence
+from common import progress
+from common import timeline
 
-def fetch_dataset(dataset_path, target_column, feature_categories):
+# Training hyperparameters; any of them can be overridden per run (see common/search.py)
+DEFAULT_HYPERPARAMETERS = {'learning_rate': 0.01, 'batch_size': 4096, 'epochs': 200}
+
+def fetch_dataset(dataset_path, target_column, feature_categories, indices=None):
     """
     Loads dataset from CSV, extracts the target column, and optionally one-hot encodes categorical features.
+    When indices is given, only those rows of the CSV are kept.
     """
     df = pd.read_csv(dataset_path)
+    if indices is not None:
+        df = df.take(indices)
     target = df[target_column].values.reshape(-1, 1)
     features = df.drop(target_column, axis=1)
 
@@ -31,108 +45,254 @@ def fetch_dataset(dataset_path, target_column, feature_categories):
         features = pd.get_dummies(features, columns=feature_categories)
 
     return features, target
+
+def fetch_sparse_dataset(dataset_path, target_column, feature_columns, categorical_columns=None, indices=None, dtype=precision.DEFAULT_POLICY):
+    """
+    Loads the dataset for multi-feature training as a scipy.sparse CSR matrix, so memory grows
+    with the non-zeros rather than rows x categories. Numeric columns are standardized;
+    categorical columns (the given ones and any text column) are one-hot encoded and scaled
+    to unit variance without centering, which keeps them sparse.
+    feature_columns is a list of column names, or "all" for every column but the target.
+    Returns the features, the target and the feature names.
+    """
+    all_columns = feature_columns in ("all", ["all"])
+    categorical_columns = list(categorical_columns or [])
+    df = pd.read_csv(dataset_path, usecols=None if all_columns else [target_column] + list(feature_columns),
+                     dtype={column: str for column in categorical_columns})
+    if indices is not None:
+        df = df.take(indices)
+    target = df[target_column].values.reshape(-1, 1)
+    if all_columns:
+        feature_columns = [column for column in df.columns if column != target_column]
+    unknown = [column for column in categorical_columns if column not in feature_columns]
+    if unknown:
+        raise ValueError(f"Categorical columns {', '.join(unknown)} are not among the features ({', '.join(feature_columns)})")
+
+    # Text columns are categorical too (object dtype, or str under pandas 3)
+    categorical = [column for column in feature_columns
+                   if column in categorical_columns or not pd.api.types.is_numeric_dtype(df[column])]
+    numeric = [column for column in feature_columns if column not in categorical]
+    cache_dtype = precision.cache_dtype(dtype)
+
+    blocks, feature_names = [], []
+    if numeric:
+        scaled = StandardScaler().fit_transform(df[numeric].to_numpy(dtype=cache_dtype))
+        blocks.append(sparse.csr_matrix(scaled))
+        feature_names += numeric
+    if categorical:
+        encoder = OneHotEncoder(handle_unknown='ignore', dtype=cache_dtype)
+        one_hot = encoder.fit_transform(df[categorical].astype(str))
+        blocks.append(StandardScaler(with_mean=False).fit_transform(one_hot))
+        feature_names += list(encoder.get_feature_names_out(categorical))
+
+    features = sparse.hstack(blocks, format='csr', dtype=cache_dtype)
+    return features, target, feature_names
  
-def normalize_data(features):
+def normalize_data(features, dtype=precision.DEFAULT_POLICY):
     """
-    Normalizes features using StandardScaler.
+    Normalizes features using StandardScaler and returns them in the storage dtype of the dtype policy.
+    Scaling runs in float32 (float64 for the float64 policy) since StandardScaler keeps that dtype.
     """
     scaler = StandardScaler()
-    normalized_features = scaler.fit_transform(features)
-    return normalized_features, scaler
+    normalized_features = scaler.fit_transform(np.asarray(features, dtype=precision.cache_dtype(dtype)))
+    return precision.cast(normalized_features, dtype), scaler
 
-def evaluate_model(model, features, target, loss_history, training_time, dataset):
+def evaluate_model(model, features, target, loss_history, training_time, dataset, dtype=precision.DEFAULT_POLICY, profiler=None):
     """
     Evaluates the model and returns performance metrics.
     """
-    start_time = time.time() 
-    predictions = model.predict(features)
-    end_time = time.time()
-    inference_time = (end_time - start_time) * 1000  # in milliseconds
+    profiler = profiler or memory.MemoryProfiler()
 
-    mse = mean_squared_error(target, predictions)
-    r2 = r2_score(target, predictions)
+    with profiler.phase('evaluate'):
+        start_time = time.time() 
+        predictions = model.predict(features)
+        end_time = time.time()
+        inference_time = (end_time - start_time) * 1000  # in milliseconds
 
-    print(f"Mean Squared Error: {mse}")
-    print(f"R-squared: {r2}")
+        # scikit-learn metrics do not accept bfloat16, so they are computed on float32 views
+        metric_dtype = precision.cache_dtype(dtype)
+        mse = float(mean_squared_error(target.astype(metric_dtype, copy=False), predictions.astype(metric_dtype, copy=False)))
+        r2 = float(r2_score(target.astype(metric_dtype, copy=False), predictions.astype(metric_dtype, copy=False)))
 
-    return {
-        "features": features.tolist(),
-        "target": target.tolist(),
-        "predictions": predictions.tolist(),
-        "loss_history": loss_history,
-        "training_time_ms": training_time,
-        "inference_time_ms": inference_time,
-        "mse": mse,
-        "r2": r2
-    }
+        print(f"Mean Squared Error: {mse}")
+        print(f"R-squared: {r2}")
+
+    # Converting the per-row arrays to lists is the largest allocation of a run
+    with profiler.phase('serialize'):
+        results = {
+            "features": None if sparse.issparse(features) else precision.to_list(features),
+            "target": precision.to_list(target),
+            "predictions": precision.to_list(predictions),
+            "loss_history": loss_history,
+            "training_time_ms": training_time,
+            "inference_time_ms": inference_time,
+            "mse": mse,
+            "r2": r2,
+            "dtype": dtype
+        }
+    results["peak_rss_mb"] = profiler.peak_rss_mb()
+    return results
 
-def train_model(features, target):
+def train_model(features, target, dtype=precision.DEFAULT_POLICY, convergence_policy=None, hyperparameters=None, progress_job=None, sampler=None):
     """
     Trains a simple linear regression model using TensorFlow.
+    With a convergence policy, training stops early once the loss plateaus or the time budget is spent.
+    hyperparameters overrides any of DEFAULT_HYPERPARAMETERS.
+    With a progress job, every epoch is published to it and the run can be aborted through it.
+    With a resource sampler (see common/timeline.py), the start of training and every epoch end are marked on it.
     """
-    model = tf.keras.Sequential([
-        tf.keras.Input(shape=(features.shape[1],)),
-        tf.keras.layers.Dense(1)
-    ])
+    hyperparameters = dict(DEFAULT_HYPERPARAMETERS, **(hyperparameters or {}))
+    with precision.policy_scope(dtype):
+        model = tf.keras.Sequential([
+            tf.keras.Input(shape=(features.shape[1],), sparse=sparse.issparse(features)),
+            tf.keras.layers.Dense(1, dtype=precision.output_dtype(dtype))
+        ])
 
-    model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=0.01), loss='mean_squared_error')
+    model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=hyperparameters['learning_rate']), loss='mean_squared_error')
+
+    callback = convergence.ConvergenceCallback(convergence_policy) if convergence_policy else None
+    progress_callback = progress.ProgressCallback(progress_job) if progress_job else None
+    timeline_callback = tf.keras.callbacks.LambdaCallback(
+        on_train_begin=lambda logs: sampler.mark('train_start'),
+        on_epoch_end=lambda epoch, logs: sampler.mark('epoch_end')) if sampler else None
+    epochs = convergence.max_epochs(convergence_policy, hyperparameters['epochs'])
 
     start_time = time.time()
-    history = model.fit(features, target, epochs=200, batch_size=4096, verbose=0)
+    history = model.fit(features, target, epochs=epochs, batch_size=hyperparameters['batch_size'], verbose=0,
+                        callbacks=[c for c in (callback, progress_callback, timeline_callback) if c])
     end_time = time.time()
 
     training_time = (end_time - start_time) * 1000  # in milliseconds
     loss_history = history.history['loss']
-    return model, training_time, loss_history
+    convergence_info = convergence.summary(callback, len(loss_history))
+    if progress_callback and progress_callback.stop_reason:
+        convergence_info['stop_reason'] = progress_callback.stop_reason  # aborted or diverged
+    return model, training_time, loss_history, convergence_info
 
-def run(dataset_path, target_column, feature_categories, feature_index_to_train_on, dataset):
+def export_model(model, scaler, export_path):
+    """
+    Saves the trained model with the feature scaling built in, so it can be served on raw feature values.
+    """
+    serving_model = tf.keras.Sequential([
+        tf.keras.Input(shape=(len(scaler.mean_),)),
+        tf.keras.layers.Normalization(mean=scaler.mean_, variance=scaler.var_),
+        model
+    ])
+    directory = os.path.dirname(export_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    serving_model.save(export_path)
+    print(f"Model exported to {export_path}")
+
+def run(dataset_path, target_column, feature_categories, feature_index_to_train_on, dataset, indices=None, dtype=precision.DEFAULT_POLICY, profiler=None, export_path=None, convergence_policy=None, hyperparameters=None, progress_job=None, sampler=None):
     """
     Executes the linear regression training and evaluation pipeline.
+    Memory is recorded per phase (load, train, evaluate, serialize) by the given MemoryProfiler.
+    When export_path is given, the trained model is saved there for serving.
     """
-    features, target = fetch_dataset(dataset_path, target_column, feature_categories)
+    dtype = precision.resolve(dtype)
+    profiler = profiler or memory.MemoryProfiler()
+
+    with profiler.phase('load'):
+        features, target = fetch_dataset(dataset_path, target_column, feature_categories, indices)
+        target = precision.cast(target, dtype)
 
-    # Use only one feature column based on index
-    single_feature = features.iloc[:, feature_index_to_train_on].values.reshape(-1, 1)
+        # Use only one feature column based on index
+        single_feature = features.iloc[:, feature_index_to_train_on].values.reshape(-1, 1)
  
-    normalized_features, _ = normalize_data(single_feature)
+        normalized_features, scaler = normalize_data(single_feature, dtype)
   
-    model, training_time, loss_history = train_model(normalized_features, target)
+    with profiler.phase('train'):
+        model, training_time, loss_history, convergence_info = train_model(normalized_features, target, dtype, convergence_policy, hyperparameters, progress_job, sampler)
+
+    results = evaluate_model(model, normalized_features, target, loss_history, training_time, dataset, dtype, profiler)
+    results["convergence"] = convergence_info  # epoch training stopped at and why
+    results["hyperparameters"] = dict(DEFAULT_HYPERPARAMETERS, **(hyperparameters or {}))
+    if export_path:
+        export_model(model, scaler, export_path)
+    del model
+    return results
+
+def run_sparse(dataset_path, target_column, feature_columns, categorical_columns, dataset, indices=None, dtype=precision.DEFAULT_POLICY, profiler=None, convergence_policy=None, hyperparameters=None, progress_job=None, sampler=None):
+    """
+    Executes the multi-feature pipeline: sparse features (see fetch_sparse_dataset) feed a
+    sparse-input Dense layer, so training runs sparse matmuls on each batch.
+    Only float32 and float64 are supported, as TensorFlow has no low-precision sparse matmul.
+    The model is not exported, since serving expects the raw single feature.
+    """
+    dtype = precision.resolve(dtype)
+    if dtype not in ('float32', 'float64'):
+        raise ValueError(f"The sparse multi-feature mode supports float32 and float64, not {dtype}")
+    profiler = profiler or memory.MemoryProfiler()
+
+    with profiler.phase('load'):
+        features, target, feature_names = fetch_sparse_dataset(dataset_path, target_column, feature_columns,
+                                                                categorical_columns, indices, dtype)
+        target = precision.cast(target, dtype)
+        print(f"Sparse features: {features.shape[0]} rows x {features.shape[1]} columns, {features.nnz} non-zeros")
+
+    with profiler.phase('train'):
+        model, training_time, loss_history, convergence_info = train_model(features, target, dtype, convergence_policy, hyperparameters, progress_job, sampler)
 
-    results = evaluate_model(model, normalized_features, target, loss_history, training_time, dataset)
+    results = evaluate_model(model, features, target, loss_history, training_time, dataset, dtype, profiler)
+    results["convergence"] = convergence_info
+    results["hyperparameters"] = dict(DEFAULT_HYPERPARAMETERS, **(hyperparameters or {}))
+    results["feature_names"] = feature_names
+    results["sparse"] = {'rows': features.shape[0], 'columns': features.shape[1], 'nnz': int(features.nnz),
+                         'density': features.nnz / max(1, features.shape[0] * features.shape[1])}
     del model
     return results
 
-def process(dataset, executionTries, sample, result_item_id):
+def process(dataset, executionTries, sample, result_item_id, dtype=precision.DEFAULT_POLICY, run_config=None, trace_allocations=False, export=True, convergence_policy=None, hyperparameters=None, progress_job=None, feature_columns=None, categorical_columns=None, export_staging=None):
     """
     Orchestrates the full experiment pipeline:
     - Loads the appropriate dataset
     - Runs training and evaluation
-    - Returns metadata and results
+    - Exports the trained model for serving (unless export is False)
+    - Returns metadata and results, and the resource timeline sampled during the run (see common/timeline.py)
+    With feature_columns (column names or "all"), trains on several features in the sparse
+    multi-feature mode, one-hot encoding categorical_columns (see run_sparse).
+    With export_staging (a directory name), the model is exported under <try>/<export_staging>/ instead
+    of the try's folder, for a cluster worker that moves it into place once its result is stored.
     """
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    dataset_mapping = {
-        1: os.path.join(base_dir, "../../datasets/house_price/sample_10%.csv"),
-        2: os.path.join(base_dir, "../../datasets/house_price/sample_50%.csv"),
-        3: os.path.join(base_dir, "../../datasets/house_price/sample_100%.csv"),
+    dataset_dir = os.path.join(base_dir, "../../datasets/house_price")
+    dataset_perc = {
+        1: 0.1,
+        2: 0.5,
+        3: 1.0,
     }
-    dataset_name = {
-        1: "sample_10%",
-        2: "sample_50%",
-        3: "sample_100%",
-    }
-    dataset_path = dataset_mapping[dataset]
+    # Any other sample (e.g. "25%") is drawn from the base dataset on demand
+    fraction = dataset_perc[dataset] if dataset in dataset_perc else sampling.parse_fraction(sample)
+    dataset_name = sampling.sample_name(fraction)
+    dataset_path = os.path.join(dataset_dir, "sample_100%.csv")
+    # The row count is cached next to the split indices, so the CSV is parsed only once, by the loader
+    n_rows = sampling.count_rows(dataset_path, cache_dir=os.path.join(dataset_dir, "indices"))
+    indices = sampling.sample_indices(n_rows, fraction, seed=1, cache_dir=os.path.join(dataset_dir, "indices"))
 
-    print(f"Using dataset: {dataset_path}")
+    print(f"Using dataset: {dataset_path} ({dataset_name}, {len(indices)} rows)")
 
     target_column = "price"
     feature_categories = []  # Add categorical columns here if needed
     feature_index_to_train_on = 0  # Index of the feature to train on
 
+    experiments_path = "linear_regression/training_result/" + str(result_item_id)
+    experiment_path = experiments_path + "/" + str(executionTries) + "/python_gpu"
+    export_path = experiments_path + "/" + str(executionTries) + ("/" + export_staging if export_staging else "") + "/python_gpu"
+    model_path = export_path + "/python_gpu_" + dataset_name + "_model.keras" if export and not feature_columns else None
+
+    profiler = memory.MemoryProfiler(trace_allocations)
+    sampler = timeline.ResourceSampler()
     start_time = time.time() 
-    results = run(dataset_path, target_column, feature_categories, feature_index_to_train_on, dataset_name[dataset])
+    # Thread pools and CPU affinity for the run, recorded with the experiment
+    with runtime.applied_run_config(run_config) as run_config, sampler:
+        if feature_columns:
+            results = run_sparse(dataset_path, target_column, feature_columns, categorical_columns, dataset_name, indices, dtype, profiler, convergence_policy, hyperparameters, progress_job, sampler)
+        else:
+            results = run(dataset_path, target_column, feature_categories, feature_index_to_train_on, dataset_name, indices, dtype, profiler, model_path, convergence_policy, hyperparameters, progress_job, sampler)
     end_time = time.time()
+    results['timeline'] = sampler.summary()
     
-    experiments_path = "linear_regression/training_result/" + str(result_item_id)
     sdt = datetime.fromtimestamp(start_time, tz=timezone.utc)
     edt = datetime.fromtimestamp(end_time, tz=timezone.utc)
 
@@ -146,10 +306,15 @@ def process(dataset, executionTries, sample, result_item_id):
             'end': edt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
             'platform': "python_gpu",
             'result_item_id': result_item_id,
+            'run_config': run_config,
+            'memory': profiler.report(),
             'location': experiments_path,
             'try_path': experiments_path + "/" + str(executionTries),
-            'experiment_path': experiments_path + "/" + str(executionTries) + "/python_gpu",
-            'result_path':  experiments_path + "/" + str(executionTries) + "/python_gpu/" +  "python_gpu_" + dataset_name[dataset] + ".json"
+            'experiment_path': experiment_path,
+            'result_path':  experiments_path + "/" + str(executionTries) + "/python_gpu/" +  "python_gpu_" + dataset_name + ".json",
+            'model_path': model_path
         },
-        'results': results
+        'results': results,
+        # Saved next to the result as <result>.timeline.npz when the experiment is appended
+        'timeline': sampler.arrays()
     }
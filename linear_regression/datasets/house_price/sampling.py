@@ -1,16 +1,23 @@
+import os
+import sys
 import pandas as pd
 
-# Load dataset
-df = pd.read_csv("sample_100%.csv")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../.."))
+from common import sampling
 
-# Create smaller dataset (e.g., 10% of the original)
-df_30 = df.sample(frac=0.1, random_state=1)
+# Samples are stored as row-index files (indices/sample_<pct>%_seed<seed>.npy) over
+# sample_100%.csv. The Python app gathers its rows straight from those indices.
+# Usage: python sampling.py [fraction ...]   e.g. python sampling.py 0.25 0.75
+seed = 1
+fractions = [float(arg) for arg in sys.argv[1:]] or [0.1, 0.5]
 
-# Save the smaller dataset
-df_30.to_csv("sample_10%.csv", index=False)
+# Load dataset
+df = pd.read_csv("sample_100%.csv")
 
-# Create smaller dataset (e.g., 50% of the original)
-df_60 = df.sample(frac=0.5, random_state=1)
+for fraction in fractions:
+    # Same rows as df.sample(frac=fraction, random_state=seed)
+    indices = sampling.sample_indices(len(df), fraction, seed=seed, cache_dir="indices")
+    print(f"{sampling.index_path('indices', 'sample', fraction, seed)}: {len(indices)} rows")
 
-# Save the smaller dataset
-df_60.to_csv("sample_50%.csv", index=False) 
\ No newline at end of file
+    # The browser apps still fetch CSV files, so materialize them from the same indices
+    df.take(indices).to_csv(sampling.sample_name(fraction) + ".csv", index=False)
@@ -6,6 +6,8 @@ import numpy as np
 import csv
 from pathlib import Path
 from scipy import stats
+from common import artifacts
+from common import timeline
 
 def plot_regression_line(title, features, target, predictions, save_path):
     """
@@ -23,18 +25,35 @@ def plot_regression_line(title, features, target, predictions, save_path):
     plt.close()
     print(f"plot_regression_line saved to {save_path}")
 
-def plot_loss_history(title, loss_history, save_path):
+def mark_early_stop(convergence):
+    """
+    Marks the epoch where early stopping ended training, if it did.
+    """
+    if not convergence or convergence.get('stop_reason') in (None, 'max_epochs'):
+        return
+    stopped_epoch = convergence['stopped_epoch']
+    plt.axvline(stopped_epoch - 1, color='gray', linestyle='--',
+                label=f"Stopped at epoch {stopped_epoch} ({convergence['stop_reason']})")
+
+def plot_loss_history(title, loss_history, save_path, convergence=None, resources=None):
     """
     Plots the loss history and saves the plot.
+    With the resource timeline of the run, its CPU% and RSS are overlaid on twin axes.
     """
     plt.figure(figsize=(10, 6)) 
+    ax = plt.gca()
     plt.plot(loss_history, label='Training Loss')
+    mark_early_stop(convergence)
     plt.xlabel('Epoch')
     plt.ylabel('Loss')
     plt.title('Training Loss History: ' + title)
-    plt.legend()  # Add a legend
-    plt.grid(True)  # Add grid lines
-    plt.savefig(save_path)
+    ax.grid(True)  # Add grid lines
+    resource_lines = timeline.overlay(ax, resources) if resources else []
+    handles, labels = ax.get_legend_handles_labels()
+    # On the topmost axes, so the overlay does not cover the legend
+    legend_ax = resource_lines[-1].axes if resource_lines else ax
+    legend_ax.legend(handles + resource_lines, labels + [line.get_label() for line in resource_lines])  # Add a legend
+    plt.savefig(save_path, bbox_inches='tight' if resource_lines else None)
     plt.close()
     print(f"plot_loss_history saved to {save_path}")
 
@@ -69,7 +88,7 @@ def create_csv(file_name, data):
     """
     Creates a CSV file with the given data.
     """
-    headers = ['Platform', 'Dataset Size', 'Training Time (ms)', 'Inference Time (ms)', 'MSE', 'R2']
+    headers = ['Platform', 'Dataset Size', 'Training Time (ms)', 'Inference Time (ms)', 'MSE', 'R2', 'Peak RSS (MB)']
     with open(file_name, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(headers)
@@ -83,19 +102,20 @@ def create_csv(file_name, data):
                     inference_time = data['inference_time'][dataset_size][platform]
                     accuracy = data['mse'][dataset_size][platform]
                     loss = data['r2'][dataset_size][platform]
-                    row = [platform, dataset_size, training_time, inference_time, accuracy, loss]
+                    peak_rss = data.get('peak_rss', {}).get(dataset_size, {}).get(platform, '')  # Python platform only
+                    row = [platform, dataset_size, training_time, inference_time, accuracy, loss, peak_rss]
                     writer.writerow(row)
 
 def process_json_files(root_folder):
     """
     Processes JSON files in subfolders, plots regression lines, and saves them.
     """
-    metrics = ["training_time", "inference_time", "mse", "r2"]
+    metrics = ["training_time", "inference_time", "mse", "r2", "peak_rss"]
     platform_folders = [f for f in os.listdir(root_folder) if os.path.isdir(os.path.join(root_folder, f))]
     predefined_platforms = ["python_gpu", "rust_wasm_cpu", "tensorflow_js_cpu", "tensorflow_js_webgpu", "tensorflow_js_wasm"]
 
     first_platform_folder = os.path.join(root_folder, platform_folders[0])
-    json_files = [re.search(r'(\d+%)', f.name).group(1) for f in Path(first_platform_folder).iterdir() if f.is_file() and f.suffix == '.json' and (f.stem.endswith('_10%') or f.stem.endswith('_50%') or f.stem.endswith('_100%'))]
+    json_files = [re.search(r'(\d+%)', f.name).group(1) for f in Path(first_platform_folder).iterdir() if f.is_file() and artifacts.is_json(f.name) and artifacts.logical_name(f.name)[:-len('.json')].endswith(('_10%', '_50%', '_100%'))]
     dataset_sizes = sorted(json_files, key=lambda x: int(x.replace('%','')))  # Sort by dataset size percentage
     platforms = sorted(platform_folders, key=lambda x: predefined_platforms.index(x) if x in predefined_platforms else len(predefined_platforms))
 
@@ -106,13 +126,13 @@ def process_json_files(root_folder):
         framework_path = os.path.join(root_folder, framework_folder)
         if os.path.isdir(framework_path):
             for json_file in os.listdir(framework_path):
-                if json_file.endswith('.json'):
+                if artifacts.is_json(json_file):  # result.json, result.json.gz or result.json.zst
                     file_path = os.path.join(framework_path, json_file)
+                    json_file = artifacts.logical_name(json_file)
                     try:
-                        with open(file_path, 'r') as f:
-                            data = json.load(f)
+                        data = artifacts.read_json(file_path)
 
-                        match = re.match(r"([a-zA-Z0-9_]+)_sample_(\d+)%.json", os.path.basename(file_path))
+                        match = re.match(r"([a-zA-Z0-9_]+)_sample_(\d+)%\.json$", json_file)
                         platform = match.group(1)
                         percentage = match.group(2) + "%"
 
@@ -132,11 +152,14 @@ def process_json_files(root_folder):
                         metric_data["inference_time"][percentage][platform] = round(data.get('inference_time_ms') / 1000, 4)
                         metric_data["mse"][percentage][platform] = data.get('mse')
                         metric_data["r2"][percentage][platform] = data.get('r2')
+                        if data.get('peak_rss_mb') is not None:
+                            metric_data["peak_rss"][percentage][platform] = round(data.get('peak_rss_mb'), 2)
 
                         # Plot loss history if present
                         plot_filename = os.path.splitext(json_file)[0] + "_loss_history.png"
                         save_path = os.path.join(framework_path, plot_filename)
-                        plot_loss_history(platform + " sample " + percentage, loss_history, save_path)
+                        plot_loss_history(platform + " sample " + percentage, loss_history, save_path, data.get('convergence'),
+                                          timeline.load(file_path, data))
 
                         # Plot regression line if valid data is available
                         if features and target and predictions:
@@ -165,7 +188,9 @@ def process_json_files(root_folder):
                         print(f"An unexpected error occurred while processing {file_path}: {e}")
  
     # Plot grouped bar comparisons and save CSV
-    plot_grouped_bar_comparisons(metric_data, metrics, dataset_sizes, platforms, root_folder)
+    # Skip metrics no platform reported (e.g. peak_rss when only browser results exist)
+    plotted_metrics = [metric for metric in metrics if any(metric_data.get(metric, {}).values())]
+    plot_grouped_bar_comparisons(metric_data, plotted_metrics, dataset_sizes, platforms, root_folder)
     create_csv(os.path.join(root_folder, "metric.csv"), metric_data)
     return metric_data
 
@@ -189,8 +214,8 @@ def calculate_confidence_interval(data, confidence=0.95):
     return ci_lower, ci_upper
 
 def save_confidence_interval(data, location): 
-    # List of metrics (training_time, inference_time, mse, r2)
-    metrics = ["training_time", "inference_time", "mse", "r2"]
+    # List of metrics (training_time, inference_time, mse, r2, peak_rss)
+    metrics = ["training_time", "inference_time", "mse", "r2", "peak_rss"]
     
     # Store results in a hierarchical JSON format
     json_data = {}
@@ -200,7 +225,7 @@ def save_confidence_interval(data, location):
         print(f"Metric: {metric}")
         
         # Get the percentages available for the metric (e.g., "10%", "50%")
-        percentages = list(data[metric].keys())  # get the percentages (keys under each metric)
+        percentages = list(data.get(metric, {}).keys())  # get the percentages (keys under each metric)
         
         for percentage in percentages:
             # Get the platforms for the current percentage (e.g., tensorflow_js_webgpu)
@@ -221,7 +246,8 @@ def save_confidence_interval(data, location):
                         "training_time": {},
                         "inference_time": {},
                         "mse": {},
-                        "r2": {}
+                        "r2": {},
+                        "peak_rss": {}
                     }
                 
                 # Add the confidence interval for the current metric
@@ -245,6 +271,11 @@ def save_confidence_interval(data, location):
                         "ci_lower": ci_lower,
                         "ci_upper": ci_upper
                     }
+                elif metric == "peak_rss":
+                    json_data[platform][percentage]["peak_rss"] = {
+                        "ci_lower": ci_lower,
+                        "ci_upper": ci_upper
+                    }
 
     # Print the resulting JSON
     json_string = json.dumps(json_data, indent=4)
@@ -256,7 +287,7 @@ def plot(result_item_id, tries):
     Runs the process_json_files function multiple times based on the number of tries.
     """
     result_item_location = 'linear_regression/training_result/' + str(result_item_id)
-    metrics = ["training_time", "inference_time", "mse", "r2"] 
+    metrics = ["training_time", "inference_time", "mse", "r2", "peak_rss"] 
     metric_results = {}
     for i in range(tries): 
         data = process_json_files(result_item_location + '/' + str(i+1))
@@ -5,43 +5,54 @@ import json
 import argparse
 import os
 from datetime import datetime, timezone
+from common import sampling
+from common import precision
+from common import runtime
+from common import memory
+from common import convergence
+from common import progress
+from common import datasets
+from common import inference
+from common import validation
+from common import timeline
+
+# Training hyperparameters; any of them can be overridden per run (see common/search.py)
+DEFAULT_HYPERPARAMETERS = {'learning_rate': 0.01, 'batch_size': 32, 'hidden_units': 32, 'epochs': 10}
+
+# Load MNIST dataset from JSON files, allowing partial loading via train_percentage.
+# The JSON files are converted once into .npy files and memory-mapped, and the requested
+# rows are gathered from them. seed=None keeps the unshuffled prefix used by the browser
+# apps; any other seed draws a cached random split (see common/sampling.py).
+# Arrays are returned in the storage dtype of the dtype policy (float32 by default).
+# When a parent process shared this split (see common/datasets.py), read-only views of it are returned instead.
+def load_mnist(train_percentage=1.0, seed=None, dtype=precision.DEFAULT_POLICY):
+    shared = datasets.lookup(dataset_key(train_percentage, seed, dtype))
+    if shared is not None:
+        return shared
 
-# Load MNIST dataset from JSON files, allowing partial loading via train_percentage
-def load_mnist(train_percentage=1.0):
     path = 'neural_network/datasets/'
+    cache_dtype = precision.cache_dtype(dtype)
+
+    train_images = sampling.load_base_array(path + 'mnist_train_images.json', cache_dtype)
+    train_labels = sampling.load_base_array(path + 'mnist_train_labels.json', cache_dtype)
+    test_images = sampling.load_base_array(path + 'mnist_test_images.json', cache_dtype)
+    test_labels = sampling.load_base_array(path + 'mnist_test_labels.json', cache_dtype)
 
-    # Load JSON-encoded image and label arrays
-    with open(path + 'mnist_train_images.json', 'r') as f:
-        train_images_data = json.load(f)
-    with open(path + 'mnist_train_labels.json', 'r') as f:
-        train_labels_data = json.load(f)
-    with open(path + 'mnist_test_images.json', 'r') as f:
-        test_images_data = json.load(f)
-    with open(path + 'mnist_test_labels.json', 'r') as f:
-        test_labels_data = json.load(f)
-
-    # Convert to numpy arrays
-    train_images = np.array(train_images_data)
-    train_labels = np.array(train_labels_data)
-    test_images = np.array(test_images_data)
-    test_labels = np.array(test_labels_data)
-
-    # Reduce data size if train_percentage < 1.0
-    num_train_samples = int(train_images.shape[0] * train_percentage)
-    num_test_samples = int(test_images.shape[0] * train_percentage)
-
-    train_images = train_images[:num_train_samples]
-    train_labels = train_labels[:num_train_samples]
-    test_images = test_images[:num_test_samples]
-    test_labels = test_labels[:num_test_samples]
+    # Row indices of the requested split, shared by images and labels
+    train_indices = sampling.sample_indices(train_images.shape[0], train_percentage, seed, path + 'indices', 'mnist_train')
+    test_indices = sampling.sample_indices(test_images.shape[0], train_percentage, seed, path + 'indices', 'mnist_test')
 
     return {
-        'train_images': train_images,
-        'train_labels': train_labels,
-        'test_images': test_images,
-        'test_labels': test_labels
+        'train_images': precision.cast(sampling.take_rows(train_images, train_indices), dtype),
+        'train_labels': precision.cast(sampling.take_rows(train_labels, train_indices), dtype),
+        'test_images': precision.cast(sampling.take_rows(test_images, test_indices), dtype),
+        'test_labels': precision.cast(sampling.take_rows(test_labels, test_indices), dtype)
     }
 
+# Key of an MNIST split in the shared dataset pool
+def dataset_key(train_percentage=1.0, seed=None, dtype=precision.DEFAULT_POLICY):
+    return f"mnist/{train_percentage:g}/{seed}/{precision.resolve(dtype)}"
+
 # Predict a single input and measure inference time
 def predict_and_measure(model, input_tensor):
     start_time = time.time()
@@ -53,89 +64,171 @@ def predict_and_measure(model, input_tensor):
     return {'predicted_class': predicted_class, 'inference_time': inference_time}
 
 # Train a simple neural network on MNIST data and collect performance metrics
-def train_model(train_percentage):
-    data = load_mnist(train_percentage)
-    train_images, train_labels = data['train_images'], data['train_labels']
-    test_images, test_labels = data['test_images'], data['test_labels']
-
-    # Define a simple feedforward neural network
-    model = tf.keras.models.Sequential([
-        tf.keras.layers.Dense(32, activation='relu', input_shape=(784,)),
-        tf.keras.layers.Dense(32, activation='relu'),
-        tf.keras.layers.Dense(10, activation='softmax')
-    ])
-
-    model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=0.01),
-                  loss='categorical_crossentropy',
-                  metrics=['accuracy'])
-
-    # Lists to collect metrics during training
-    loss_values, accuracy_values = [], []
-    val_loss_values, val_accuracy_values = [], []
-
-    # Train the model and track metrics at each epoch
-    start_time = time.time()
-    model.fit(train_images, train_labels, epochs=10,
-              validation_data=(test_images, test_labels),
-              callbacks=[tf.keras.callbacks.LambdaCallback(
-                  on_epoch_end=lambda epoch, logs: (
-                      loss_values.append(logs['loss']),
-                      accuracy_values.append(logs['accuracy']),
-                      val_loss_values.append(logs['val_loss']),
-                      val_accuracy_values.append(logs['val_accuracy'])
-                  )
-              )])
-    end_time = time.time()
-    training_time = (end_time - start_time) * 1000  # ms
-    print('Training time:', training_time, 'milliseconds')
+# Memory is recorded per phase (load, train, evaluate, serialize) by the given MemoryProfiler
+# When export_path is given, the trained model is saved there for serving
+# With a convergence policy, training stops early once the loss plateaus or the time budget is spent
+# hyperparameters overrides any of DEFAULT_HYPERPARAMETERS
+# With a progress job, every epoch is published to it and the run can be aborted through it
+# With inference_variants, the trained model is also benchmarked as XLA, TFLite and int8 TFLite (see common/inference.py)
+# validation_config sets how often and on how many test rows the model is validated, and whether
+# the final metrics reuse the last validation instead of a separate evaluate (see common/validation.py)
+# With a resource sampler (see common/timeline.py), the start of training and every epoch end are marked on it
+def train_model(train_percentage, dtype=precision.DEFAULT_POLICY, profiler=None, export_path=None, convergence_policy=None, hyperparameters=None, progress_job=None, inference_variants=False, validation_config=None, sampler=None):
+    dtype = precision.resolve(dtype)
+    hyperparameters = dict(DEFAULT_HYPERPARAMETERS, **(hyperparameters or {}))
+    validation_config = validation.resolve_config(validation_config)
+    profiler = profiler or memory.MemoryProfiler()
+
+    with profiler.phase('load'):
+        data = load_mnist(train_percentage, dtype=dtype)
+        train_images, train_labels = data['train_images'], data['train_labels']
+        test_images, test_labels = data['test_images'], data['test_labels']
+        val_images, val_labels = validation.subset(test_images, test_labels, validation_config)
+
+    with profiler.phase('train'):
+        with precision.policy_scope(dtype):
+            # Define a simple feedforward neural network
+            model = tf.keras.models.Sequential([
+                tf.keras.layers.Dense(hyperparameters['hidden_units'], activation='relu', input_shape=(784,)),
+                tf.keras.layers.Dense(hyperparameters['hidden_units'], activation='relu'),
+                tf.keras.layers.Dense(10, activation='softmax', dtype=precision.output_dtype(dtype))
+            ])
+
+        model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=hyperparameters['learning_rate']),
+                      loss='categorical_crossentropy',
+                      metrics=['accuracy'])
 
-    # Evaluate the model on the test set
-    loss, accuracy = model.evaluate(test_images, test_labels)
-    print('Loss:', loss)
-    print('Accuracy:', accuracy)
+        # Lists to collect metrics during training; validation metrics are collected by validation_callback
+        loss_values, accuracy_values = [], []
 
-    # Test prediction on a single image
-    sample_image = test_images[0:1, :]
-    prediction_result = predict_and_measure(model, sample_image)
-    print('Predicted class:', prediction_result['predicted_class'])
-    print('Inference time:', prediction_result['inference_time'], 'milliseconds')
+        validation_callback = validation.ValidationCallback(val_images, val_labels)
+        callbacks = [tf.keras.callbacks.LambdaCallback(
+            on_epoch_end=lambda epoch, logs: (
+                loss_values.append(logs['loss']),
+                accuracy_values.append(logs['accuracy'])
+            )
+        ), validation_callback]
+        convergence_callback = convergence.ConvergenceCallback(convergence_policy) if convergence_policy else None
+        if convergence_callback:
+            callbacks.append(convergence_callback)
+        progress_callback = progress.ProgressCallback(progress_job) if progress_job else None
+        if progress_callback:
+            callbacks.append(progress_callback)
+        if sampler:
+            callbacks.append(tf.keras.callbacks.LambdaCallback(
+                on_train_begin=lambda logs: sampler.mark('train_start'),
+                on_epoch_end=lambda epoch, logs: sampler.mark('epoch_end')))
+
+        # Train the model and track metrics at each epoch
+        start_time = time.time()
+        model.fit(train_images, train_labels, epochs=convergence.max_epochs(convergence_policy, hyperparameters['epochs']),
+                  batch_size=hyperparameters['batch_size'],
+                  validation_data=(val_images, val_labels),
+                  validation_freq=validation_config['freq'],
+                  callbacks=callbacks)
+        end_time = time.time()
+        training_time = (end_time - start_time) * 1000  # ms
+        print('Training time:', training_time, 'milliseconds')
+
+    with profiler.phase('evaluate'):
+        if validation_config['final'] == 'reuse':
+            # The final epoch was validated during training (or is now, when it was off cadence):
+            # no second pass over the test data
+            validation_callback.validate_last_epoch()
+            loss, accuracy = validation_callback.val_loss_values[-1], validation_callback.val_accuracy_values[-1]
+            evaluation_time = validation_callback.final_time_ms
+        else:
+            # Evaluate the model on the test set
+            start_time = time.time()
+            loss, accuracy = model.evaluate(test_images, test_labels)
+            evaluation_time = (time.time() - start_time) * 1000  # ms
+        print('Loss:', loss)
+        print('Accuracy:', accuracy)
+
+        # Test prediction on a single image
+        sample_image = test_images[0:1, :]
+        prediction_result = predict_and_measure(model, sample_image)
+        print('Predicted class:', prediction_result['predicted_class'])
+        print('Inference time:', prediction_result['inference_time'], 'milliseconds')
+
+    keras_report, variant_results = None, None
+    if inference_variants:
+        with profiler.phase('variants'):
+            # TFLite files go to <try>/<variant platform>/, next to the python_gpu folder of export_path
+            export_dir = os.path.dirname(os.path.dirname(export_path)) if export_path else None
+            export_name = os.path.basename(export_path).replace('python_gpu_', '').replace('_model.keras', '') if export_path else None
+            keras_report, variant_results = inference.run_variants(model, test_images, test_labels, export_dir, export_name)
+
+    if export_path:
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+        model.save(export_path)
+        print('Model exported to', export_path)
 
     del model
     
+    convergence_info = convergence.summary(convergence_callback, len(loss_values))
+    if progress_callback and progress_callback.stop_reason:
+        convergence_info['stop_reason'] = progress_callback.stop_reason  # aborted or diverged
+
     # Return all results and metrics
-    return {
-        'loss_values': loss_values,
-        'accuracy_values': accuracy_values,
-        'val_loss_values': val_loss_values,
-        'val_accuracy_values': val_accuracy_values,
-        'training_time_ms': training_time,
-        'inference_time_ms': prediction_result['inference_time'],
-        'loss': loss,
-        'accuracy': accuracy
-    } 
+    with profiler.phase('serialize'):
+        results = {
+            'loss_values': loss_values,
+            'accuracy_values': accuracy_values,
+            'val_loss_values': validation_callback.val_loss_values,
+            'val_accuracy_values': validation_callback.val_accuracy_values,
+            'val_epochs': validation_callback.validated_epochs,
+            'training_time_ms': training_time,
+            'evaluation_time_ms': evaluation_time,
+            'inference_time_ms': prediction_result['inference_time'],
+            'loss': loss,
+            'accuracy': accuracy,
+            'dtype': dtype,
+            'hyperparameters': hyperparameters,
+            'convergence': convergence_info,
+            'validation': dict(validation_config, val_size=int(val_labels.shape[0]),
+                               final_validation_time_ms=validation_callback.final_time_ms)
+        }
+    results['peak_rss_mb'] = profiler.peak_rss_mb()
+    if keras_report:
+        results['inference_benchmark'] = keras_report['benchmark']  # same harness as the variants
+        # inference_time_ms stays the single predict above, as without variants
+        results['harness_inference_time_ms'] = inference.harness_time_ms(keras_report['benchmark'])
+        results['inference_variants'] = variant_results
+    return results
 
 # Perform a training run and format results for saving and reporting
-def process(dataset, executionTries, sample, result_item_id):
+# The resources of the run are sampled in the background and returned as 'timeline' (see common/timeline.py)
+def process(dataset, executionTries, sample, result_item_id, dtype=precision.DEFAULT_POLICY, run_config=None, trace_allocations=False, export=True, convergence_policy=None, hyperparameters=None, progress_job=None, inference_variants=False, validation_config=None, export_staging=None):
+    # With export_staging (a directory name), the model and the TFLite variants are exported under
+    # <try>/<export_staging>/ instead of the try's folder, for a cluster worker that moves them into
+    # place once its result is stored
     dataset_perc = {
         1: 0.1,
         2: 0.5,
         3: 1.0,
     }
-    dataset_name = {
-        1: "sample_10%",
-        2: "sample_50%",
-        3: "sample_100%",
-    }
+    # Any other sample (e.g. "25%") is drawn from the base dataset on demand
+    fraction = dataset_perc[dataset] if dataset in dataset_perc else sampling.parse_fraction(sample)
+    dataset_name = sampling.sample_name(fraction)
 
+    experiments_path = f"neural_network/training_result/{result_item_id}"
+    export_root = f"{experiments_path}/{executionTries}" + (f"/{export_staging}" if export_staging else "")
+    model_path = f"{export_root}/python_gpu/python_gpu_{dataset_name}_model.keras" if export else None
+
+    profiler = memory.MemoryProfiler(trace_allocations)
+    sampler = timeline.ResourceSampler()
     start_time = time.time()
-    results = train_model(dataset_perc[dataset])
+    # Thread pools and CPU affinity for the run, recorded with the experiment
+    with runtime.applied_run_config(run_config) as run_config, sampler:
+        results = train_model(fraction, dtype, profiler, model_path, convergence_policy, hyperparameters, progress_job, inference_variants, validation_config, sampler)
     end_time = time.time()
+    results['timeline'] = sampler.summary()
 
     sdt = datetime.fromtimestamp(start_time, tz=timezone.utc)
     edt = datetime.fromtimestamp(end_time, tz=timezone.utc)
 
-    experiments_path = f"neural_network/training_result/{result_item_id}"
-
+    variant_results = results.pop('inference_variants', None) or {}
     return {
         'experiment': {
             'try': int(executionTries),
@@ -146,10 +239,43 @@ def process(dataset, executionTries, sample, result_item_id):
             'end': edt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
             'platform': "python_gpu",
             'result_item_id': result_item_id,
+            'run_config': run_config,
+            'memory': profiler.report(),
             'location': experiments_path,
             'try_path': f"{experiments_path}/{executionTries}",
             'experiment_path': f"{experiments_path}/{executionTries}/python_gpu",
-            'result_path': f"{experiments_path}/{executionTries}/python_gpu/python_gpu_sample_{int(dataset_perc[dataset] * 100)}%.json"
+            'result_path': f"{experiments_path}/{executionTries}/python_gpu/python_gpu_{dataset_name}.json",
+            'model_path': model_path
+        },
+        'results': results,
+        # Saved next to the result as <result>.timeline.npz when the experiment is appended
+        'timeline': sampler.arrays(),
+        # Each inference variant is its own platform of the same try, sharing the trained model's metrics
+        'variants': [variant_experiment(platform, variant, results, executionTries, sample, result_item_id,
+                                        experiments_path, dataset_name, sdt, edt)
+                     for platform, variant in variant_results.items()]
+    }
+
+# Experiment record of an inference variant (python_xla, python_tflite, python_tflite_int8)
+def variant_experiment(platform, variant, results, executionTries, sample, result_item_id, experiments_path, dataset_name, sdt, edt):
+    label = platform.replace('python_', '').replace('_', ' ')
+    experiment_path = f"{experiments_path}/{executionTries}/{platform}"
+    return {
+        'experiment': {
+            'try': int(executionTries),
+            'type': f"Neural Network Python {label}",
+            'sample': sample,
+            'title': f"Neural Network Python {label} {sample}",
+            'start': sdt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'end': edt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'platform': platform,
+            'result_item_id': result_item_id,
+            'location': experiments_path,
+            'try_path': f"{experiments_path}/{executionTries}",
+            'experiment_path': experiment_path,
+            'result_path': f"{experiment_path}/{platform}_{dataset_name}.json",
+            'model_path': variant.get('model_path')
         },
-        'results': results
+        # No training_time_ms: the variants share python_gpu's training, which is charted once
+        'results': dict(variant, dtype=results['dtype'], variant_of='python_gpu')
     }
\ No newline at end of file
@@ -6,33 +6,57 @@ import re
 import csv
 from pathlib import Path
 from scipy import stats
+from common import artifacts
+from common import timeline
 
-def plot_loss(title, loss, val_loss, save_path):
-    """Plots and saves the training and validation loss over epochs."""
+def mark_early_stop(convergence):
+    """
+    Marks the epoch where early stopping ended training, if it did.
+    """
+    if not convergence or convergence.get('stop_reason') in (None, 'max_epochs'):
+        return
+    stopped_epoch = convergence['stopped_epoch']
+    plt.axvline(stopped_epoch - 1, color='gray', linestyle='--',
+                label=f"Stopped at epoch {stopped_epoch} ({convergence['stop_reason']})")
+
+def validation_x(values, val_epochs):
+    # Epoch index of each validation value; runs validating every k epochs record val_epochs (1-based)
+    return [epoch - 1 for epoch in val_epochs] if val_epochs else list(range(len(values)))
+
+def plot_loss(title, loss, val_loss, save_path, convergence=None, val_epochs=None, resources=None):
+    """Plots and saves the training and validation loss over epochs, with the CPU% and RSS of the run's resource timeline if given."""
     plt.figure(figsize=(8, 6))
     ax = plt.gca()
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
     plt.plot(loss, color='blue', label='Training Loss')
-    plt.plot(val_loss, color='red', label='Validation Loss')
+    plt.plot(validation_x(val_loss, val_epochs), val_loss, color='red', label='Validation Loss',
+             marker='o' if val_epochs and len(val_epochs) < len(loss) else None)
+    mark_early_stop(convergence)
     plt.title('Model Loss: ' + title)
     plt.xlabel('Epoch')
     plt.ylabel('Loss')
-    plt.legend()
+    resource_lines = timeline.overlay(ax, resources) if resources else []
+    handles, labels = ax.get_legend_handles_labels()
+    # On the topmost axes, so the overlay does not cover the legend
+    legend_ax = resource_lines[-1].axes if resource_lines else ax
+    legend_ax.legend(handles + resource_lines, labels + [line.get_label() for line in resource_lines])
     plt.tight_layout()
     plt.savefig(save_path)
     plt.close()
     print(f"Loss plot saved to {save_path}")
 
     
-def plot_accuracy(title, accuracy, val_accuracy, save_path):
+def plot_accuracy(title, accuracy, val_accuracy, save_path, convergence=None, val_epochs=None):
     """Plots and saves the training and validation accuracy over epochs."""
     plt.figure(figsize=(8, 6))
     ax = plt.gca()
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
     plt.plot(accuracy, color='blue', label='Training Accuracy')
-    plt.plot(val_accuracy, color='red', label='Validation Accuracy')
+    plt.plot(validation_x(val_accuracy, val_epochs), val_accuracy, color='red', label='Validation Accuracy',
+             marker='o' if val_epochs and len(val_epochs) < len(accuracy) else None)
+    mark_early_stop(convergence)
     plt.title('Model Accuracy: ' + title)
     plt.xlabel('Epoch')
     plt.ylabel('Accuracy')
@@ -48,14 +72,16 @@ def plot_grouped_bar_comparisons(data, metrics, dataset_sizes, platforms, save_p
     Plots grouped bar charts to compare platforms for each dataset size.
     """
     for metric in metrics:
+        # Only the platforms that report the metric (e.g. inference variants have no training time)
+        metric_platforms = [platform for platform in platforms if any(platform in data[metric][size] for size in dataset_sizes)]
         x = np.arange(len(dataset_sizes))  # the label locations
-        width = 0.8 / len(platforms)  # the width of the bars
+        width = 0.8 / len(metric_platforms)  # the width of the bars
 
         fig, ax = plt.subplots(figsize=(12, 6))  # Adjust figure size as needed
 
-        for i, platform in enumerate(platforms):
+        for i, platform in enumerate(metric_platforms):
             values = [data[metric][size].get(platform, 0) for size in dataset_sizes]
-            offset = (i - len(platforms) / 2 + 0.5) * width
+            offset = (i - len(metric_platforms) / 2 + 0.5) * width
             rects = ax.bar(x + offset, values, width, label=platform)
             ax.bar_label(rects, padding=3, fontsize=8)
 
@@ -73,32 +99,33 @@ def plot_grouped_bar_comparisons(data, metrics, dataset_sizes, platforms, save_p
 
 def create_csv(file_name, data):
     """Generates a CSV file with training metrics for each platform and dataset size."""
-    headers = ['Platform', 'Dataset Size', 'Training Time (ms)', 'Inference Time (ms)', 'Accuracy', 'Loss']
+    headers = ['Platform', 'Dataset Size', 'Training Time (ms)', 'Inference Time (ms)', 'Accuracy', 'Loss', 'Peak RSS (MB)']
     with open(file_name, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(headers)
 
         dataset_sizes_order = ['10%', '50%', '100%']
         for dataset_size in dataset_sizes_order:
-            if dataset_size in data['training_time']:  # Check if the dataset size exists in the data
-                training_times = data['training_time'][dataset_size]
-                for platform, training_time in training_times.items():
+            if dataset_size in data['accuracy']:  # Check if the dataset size exists in the data
+                for platform in data['accuracy'][dataset_size]:
+                    training_time = data['training_time'].get(dataset_size, {}).get(platform, '')  # not for inference variants
                     inference_time = data['inference_time'][dataset_size][platform]
                     accuracy = data['accuracy'][dataset_size][platform]
                     loss = data['loss'][dataset_size][platform]
-                    writer.writerow([platform, dataset_size, training_time, inference_time, accuracy, loss])
+                    peak_rss = data.get('peak_rss', {}).get(dataset_size, {}).get(platform, '')  # Python platform only
+                    writer.writerow([platform, dataset_size, training_time, inference_time, accuracy, loss, peak_rss])
 
 
 def process_json_files(root_folder):
     """Processes JSON files in the root folder, extracts metrics, and generates plots and CSV."""
-    metrics = ["training_time", "inference_time", "loss", "accuracy"]
+    metrics = ["training_time", "inference_time", "loss", "accuracy", "peak_rss"]
     platform_folders = [f for f in os.listdir(root_folder) if os.path.isdir(os.path.join(root_folder, f))]
-    predefined_platforms = ["python_gpu", "rust_wasm_cpu", "tensorflow_js_cpu", "tensorflow_js_webgpu", "tensorflow_js_wasm"]
+    predefined_platforms = ["python_gpu", "python_xla", "python_tflite", "python_tflite_int8", "rust_wasm_cpu", "tensorflow_js_cpu", "tensorflow_js_webgpu", "tensorflow_js_wasm"]
 
     # Retrieve dataset sizes from the first platform folder
     first_platform_folder = os.path.join(root_folder, platform_folders[0])
     json_files = [re.search(r'(\d+%)', f.name).group(1) for f in Path(first_platform_folder).iterdir()
-                  if f.is_file() and f.suffix == '.json' and f.stem.endswith(('10%', '50%', '100%'))]
+                  if f.is_file() and artifacts.is_json(f.name) and artifacts.logical_name(f.name)[:-len('.json')].endswith(('10%', '50%', '100%'))]
     dataset_sizes = sorted(json_files, key=lambda x: int(x.replace('%', '')))  # Sort dataset sizes
     platforms = sorted(platform_folders, key=lambda x: predefined_platforms.index(x) if x in predefined_platforms else len(predefined_platforms))
 
@@ -109,13 +136,13 @@ def process_json_files(root_folder):
         framework_path = os.path.join(root_folder, framework_folder)
         if os.path.isdir(framework_path):
             for json_file in os.listdir(framework_path):
-                if json_file.endswith(('.json')):
+                if artifacts.is_json(json_file):  # result.json, result.json.gz or result.json.zst
                     file_path = os.path.join(framework_path, json_file)
+                    json_file = artifacts.logical_name(json_file)
                     try:
-                        with open(file_path, 'r') as f:
-                            data = json.load(f)
+                        data = artifacts.read_json(file_path)
 
-                        match = re.match(r"([a-zA-Z0-9_]+)_sample_(\d+)%.json", os.path.basename(file_path).replace("nn_mnist_", "")) 
+                        match = re.match(r"([a-zA-Z0-9_]+)_sample_(\d+)%\.json$", json_file.replace("nn_mnist_", ""))
                         platform = match.group(1)
                         percentage = match.group(2) + "%"
 
@@ -129,10 +156,13 @@ def process_json_files(root_folder):
                         accuracy_values = data.get('accuracy_values')
                         val_loss_values = data.get('val_loss_values')
                         val_accuracy_values = data.get('val_accuracy_values')
-                        metric_data["training_time"][percentage][platform] = round(data.get('training_time_ms') / 1000, 4)
+                        if data.get('training_time_ms') is not None:  # inference variants share python_gpu's training
+                            metric_data["training_time"][percentage][platform] = round(data.get('training_time_ms') / 1000, 4)
                         metric_data["inference_time"][percentage][platform] = round(data.get('inference_time_ms') / 1000, 4)
                         metric_data["accuracy"][percentage][platform] = data.get('accuracy')
                         metric_data["loss"][percentage][platform] = data.get('loss') 
+                        if data.get('peak_rss_mb') is not None:
+                            metric_data["peak_rss"][percentage][platform] = round(data.get('peak_rss_mb'), 2)
                         # print(loss_values)
                         # print(accuracy_values)
                         # print(val_loss_values)
@@ -148,8 +178,9 @@ def process_json_files(root_folder):
                                 plot_filename = os.path.splitext(json_file)[0].replace("nn_mnist_", "")
                                 save_path = os.path.join(framework_path, plot_filename)
 
-                                plot_loss(platform + " sample " + percentage, loss_values, val_loss_values, save_path + "_loss.png")
-                                plot_accuracy(platform + " sample " + percentage, accuracy_values, val_accuracy_values, save_path + "_accuracy.png")
+                                plot_loss(platform + " sample " + percentage, loss_values, val_loss_values, save_path + "_loss.png", data.get('convergence'), data.get('val_epochs'),
+                                          timeline.load(file_path, data))
+                                plot_accuracy(platform + " sample " + percentage, accuracy_values, val_accuracy_values, save_path + "_accuracy.png", data.get('convergence'), data.get('val_epochs'))
                             else:
                                 print(f"Warning: loss_values, accuracy_values, val_loss_values, or val_accuracy_values in {file_path} are not valid lists of numbers.")
 
@@ -163,7 +194,9 @@ def process_json_files(root_folder):
                     except Exception as e:
                         print(f"An unexpected error occurred while processing {file_path}: {e}")
     
-    plot_grouped_bar_comparisons(metric_data, metrics, dataset_sizes, platforms, root_folder)
+    # Skip metrics no platform reported (e.g. peak_rss when only browser results exist)
+    plotted_metrics = [metric for metric in metrics if any(metric_data.get(metric, {}).values())]
+    plot_grouped_bar_comparisons(metric_data, plotted_metrics, dataset_sizes, platforms, root_folder)
     create_csv(os.path.join(root_folder, "metric.csv"), metric_data)
     return metric_data
 
@@ -188,8 +221,8 @@ def calculate_confidence_interval(data, confidence=0.95):
     return ci_lower, ci_upper
 
 def save_confidence_interval(data, location): 
-    # List of metrics (training_time, inference_time, mse, r2)
-    metrics = ["training_time", "inference_time", "loss", "accuracy"]
+    # List of metrics (training_time, inference_time, loss, accuracy, peak_rss)
+    metrics = ["training_time", "inference_time", "loss", "accuracy", "peak_rss"]
     
     # Store results in a hierarchical JSON format
     json_data = {}
@@ -199,7 +232,7 @@ def save_confidence_interval(data, location):
         print(f"Metric: {metric}")
         
         # Get the percentages available for the metric (e.g., "10%", "50%")
-        percentages = list(data[metric].keys())  # get the percentages (keys under each metric)
+        percentages = list(data.get(metric, {}).keys())  # get the percentages (keys under each metric)
         
         for percentage in percentages:
             # Get the platforms for the current percentage (e.g., tensorflow_js_webgpu)
@@ -220,7 +253,8 @@ def save_confidence_interval(data, location):
                         "training_time": {},
                         "inference_time": {},
                         "loss": {},
-                        "accuracy": {}
+                        "accuracy": {},
+                        "peak_rss": {}
                     }
                 
                 # Add the confidence interval for the current metric
@@ -244,6 +278,11 @@ def save_confidence_interval(data, location):
                         "ci_lower": ci_lower,
                         "ci_upper": ci_upper
                     }
+                elif metric == "peak_rss":
+                    json_data[platform][percentage]["peak_rss"] = {
+                        "ci_lower": ci_lower,
+                        "ci_upper": ci_upper
+                    }
 
     # Print the resulting JSON
     json_string = json.dumps(json_data, indent=4)
@@ -255,7 +294,7 @@ def plot(result_item_id, tries):
     Runs the process_json_files function multiple times based on the number of tries.
     """
     result_item_location = 'neural_network/training_result/' + str(result_item_id)
-    metrics = ["training_time", "inference_time", "loss", "accuracy"] 
+    metrics = ["training_time", "inference_time", "loss", "accuracy", "peak_rss"] 
     metric_results = {}
     for i in range(tries): 
         data = process_json_files(result_item_location + '/' + str(i+1))
@@ -6,13 +6,32 @@ import socketserver
 import json
 import os
 import socket
+import threading
+import time
+import shutil
+import sqlite3
+import tempfile
 import rarfile
 from datetime import datetime, timedelta, timezone
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, unquote
 from linear_regression.app.python import linear_regression
 from linear_regression.plot import linear_regression_plot
 from neural_network.app.python import neural_network
 from neural_network.plot import neural_network_plot
+from common import runtime
+from common import memory
+from common import serving
+from common import convergence
+from common import search
+from common import progress
+from common import artifacts
+from common import analytics
+from common import datasets
+from common import uploads
+from common import observability
+from common import validation
+from common import timeline
+from common import retention
 
 def extract_if_not_exists(target_file, rar_path):
     if os.path.exists(target_file):
@@ -24,10 +43,57 @@ def extract_if_not_exists(target_file, rar_path):
         rf.extractall(path=os.path.dirname(rar_path))
         print("Extraction complete.")
 
-# this extract a rar which is big for github to have as a raw file
-extract_if_not_exists('neural_network/datasets/mnist_train_images.json', 'neural_network/datasets/mnist_train_images.rar')
+# Requests are handled on separate threads (e.g. model serving while a run is in progress), so
+# result_list.json updates are serialized, and Python runs execute one at a time to keep timings comparable
+result_list_lock = threading.RLock()
+training_lock = threading.Lock()
+
+# The API endpoints of the handler below, used as route labels of the request metrics
+API_ROUTES = ('/api/new_result_item', '/api/run_python', '/api/plot_linear_regression', '/api/plot_neural_network',
+              '/api/metrics', '/api/thread_scaling', '/api/search', '/api/progress', '/api/abort', '/api/query',
+              '/api/save_json_object', '/api/append_experiment', '/api/update_result_item')
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler): 
+    # Every request is timed from its request line to the end of its response and recorded per route,
+    # with its status and the bytes written to the client (see common/observability.py)
+    def setup(self):
+        super().setup()
+        self.wfile = observability.CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        self.request_start = None
+        failed = False
+        try:
+            super().handle_one_request()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.request_start is not None:
+                self.record_request(failed)
+
+    def parse_request(self):
+        self.request_start = time.perf_counter()
+        self.request_bytes_start = self.wfile.count
+        self.status_code = None
+        observability.registry.request_started()
+        return super().parse_request()
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def record_request(self, failed):
+        duration = time.perf_counter() - self.request_start
+        path = getattr(self, 'path', '')
+        status = self.status_code or (500 if failed else 0)
+        bytes_sent = self.wfile.count - self.request_bytes_start
+        route = observability.route_of(path, API_ROUTES)
+        observability.registry.request_finished(route, observability.method_of(self.command), status, duration, bytes_sent)
+        observability.log_access({'client': self.client_address[0], 'method': self.command, 'path': path,
+                                  'route': route, 'status': status, 'duration_ms': duration * 1000,
+                                  'bytes': bytes_sent})
+
     # Handle GET requests
     def do_GET(self):
         parsed_path = urlparse(self.path)
@@ -40,7 +106,19 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.plot_linear_regression()  # Plot linear regression
         elif parsed_path.path == '/api/plot_neural_network':
             self.plot_neural_network()  # Plot neural network
-        else:
+        elif parsed_path.path == '/api/metrics':
+            self.send_metrics()  # Request metrics (Prometheus text), or memory and serving stats with format=json
+        elif parsed_path.path == '/api/thread_scaling':
+            self.thread_scaling()  # Benchmark Python training across thread counts
+        elif parsed_path.path == '/api/search':
+            self.search()  # Hyperparameter search over the Python trainers
+        elif parsed_path.path == '/api/progress':
+            self.stream_progress()  # Server-Sent Events with the epochs of a Python run
+        elif parsed_path.path == '/api/abort':
+            self.abort()  # Stop a Python run after its current batch
+        elif parsed_path.path == '/api/query':
+            self.query()  # Aggregated metrics across sweeps
+        elif not self.serve_artifact():
             super().do_GET()  # Default behavior for other GET requests
 
     # Handle POST requests
@@ -51,6 +129,8 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.append_experiment()  # Append experiment to result list
         elif self.path == '/api/update_result_item':
             self.update_result_item()  # Update result item information
+        elif self.path.startswith('/api/predict/'):
+            self.predict()  # Predict with a served model
         else:
             self.send_response(404)
             self.end_headers()
@@ -62,30 +142,95 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         directory = os.path.dirname(location)
 
         # Only try to create the directory if it's not empty (i.e., not just a filename)
-        if directory and not os.path.exists(directory):
-            os.makedirs(directory)
+        if directory:
+            os.makedirs(directory, exist_ok=True)  # another request may create it at the same time
 
-        # Save the JSON file
-        with open(location, 'w') as file:
-            json.dump(data, file, indent=4)
+        # Save the JSON file to a temporary file of its own and rename it, so readers never see a partial
+        # file and concurrent saves of the same location do not write into each other's temporary file
+        fd, tmp_location = tempfile.mkstemp(dir=directory or '.', prefix='.' + os.path.basename(location), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(data, file, indent=4)
+            os.chmod(tmp_location, 0o644)
+            os.replace(tmp_location, location)
+        except BaseException:
+            os.unlink(tmp_location)
+            raise
+
+    # Serve a result stored compressed (result.json.gz / .zst) when result.json is requested, and
+    # files of sweeps whose raw artifacts were moved into their archive (see common/retention.py)
+    # A compressed result is sent as is when the client accepts its encoding, otherwise decompressed
+    def serve_artifact(self):
+        path = self.translate_path(self.path)
+        if os.path.exists(path):
+            return False
+        json_variants = artifacts.is_json(path) and artifacts.compression_of(path) == 'none'
+        found, archived = None, None
+        for candidate in (artifacts.variants(path) if json_variants else [path]):
+            if os.path.exists(candidate):
+                found = candidate
+                break
+            archived = retention.locate(os.path.relpath(candidate, self.directory))
+            if archived:
+                found = candidate
+                break
+        if found is None:
+            return False
+
+        def open_found():
+            return retention.open_member(archived[0], archived[1]) if archived else open(found, 'rb')
+
+        compression = artifacts.compression_of(found) if json_variants else 'none'
+        encoding = artifacts.CONTENT_ENCODINGS.get(compression)
+        accepted = [value.split(';')[0].strip() for value in self.headers.get('Accept-Encoding', '').split(',')]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if json_variants else self.guess_type(path))
+        if encoding is None or encoding in accepted:
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(archived[2] if archived else os.path.getsize(found)))
+            self.end_headers()
+            with open_found() as file:
+                shutil.copyfileobj(file, self.wfile)
+        else:
+            self.end_headers()
+            self.close_connection = True  # length unknown until decompressed
+            with artifacts.decompressing_reader(open_found(), compression, found) as file:
+                shutil.copyfileobj(file, self.wfile)
+        return True
+
+    # Read a JSON request body, streamed to a temporary file first (see common/uploads.py)
+    # Sends 413 or 400 and returns None when the body is too large or not valid (gzip) JSON
+    # Returns (data, spooled arrays), or (None, None) after answering 413 or 400
+    def read_json_body(self):
+        try:
+            return uploads.read_body(self.rfile, self.headers)
+        except uploads.BodyTooLarge as e:
+            self.close_connection = True  # the rest of the body is not read
+            status = 413
+            error = str(e)
+        except (uploads.BadBody, ValueError) as e:
+            status = 400
+            error = str(e)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps({'error': error}).encode('utf-8'))
+        return None, None
 
     # Save the JSON object from the request body
+    # Its large numeric arrays are stored as .npy files next to the location
     def save_json_object(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
+        data, spooled = self.read_json_body()
+        if data is None:
+            return
         try:
-            data = json.loads(post_data) 
             location = data['location']
-            jsonObject = data['jsonObject']
-           
-            self.save_json_file(location, jsonObject)
-            self.response({})
-
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(b'{"error": "Invalid JSON"}')
+            jsonObject = artifacts.externalize_arrays(location, data['jsonObject'], spooled=spooled)
+        finally:
+            uploads.discard(spooled)
+        self.save_json_file(location, jsonObject)
+        self.response({})
 
     # Plot the linear regression graph based on query parameters
     def plot_linear_regression(self):
@@ -93,6 +238,7 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         query_params = parse_qs(parsed_path.query)
         id = query_params.get('id', [None])[0]
         tries = query_params.get('tries', [None])[0]
+        retention.ensure_hot('linear_regression', int(id))  # an archived sweep is extracted again
         linear_regression_plot.plot(int(id), int(tries))
         self.response({})
     
@@ -102,6 +248,7 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         query_params = parse_qs(parsed_path.query)
         id = query_params.get('id', [None])[0]
         tries = query_params.get('tries', [None])[0]
+        retention.ensure_hot('neural_network', int(id))  # an archived sweep is extracted again
         neural_network_plot.plot(int(id), int(tries))
         self.response({})
     
@@ -122,17 +269,206 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         type = query_params.get('type', [None])[0]
         retry = query_params.get('try', [None])[0]
         sample = query_params.get('sample', [None])[0]
-        dataset = int(query_params.get('dataset', [None])[0])
+        dataset = int(query_params.get('dataset', [0])[0])  # 0: derive the split from sample, e.g. 25%
         result_item_id = int(query_params.get('result_item_id', [None])[0])
+        dtype = query_params.get('dtype', [None])[0]  # float32 (default), float64, bfloat16, mixed_bfloat16, mixed_float16
+        # Optional intra_op_threads, inter_op_threads, omp_threads and cpu_affinity (e.g. 0-3)
+        run_config = runtime.run_config_from_query(query_params)
+        # trace_memory=true adds tracemalloc top allocations per phase (slows the run down)
+        trace_allocations = query_params.get('trace_memory', ['false'])[0] == 'true'
+        # Early stopping with any of monitor, tolerance, patience, max_epochs, time_budget_ms
+        convergence_policy = convergence.policy_from_query(query_params)
+        # Optional learning_rate, batch_size, hidden_units (neural network) and epochs
+        hyperparameters = search.hyperparameters_from_query(query_params)
+        # features=area,zip_code (or all) trains the linear regression on several features, one-hot
+        # encoding categorical=zip_code into a sparse matrix
+        feature_columns = query_params.get('features', [None])[0]
+        feature_columns = feature_columns.split(',') if feature_columns else None
+        categorical_columns = query_params.get('categorical', [''])[0].split(',') if query_params.get('categorical') else None
+        # variants=true also benchmarks the neural network as XLA, TFLite and int8 TFLite platforms
+        inference_variants = query_params.get('variants', ['false'])[0] == 'true'
+        # Neural network validation cadence: validation_freq, validation_subset, validation_seed, reuse_validation=true
+        validation_config = validation.config_from_query(query_params)
+        # Epochs are streamed at /api/progress?job_id=...; pass a job_id to subscribe before the run starts
+        try:
+            job = progress.jobs.create(query_params.get('job_id', [None])[0])
+        except ValueError as e:  # a run with this job_id is still running
+            self.send_response(409)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+            return
+        job.publish('queued', {'type': type, 'sample': sample, 'try': retry})
  
-        if(type == 'Linear Regression Python GPU'):
-            data = linear_regression.process(dataset, retry, sample, result_item_id)
-        else :
-            data = neural_network.process(dataset, retry, sample, result_item_id)
+        try:
+            with observability.registry.queued_on(training_lock):
+                job.publish('started')
+                if(type == 'Linear Regression Python GPU'):
+                    data = linear_regression.process(dataset, retry, sample, result_item_id, dtype, run_config, trace_allocations,
+                                                     convergence_policy=convergence_policy, hyperparameters=hyperparameters, progress_job=job,
+                                                     feature_columns=feature_columns, categorical_columns=categorical_columns)
+                    model = 'linear_regression'
+                else :
+                    data = neural_network.process(dataset, retry, sample, result_item_id, dtype, run_config, trace_allocations,
+                                                  convergence_policy=convergence_policy, hyperparameters=hyperparameters, progress_job=job,
+                                                  inference_variants=inference_variants, validation_config=validation_config)
+                    model = 'neural_network'
+        except Exception as e:
+            job.finish('error', {'error': repr(e)})
+            raise
+        data['experiment']['job_id'] = job.job_id
+
+        # The latest trained model of each type is served at /api/predict/<model>
+        if data['experiment'].get('model_path'):
+            serving.registry.register(model, data['experiment']['model_path'])
 
         self.append_experiment_to_result_list(data)
+        for variant in data.get('variants', []):
+            self.append_experiment_to_result_list(variant)
+        job.finish('end', {'result_path': data['experiment']['result_path'],
+                           'training_time_ms': data['results']['training_time_ms'],
+                           'convergence': data['results'].get('convergence')})
 
-        self.response({})
+        self.response({'job_id': job.job_id})
+
+    # Stream the progress events of a Python run as Server-Sent Events
+    # Reconnecting clients send Last-Event-ID (or ?last_event_id=) and get the events they missed
+    # from the job's ring buffer; the stream ends after the run's end or error event, or with an error
+    # event when no run claims the job within progress.CLAIM_TIMEOUT seconds
+    def stream_progress(self):
+        query_params = parse_qs(urlparse(self.path).query)
+        job_id = query_params.get('job_id', [None])[0]
+        if not job_id:
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Expected a job_id"}')
+            return
+        try:
+            last_id = int(self.headers.get('Last-Event-ID') or query_params.get('last_event_id', [0])[0])
+        except ValueError:
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Last-Event-ID must be an integer"}')
+            return
+        job = progress.jobs.get(job_id, create=True)  # the run may not have started yet
+        if job is None:
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Too many subscriptions are waiting for a run"}')
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "keep-alive")
+        self.end_headers()
+        self.close_connection = True  # the stream has no length, it ends when the connection closes
+        try:
+            while True:
+                events = job.events_after(last_id, timeout=15)
+                for event_id, event, data in events:
+                    self.wfile.write(progress.format_event(event_id, event, data))
+                    last_id = event_id
+                if not events and not job.expire_unclaimed():
+                    self.wfile.write(b": keepalive\n\n")  # keeps proxies from closing an idle stream
+                self.wfile.flush()
+                if job.done and not job.events_after(last_id, timeout=0):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away
+
+    # Request that a Python run stops; it ends after its current batch with stop_reason "aborted"
+    def abort(self):
+        query_params = parse_qs(urlparse(self.path).query)
+        job = progress.jobs.get(query_params.get('job_id', [None])[0])
+        if job is None:
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Job not found"}')
+            return
+        job.request_abort()
+        self.response({'job_id': job.job_id, 'abort_requested': True, 'done': job.done})
+
+    # Run the thread-scaling benchmark (1, 2, 4 ... N threads), each count in its own process
+    def thread_scaling(self):
+        parsed_path = urlparse(self.path)
+        query_params = parse_qs(parsed_path.query)
+        type = query_params.get('type', [None])[0]
+        sample = query_params.get('sample', ['10%'])[0]
+        dataset = int(query_params.get('dataset', [0])[0])
+        tries = int(query_params.get('tries', [1])[0])
+        max_threads = query_params.get('max_threads', [None])[0]
+        dtype = query_params.get('dtype', [None])[0]
+
+        model = 'linear_regression' if type == 'Linear Regression Python GPU' else 'neural_network'
+        thread_counts = runtime.default_thread_counts(int(max_threads) if max_threads else None)
+        # Holds the training slot for the whole sweep, so no run or search overlaps it and skews either's timings
+        with observability.registry.queued_on(training_lock):
+            result = runtime.thread_scaling(model, dataset, sample, thread_counts, tries, dtype)
+
+        self.response(result)
+
+    # Run a hyperparameter search (grid, random, halving or hyperband) on a process pool
+    # Trials and the best config per sample are saved under <model>/training_result (see common/search.py)
+    def search(self):
+        parsed_path = urlparse(self.path)
+        query_params = parse_qs(parsed_path.query)
+        type = query_params.get('type', [None])[0]
+        sample = query_params.get('sample', ['10%'])[0]
+        strategy = query_params.get('strategy', ['halving'])[0]
+        space = query_params.get('space', [None])[0]  # JSON, defaults to search.DEFAULT_SPACES
+        def optional_int(name):
+            value = query_params.get(name, [None])[0]
+            return int(value) if value else None
+
+        model = 'linear_regression' if type == 'Linear Regression Python GPU' else 'neural_network'
+        with observability.registry.queued_on(training_lock):
+            record = search.run_search(model, sample, strategy, json.loads(space) if space else None,
+                                       optional_int('trials'), optional_int('workers'), optional_int('min_epochs'),
+                                       optional_int('max_epochs'), optional_int('eta') or 3, optional_int('seed'),
+                                       query_params.get('dtype', [None])[0], convergence.policy_from_query(query_params))
+
+        self.response({'search_path': record['search_path'], 'objective': record['objective'],
+                       'trial_count': record['trial_count'], 'leaderboard': record['leaderboard'][:10]})
+
+    # Predict with a served model: POST /api/predict/<model> with {"inputs": [[...], ...]}
+    # <model> is linear_regression or neural_network (latest run) or <model>/<result_item_id>/<try>/<sample>
+    # Concurrent requests are coalesced into micro-batches (see common/serving.py)
+    def predict(self):
+        name = unquote(urlparse(self.path).path[len('/api/predict/'):])
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        try:
+            inputs = json.loads(body)['inputs']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Expected a JSON body with inputs"}')
+            return
+        try:
+            batcher = serving.registry.get(name)
+        except KeyError:
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": "Model not found"}')
+            return
+
+        start_time = time.perf_counter()
+        try:
+            predictions = batcher.predict(inputs)
+        except (ValueError, serving.Unavailable) as e:
+            self.send_response(503 if isinstance(e, serving.Unavailable) else 400)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+            return
+        self.response({'predictions': predictions.tolist(), 'latency_ms': (time.perf_counter() - start_time) * 1000})
 
     # Send a JSON response back to the client
     def response(self, response_obj):
@@ -146,72 +482,130 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
     # Create a new result item and append it to the result list
     def new_result_item(self):
-        data = self.get_result_list()
-        sorted_data = sorted(data, key=lambda x: x['id'])
-        if sorted_data:
-            last_id = sorted_data[-1]['id']
-            new_id = last_id + 1
-        else:
-            new_id = 1
+        with result_list_lock:
+            data = self.get_result_list()
+            sorted_data = sorted(data, key=lambda x: x['id'])
+            if sorted_data:
+                last_id = sorted_data[-1]['id']
+                new_id = last_id + 1
+            else:
+                new_id = 1
 
-        parsed_path = urlparse(self.path)
-        query_params = parse_qs(parsed_path.query)
+            parsed_path = urlparse(self.path)
+            query_params = parse_qs(parsed_path.query)
 
-        new_item = {'id': new_id, 'tries': int(query_params.get('tries', [None])[0]), "isRunAll": query_params.get('isRunAll', [None])[0], "start": query_params.get('start', [None])[0],  'experiments': []}
-        data.append(new_item)
-        self.save_json_file('result_list.json', data)
+            new_item = {'id': new_id, 'tries': int(query_params.get('tries', [None])[0]), "isRunAll": query_params.get('isRunAll', [None])[0], "start": query_params.get('start', [None])[0],  'experiments': []}
+            data.append(new_item)
+            self.save_json_file('result_list.json', data)
+
+        # Older sweeps are packed into their archives in the background (see common/retention.py)
+        retention.apply_policy_in_background()
         return new_item
 
+    # Memory of the server process and of the most recent Python experiments
+    def metrics(self):
+        return {'process': memory.process_memory(), 'experiments': list(memory.recent_experiments),
+                'serving': serving.registry.stats(), 'shared_datasets': datasets.pool.stats(),
+                'http': observability.registry.snapshot()}
+
+    # /api/metrics in the Prometheus text format; /api/metrics?format=json returns metrics() instead
+    def send_metrics(self):
+        query_params = parse_qs(urlparse(self.path).query)
+        if query_params.get('format', [None])[0] == 'json':
+            self.response(self.metrics())
+            return
+        process = memory.process_memory()
+        body = observability.registry.render({
+            'process_resident_memory_bytes': int(process['rss_mb'] * 2**20),
+            'process_peak_resident_memory_bytes': int(process['peak_rss_mb'] * 2**20),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     # Append the experiment data to the result list
-    def append_experiment_to_result_list(self, data):
+    # Large per-row arrays of the results (features, predictions ...) are stored as .npy files next to them
+    # spooled lists the arrays uploaded with data (see common/uploads.py)
+    def append_experiment_to_result_list(self, data, spooled=()):
         experiment = data['experiment'];
-        self.save_json_file(experiment['result_path'], data['results'])
+        # The resource timeline of a Python run is saved as <result>.timeline.npz next to the result
+        timeline_arrays = data.pop('timeline', None)
+        if timeline_arrays is not None and (data['results'].get('timeline') or {}).get('samples'):
+            path = timeline.save(timeline.timeline_path(artifacts.logical_name(experiment['result_path'])), timeline_arrays)
+            data['results']['timeline']['path'] = os.path.basename(path)
+        if 'memory' in experiment:
+            # Python experiments also record the memory used to write their results
+            profiler = memory.MemoryProfiler(experiment['memory'].get('trace_allocations', False))
+            with profiler.phase('write'):
+                results = artifacts.externalize_arrays(experiment['result_path'], data['results'], spooled=spooled)
+                artifacts.write_json(experiment['result_path'], results)
+            experiment['memory']['phases']['write'] = profiler.phases['write']
+            memory.recent_experiments.append({'title': experiment['title'], 'try': experiment['try'],
+                                              'result_item_id': experiment['result_item_id'], 'memory': experiment['memory']})
+        else:
+            results = artifacts.externalize_arrays(experiment['result_path'], data['results'], spooled=spooled)
+            artifacts.write_json(experiment['result_path'], results)
 
-        result_list = self.get_result_list()
-        for item in result_list:
-            if item.get('id') == experiment['result_item_id']:
-                if 'experiments' in item and isinstance(item['experiments'], list):
-                    item['experiments'].append(experiment)
-                else:
-                    item['experiments'] = [experiment]
-                break 
+        with result_list_lock:
+            result_list = self.get_result_list()
+            for item in result_list:
+                if item.get('id') == experiment['result_item_id']:
+                    if 'experiments' in item and isinstance(item['experiments'], list):
+                        item['experiments'].append(experiment)
+                    else:
+                        item['experiments'] = [experiment]
+                    break 
 
-        self.save_json_file("result_list.json", result_list)
+            self.save_json_file("result_list.json", result_list)
 
-    # Append experiment data (received in the request) to the result list
-    def append_experiment(self):
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
+        # Keep the analytics table in step with the result list
         try:
-            data = json.loads(body) 
-            self.append_experiment_to_result_list(data)
- 
-            self.response({})
-        except json.JSONDecodeError:
+            analytics.ingest(experiment, results)
+        except sqlite3.Error as e:
+            print(f"Warning: could not add the experiment to {analytics.DB_PATH}: {e}")
+
+    # Aggregate metrics across sweeps, e.g. /api/query?group_by=platform,sample&metrics=training_time_ms&agg=avg&last=5
+    # Any dimension (model, platform, sample, dtype ...) can be given as a filter; see common/analytics.py
+    def query(self):
+        query_params = parse_qs(urlparse(self.path).query)
+        try:
+            rows = analytics.query_from_params(query_params)
+        except ValueError as e:
             self.send_response(400)
+            self.send_header("Content-Type", "application/json")
             self.end_headers()
-            self.wfile.write(b"Invalid JSON")
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+            return
+        self.response({'rows': rows})
+
+    # Append experiment data (received in the request) to the result list
+    def append_experiment(self):
+        data, spooled = self.read_json_body()
+        if data is None:
             return
+        try:
+            self.append_experiment_to_result_list(data, spooled)
+        finally:
+            uploads.discard(spooled)  # those not moved next to the result
+        self.response({})
         
     # Update the result item with new start and end timestamps
     def update_result_item(self): 
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        try:
-            data = json.loads(body) 
+        data, spooled = self.read_json_body()
+        if data is None:
+            return
+        uploads.discard(spooled)
+
+        with result_list_lock:
             result_list = self.get_result_list()
             for item in result_list:
                 if item.get('id') == data['result_item_id']:
                     item['end'] = data['end'];
                     break 
-            self.response({})
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b"Invalid JSON")
-            return
- 
-        self.save_json_file("result_list.json", result_list)
+            self.save_json_file("result_list.json", result_list)
+        self.response({})
 
 
     def end_headers(self):
@@ -238,7 +632,8 @@ def start_server(handler, port=8001, max_retries=5):
     retries = 0
     while retries < max_retries:
         try:
-            with socketserver.TCPServer(("", port), handler) as httpd:
+            with socketserver.ThreadingTCPServer(("", port), handler) as httpd:
+                httpd.daemon_threads = True
                 print(f"Serving at port {port}")
                 httpd.serve_forever()
                 return  # Successfully started the server
@@ -252,5 +647,11 @@ def start_server(handler, port=8001, max_retries=5):
     return None
 
 
-# Start the server on port 8001
-start_server(MyHTTPRequestHandler, port=8001)
\ No newline at end of file
+# Only when run as a script: the search pool spawns its workers by re-importing this module as __mp_main__,
+# and they must not extract the dataset again or start servers of their own
+if __name__ == '__main__':
+    # this extract a rar which is big for github to have as a raw file
+    extract_if_not_exists('neural_network/datasets/mnist_train_images.json', 'neural_network/datasets/mnist_train_images.rar')
+
+    # Start the server on port 8001
+    start_server(MyHTTPRequestHandler, port=8001)